@@ -1,13 +1,26 @@
-from flask import Flask, render_template, jsonify, request
-from datetime import datetime
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context, g
+from datetime import datetime, timedelta
 import time
 import threading
-import webview
 import json
 import os
 import sys
 import uuid
-import subprocess
+import queue
+import copy
+import zipfile
+
+from dispatcher import Dispatcher, QueueFullError
+from job_store import JobStore
+from events import bus, format_sse
+import chat_store
+from chat_catalog import ChatCatalog
+from config_cache import CachedFile, make_etag
+from search_index import SearchIndex
+from archive import ChatArchive
+import chat_transfer
+import storage
+import metrics
 
 app = Flask(__name__)
 
@@ -17,26 +30,85 @@ DEVLOG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'devlog.html')
 DEFAULT_SETTINGS = {
     "fullscreen": False,
     "theme": "blue",
+    "max_workers": 4,
+    "queue_size": 32,
+    "response_cache": False,
+    "archive_days": 30,
+    "hedge_requests": False,
     "models": [
         {"id": 1, "name": "Qwen: Qwen3 Coder", "url": "qwen/qwen3-coder:free"},
         {"id": 2, "name": "DeepSeek: Deepseek R1 0528 Qwen3 8B", "url": "deepseek/deepseek-r1-0528-qwen3-8b:free"},
     ]
 }
 
-CHATS_DIR = 'chats'
-if not os.path.exists(CHATS_DIR):
-    os.makedirs(CHATS_DIR)
+
+# Интервал keep-alive комментариев в потоке событий чата (секунды)
+EVENTS_KEEPALIVE = 15
+# Сколько последних сообщений сверяется с клиентом при подключении к потоку событий
+EVENTS_SYNC_LIMIT = 50
+
+# Страница сообщений (/api/chats/<id>/messages): наибольший limit и поля,
+# которые клиент может попросить не присылать
+MAX_MESSAGES_PAGE = 500
+OMITTABLE_FIELDS = {'reasoning'}
+# Наибольший limit поиска (/api/search)
+MAX_SEARCH_HITS = 100
+# Поля чата, которые можно изменить через PATCH /api/chats/<id>
+HEADER_FIELDS = {'title', 'model', 'system_prompt', 'reasoning_len'}
 
 CONFIG_DIR = 'config'
 if not os.path.exists(CONFIG_DIR):
     os.makedirs(CONFIG_DIR)
 
-def get_app_version():
-    """Получение версии приложения из файла VERSION.txt"""
-    version_file_path = os.path.join(os.path.dirname(__file__), 'VERSION.txt')
+JOBS_DB_PATH = os.path.join(CONFIG_DIR, 'jobs.db')
+# Позиция в ленте изменений общего хранилища, до которой обновлены каталог и поиск
+SYNC_CURSOR_PATH = os.path.join(chat_store.CHATS_DIR, 'changes.cursor')
+
+# Архив давно не менявшихся чатов: подключается до первого чтения чатов.
+# Архив - локальные файлы, поэтому с общим хранилищем (SYNEDRION_STORAGE) он выключен
+chat_archive = None
+if not chat_store.is_shared():
+    chat_archive = ChatArchive(os.path.join(chat_store.CHATS_DIR, 'archive'))
+    chat_store.set_archive(chat_archive)
+
+# Каталог чатов для списка: обновляется при каждой записи в журнал чата
+catalog = ChatCatalog(os.path.join(chat_store.CHATS_DIR, 'catalog.db'))
+chat_store.add_listener(catalog.on_change)
+
+# Полнотекстовый поиск: индекс тоже обновляется из записей журнала чатов
+search_index = SearchIndex(os.path.join(chat_store.CHATS_DIR, 'search.db'))
+chat_store.add_listener(search_index.on_change)
+
+def rebuild_search_in_background():
+    # Первое построение по всем чатам может быть долгим - не задерживаем запуск
+    threading.Thread(target=search_index.rebuild, name="search-rebuild", daemon=True).start()
+
+def rebuild_indexes():
+    """Каталог и поиск заново: экземпляр пропустил часть ленты изменений"""
+    catalog.rebuild()
+    rebuild_search_in_background()
+
+def forward_remote_change(op, chat_id, record):
+    """Сообщения, записанные другими экземплярами, - в потоки событий этого"""
+    if op == 'put':
+        bus.publish(chat_id, 'message', record['message'])
+    elif op == 'del':
+        bus.publish(chat_id, 'removed', {'id': record.get('id')})
+
+if chat_store.is_shared():
+    chat_store.add_listener(forward_remote_change, remote_only=True)
+    chat_store.start_sync(SYNC_CURSOR_PATH, on_gap=rebuild_indexes)
+else:
+    if catalog.count() == 0:
+        catalog.rebuild()
+    if search_index.count() == 0 and catalog.count() > 0:
+        rebuild_search_in_background()
+
+def _read_version(path):
+    """Версия приложения из VERSION.txt"""
     try:
-        if os.path.exists(version_file_path):
-            with open(version_file_path, 'r', encoding='utf-8') as f:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
                 version = f.read().strip()
                 # Если файл пустой, возвращаем значение по умолчанию
                 return version if version else '1.0.0'
@@ -48,18 +120,171 @@ def get_app_version():
         # В случае ошибки возвращаем значение по умолчанию
         return '1.0.0'
 
-def load_settings():
-    if os.path.exists(SETTINGS_FILE):
+def _read_settings(path):
+    if os.path.exists(path):
         try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except:
             return DEFAULT_SETTINGS
     return DEFAULT_SETTINGS
 
+def _read_devlog(path):
+    """Ответ /api/devlog: (данные, код ответа)"""
+    if not os.path.exists(path):
+        # Если файла нет, возвращаем пустой ответ
+        return {'content': '', 'shouldShow': False}, 204
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    if not lines:
+        # Если файл пустой
+        return {'content': '', 'shouldShow': False}, 204
+    # Проверяем первую строку на наличие комментария //show = false
+    first_line = lines[0].strip()
+    if "//show = false" in first_line:
+        # Если не нужно показывать, отправляем пустой контент
+        return {'content': '', 'shouldShow': False}, 200
+    # Если нужно показывать, возвращаем содержимое БЕЗ первой строки
+    return {'content': "".join(lines[1:]), 'shouldShow': True}, 200
+
+# Файлы конфигурации читаются и разбираются заново только при изменении
+version_file = CachedFile(os.path.join(os.path.dirname(__file__), 'VERSION.txt'), _read_version)
+settings_file = CachedFile(SETTINGS_FILE, _read_settings)
+devlog_file = CachedFile(DEVLOG_FILE_PATH, _read_devlog)
+
+def get_app_version():
+    """Получение версии приложения из файла VERSION.txt"""
+    return version_file.get()
+
+def load_settings():
+    # Копия: вызывающие изменяют настройки перед сохранением
+    return copy.deepcopy(settings_file.get())
+
 def save_settings(settings):
     with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
         json.dump(settings, f, ensure_ascii=False, indent=2)
+    settings_file.invalidate()
+
+def json_body(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def etag_response(body, etag, status=200):
+    """JSON-ответ с ETag; 304 без тела, если у клиента та же версия"""
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+def cached_json_response(cached_file, fn=None):
+    """Ответ из кэша файла: тело и ETag считаются один раз на версию файла"""
+    def render(value):
+        data, status = fn(value) if fn else (value, 200)
+        body = json_body(data)
+        return body, make_etag(body), status
+    body, etag, status = cached_file.render('response', render)
+    return etag_response(body, etag, status)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """Пул обработчиков запросов к ИИ, создается при первом обращении"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            # Импорт здесь: sender при загрузке читает ключи и системный промпт
+            from sender import process_request, get_key_pool, configure_response_cache
+            settings = load_settings()
+            configure_response_cache(settings.get('response_cache', DEFAULT_SETTINGS['response_cache']))
+            apply_routing(settings)
+            _dispatcher = Dispatcher(
+                process_request,
+                JobStore(storage.shared_database() or JOBS_DB_PATH, shared=chat_store.is_shared()),
+                max_workers=settings.get('max_workers', DEFAULT_SETTINGS['max_workers']),
+                queue_size=settings.get('queue_size', DEFAULT_SETTINGS['queue_size'])
+            )
+            _dispatcher.start()
+            # Ключи API создаются заранее, до первого сообщения
+            get_key_pool()
+        return _dispatcher
+
+_council = None
+_council_lock = threading.Lock()
+
+def get_council():
+    """Движок консилиумов, создается при первом обращении"""
+    global _council
+    with _council_lock:
+        if _council is None:
+            from sender import complete, BASE_SYSTEM_PROMPT
+            from council import CouncilEngine
+            apply_routing(load_settings())
+            _council = CouncilEngine(complete, BASE_SYSTEM_PROMPT)
+        return _council
+
+def apply_routing(settings):
+    """Передает в sender модели настроек для "auto" и флаг дублирования запросов"""
+    if 'sender' not in sys.modules:
+        # sender еще не загружен: настройки применятся при создании диспетчера
+        return
+    from sender import configure_routing
+    configure_routing(
+        [m.get('url') for m in settings.get('models', [])],
+        settings.get('hedge_requests', DEFAULT_SETTINGS['hedge_requests'])
+    )
+
+def resolve_models(selected):
+    """Модели консилиума по id или url из настроек; None - все модели настроек"""
+    models = load_settings().get('models', [])
+    if selected is None:
+        return models
+    result = []
+    for value in selected:
+        model = next((m for m in models if value in (m.get('id'), m.get('url'))), None)
+        # Модель не из настроек тоже допустима - по ее url
+        result.append(model or {'name': str(value), 'url': str(value)})
+    return result
+
+def _job_counts():
+    if _dispatcher is None:
+        return {}
+    return {(('status', status),): count for status, count in _dispatcher.stats()['jobs'].items()}
+
+def _key_counts():
+    if _dispatcher is None:
+        return {}
+    from sender import get_key_pool
+    return {(('state', state),): count for state, count in get_key_pool().stats().items()}
+
+metrics.REGISTRY.gauge('synedrion_jobs', "Запросы к ИИ по статусам", _job_counts)
+metrics.REGISTRY.gauge('synedrion_keys', "Ключи API в пуле: всего, занятые, создаваемые, аккаунты на паузе", _key_counts)
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_timing(response):
+    started = g.pop('started', None)
+    if started is not None:
+        # Метка - шаблон маршрута, а не путь: иначе каждый чат дал бы свой ряд
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    return response
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/models/health')
+def get_models_health():
+    """Скользящая статистика моделей: p50/p95 до первого токена, доля ошибок"""
+    if 'sender' not in sys.modules:
+        return jsonify({})
+    from sender import HEALTH
+    return jsonify(HEALTH.stats())
 
 @app.route('/')
 def index():
@@ -106,14 +331,12 @@ def about():
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Получение текущих настроек"""
-    settings = load_settings()
-    return jsonify(settings)
+    return cached_json_response(settings_file)
 
 @app.route('/api/version')
 def get_version():
     """API endpoint для получения версии приложения"""
-    version = get_app_version()
-    return jsonify({'version': version})
+    return cached_json_response(version_file, lambda version: ({'version': version}, 200))
 
 @app.route('/api/settings', methods=['PUT'])
 def update_settings():
@@ -121,6 +344,10 @@ def update_settings():
     try:
         new_settings = request.get_json()
         save_settings(new_settings)
+        if _dispatcher is not None:
+            from sender import configure_response_cache
+            configure_response_cache(new_settings.get('response_cache', DEFAULT_SETTINGS['response_cache']))
+        apply_routing(new_settings)
         return jsonify({"success": True, "message": "Настройки сохранены"})
     except Exception as e:
         return jsonify({"success": False, "message": f"Ошибка сохранения: {str(e)}"}), 500
@@ -138,6 +365,7 @@ def delete_model():
         
         settings['models'] = [m for m in settings['models'] if m['id'] != model_id]
         save_settings(settings)
+        apply_routing(settings)
         
         return jsonify({"success": True, "message": "Модель удалена"})
     except Exception as e:
@@ -167,6 +395,7 @@ def add_model():
         
         settings['models'].append(new_model)
         save_settings(settings)
+        apply_routing(settings)
         
         return jsonify({"success": True, "message": "Модель добавлена", "model": new_model})
     except Exception as e:
@@ -182,7 +411,10 @@ def exit_app():
         # Закрываем окно в отдельном потоке, чтобы ответ успел отправиться
         def close_window():
             try:
-                webview.windows[0].destroy()
+                # Окна нет, если сервер запущен без него (--headless)
+                webview = sys.modules.get('webview')
+                if webview and webview.windows:
+                    webview.windows[0].destroy()
             except:
                 pass
         
@@ -196,38 +428,27 @@ def exit_app():
     
 @app.route('/api/chats', methods=['GET'])
 def get_chats_list():
-    """Получить список всех чатов"""
+    """Получить список чатов.
+
+    Без параметров возвращает все чаты (новые сверху). С ?limit=N возвращает
+    страницу {'chats': [...], 'next_cursor': ...}; следующая страница
+    запрашивается с ?cursor=<next_cursor>. Сортировка: ?order=created_at|updated_at|title
+    и ?direction=desc|asc.
+    """
     try:
-        chats = []
-        for filename in os.listdir(CHATS_DIR):
-            if filename.endswith('.json'):
-                file_path = os.path.join(CHATS_DIR, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        chat_data = json.load(f)
-                        # Берем первую часть названия файла как ID чата
-                        chat_id = filename[:-5]  # Убираем .json
-                        # Получаем превью из первого сообщения или заголовка
-                        preview = chat_data.get('title', 'Новый чат')
-                        if not preview and chat_data.get('messages'):
-                            # Пытаемся получить текст первого сообщения пользователя
-                            for msg in chat_data['messages']:
-                                if msg.get('sender') == 'user':
-                                    preview = msg.get('text', '')[:30] + '...' if len(msg.get('text', '')) > 30 else msg.get('text', '')
-                                    break
-                        
-                        chats.append({
-                            'id': chat_id,
-                            'title': preview or 'Пустой чат',
-                            'created_at': chat_data.get('created_at', datetime.now().isoformat())
-                        })
-                except Exception as e:
-                    print(f"Ошибка при чтении чата {filename}: {e}")
-                    continue
-        
-        # Сортируем по дате создания (новые сверху)
-        chats.sort(key=lambda x: x['created_at'], reverse=True)
-        return jsonify(chats)
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        order = request.args.get('order', 'created_at')
+        direction = request.args.get('direction', 'desc')
+        if limit is not None:
+            limit = max(1, min(500, limit))
+        try:
+            chats, next_cursor = catalog.list(limit=limit, cursor=cursor, order=order, direction=direction)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if limit is None:
+            return jsonify(chats)
+        return jsonify({'chats': chats, 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -246,7 +467,6 @@ def create_new_chat():
         
         # Генерируем уникальный ID для чата
         chat_id = str(uuid.uuid4())
-        file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
         
         # Создаем структуру нового чата
         new_chat = {
@@ -260,36 +480,313 @@ def create_new_chat():
             'messages': []
         }
         
-        # Сохраняем чат в файл
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(new_chat, f, ensure_ascii=False, indent=2)
+        # Сохраняем чат в журнал
+        chat_store.create_chat(new_chat)
         
         return jsonify(new_chat)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def chat_filter(args):
+    """Фильтр чатов для выгрузки и удаления из параметров запроса.
+
+    before/after - ISO-дата или время последнего изменения, model - модель
+    чата, ids - id через запятую. ValueError, если дата некорректна.
+    """
+    result = {}
+    for name in ('before', 'after'):
+        value = args.get(name)
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{name} должно быть датой в формате ISO (например, 2025-01-31)")
+            result[name] = value
+    if 'model' in args:
+        result['model'] = args.get('model')
+    ids = [chat_id for chat_id in args.get('ids', '').split(',') if chat_id]
+    if ids:
+        result['ids'] = ids
+    return result
+
+def filtered_chat_ids(chat_filter):
+    """id чатов по фильтру chat_filter(): генератор по каталогу"""
+    ids = chat_filter.get('ids')
+    found = catalog.find(before=chat_filter.get('before'), after=chat_filter.get('after'), model=chat_filter.get('model'))
+    if ids is None:
+        return found
+    if len(chat_filter) == 1:
+        return (chat_id for chat_id in ids if chat_store.valid_id(chat_id))
+    wanted = set(ids)
+    return (chat_id for chat_id in found if chat_id in wanted)
+
+@app.route('/api/chats/export', methods=['GET'])
+def export_chats():
+    """Выгрузка чатов потоком: ?format=ndjson (по чату на строку) или zip.
+
+    Без фильтра выгружаются все чаты; фильтр - как у DELETE /api/chats.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in chat_transfer.EXPORT_FORMATS:
+        return jsonify({'error': f"format должен быть одним из: {', '.join(chat_transfer.EXPORT_FORMATS)}"}), 400
+    try:
+        chat_ids = filtered_chat_ids(chat_filter(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    filename = f"synedrion-chats-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+    if fmt == 'zip':
+        body, mimetype = chat_transfer.export_zip(chat_ids), 'application/zip'
+    else:
+        body, mimetype = chat_transfer.export_ndjson(chat_ids), 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/chats/import', methods=['POST'])
+def import_chats():
+    """Загрузка чатов из NDJSON или zip (формат выгрузки), читается потоком.
+
+    ?on_conflict=skip|replace - что делать с чатом, id которого уже есть;
+    ?batch и ?workers - размер порции и число потоков записи.
+    """
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'zip' if request.mimetype in ('application/zip', 'application/x-zip-compressed') else 'ndjson'
+    if fmt not in chat_transfer.EXPORT_FORMATS:
+        return jsonify({'error': f"format должен быть одним из: {', '.join(chat_transfer.EXPORT_FORMATS)}"}), 400
+    on_conflict = request.args.get('on_conflict', 'skip')
+    if on_conflict not in chat_transfer.CONFLICT_MODES:
+        return jsonify({'error': f"on_conflict должен быть одним из: {', '.join(chat_transfer.CONFLICT_MODES)}"}), 400
+    batch = request.args.get('batch', chat_transfer.IMPORT_BATCH, type=int)
+    workers = request.args.get('workers', chat_transfer.IMPORT_WORKERS, type=int)
+    if not 1 <= batch <= chat_transfer.MAX_IMPORT_BATCH or not 1 <= workers <= chat_transfer.MAX_IMPORT_WORKERS:
+        return jsonify({'error': f"batch должен быть от 1 до {chat_transfer.MAX_IMPORT_BATCH}, "
+                                 f"workers - от 1 до {chat_transfer.MAX_IMPORT_WORKERS}"}), 400
+    try:
+        if fmt == 'zip':
+            with chat_transfer.spool_upload(request.stream) as upload:
+                report = chat_transfer.import_chats(chat_transfer.read_zip(upload), on_conflict, batch, workers)
+        else:
+            report = chat_transfer.import_chats(chat_transfer.read_ndjson(request.stream), on_conflict, batch, workers)
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Файл не является zip-архивом'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(report)
+
+@app.route('/api/chats', methods=['DELETE'])
+def delete_chats():
+    """Удаление чатов по фильтру: ?before, ?after (ISO-дата изменения), ?model, ?ids.
+
+    Фильтр обязателен. ?dry_run=1 только считает подходящие чаты.
+    """
+    try:
+        selected = chat_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not selected:
+        return jsonify({'error': 'Укажите фильтр: before, after, model или ids'}), 400
+    chat_ids = filtered_chat_ids(selected)
+    if request.args.get('dry_run') in ('1', 'true'):
+        return jsonify({'matched': sum(1 for chat_id in chat_ids if chat_store.chat_exists(chat_id)), 'dry_run': True})
+    return jsonify({'deleted': chat_transfer.delete_chats(chat_ids)})
+
+@app.route('/api/search', methods=['GET'])
+def search_chats():
+    """Поиск по сообщениям, названиям и системным промптам всех чатов"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Не указан запрос'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры'}), 400
+    if not 1 <= limit <= MAX_SEARCH_HITS:
+        return jsonify({'error': f'limit должен быть от 1 до {MAX_SEARCH_HITS}'}), 400
+    hits = search_index.search(query, limit=limit, offset=offset, chat_id=request.args.get('chat'))
+    titles = {}
+    for hit in hits:
+        if hit['chat_id'] not in titles:
+            titles[hit['chat_id']] = catalog.title(hit['chat_id'])
+        hit['chat_title'] = titles[hit['chat_id']]
+    return jsonify({'query': query, 'hits': hits})
+
+@app.route('/api/search/rebuild', methods=['POST'])
+def rebuild_search_index():
+    """Перестроить индекс поиска по файлам чатов"""
+    count = search_index.rebuild()
+    return jsonify({'success': True, 'documents': count})
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive_stats():
+    """Размер архива чатов"""
+    if chat_archive is None:
+        return jsonify({'error': 'Архив недоступен при общем хранилище чатов'}), 409
+    return jsonify(chat_archive.stats())
+
+@app.route('/api/archive', methods=['POST'])
+def archive_chats():
+    """Перенести в архив чаты, не менявшиеся days дней, и сжать сегменты архива"""
+    if chat_archive is None:
+        return jsonify({'error': 'Архив недоступен при общем хранилище чатов'}), 409
+    data = request.get_json(silent=True) or {}
+    days = data.get('days', load_settings().get('archive_days', DEFAULT_SETTINGS['archive_days']))
+    if not isinstance(days, (int, float)) or days < 0:
+        return jsonify({'error': 'days должно быть неотрицательным числом'}), 400
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    report = chat_archive.archive_cold(days, candidates=catalog.updated_before(cutoff))
+    report['archive'] = chat_archive.stats()
+    return jsonify(report)
+
 @app.route('/api/chats/<chat_id>', methods=['GET'])
 def get_chat(chat_id):
     """Получить данные конкретного чата"""
+    if not chat_store.valid_id(chat_id):
+        return jsonify({'error': 'Чат не найден'}), 404
     try:
-        file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-        if not os.path.exists(file_path):
+        # ETag по отметкам файлов чата: неизменный чат не читается с диска
+        stamp = chat_store.chat_stamp(chat_id)
+        etag = make_etag(chat_id, stamp)
+        if stamp and request.if_none_match.contains(etag.strip('"')):
+            return etag_response(b'', etag)
+        chat_data = chat_store.load_chat(chat_id)
+        if chat_data is None:
             return jsonify({'error': 'Чат не найден'}), 404
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        return jsonify(chat_data)
+        return etag_response(json_body(chat_data), etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chats/<chat_id>/meta', methods=['GET'])
+def get_chat_meta(chat_id):
+    """Поля чата без сообщений (название, модель, системный промпт...)"""
+    if not chat_store.valid_id(chat_id):
+        return jsonify({'error': 'Чат не найден'}), 404
+    try:
+        stamp = chat_store.chat_stamp(chat_id)
+        etag = make_etag('meta', chat_id, stamp)
+        if stamp and request.if_none_match.contains(etag.strip('"')):
+            return etag_response(b'', etag)
+        meta = chat_store.read_header(chat_id)
+        if meta is None:
+            return jsonify({'error': 'Чат не найден'}), 404
+        return etag_response(json_body(meta), etag)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def omit_fields(message, fields):
+    """Копия сообщения без тяжелых полей; они перечисляются в 'omitted'"""
+    omitted = [field for field in fields if message.get(field)]
+    if not omitted:
+        return message
+    message = {k: v for k, v in message.items() if k not in omitted}
+    if 'reasoning' in omitted and message.get('sender') == 'ai' and 'answer' in message:
+        # Текст ответа повторяет рассуждения в [THOUGHTS] - оставляем только ответ
+        message['text'] = message['answer']
+    message['omitted'] = omitted
+    return message
+
+@app.route('/api/chats/<chat_id>/messages', methods=['GET'])
+def get_chat_messages(chat_id):
+    """Страница сообщений чата: последние limit сообщений с id меньше before.
+
+    omit=reasoning убирает рассуждения модели - их можно получить отдельно
+    через /api/chats/<id>/messages/<message_id>.
+    """
+    try:
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', chat_store.PAGE_SIZE, type=int)
+        if limit is None or not 1 <= limit <= MAX_MESSAGES_PAGE:
+            return jsonify({'error': f'limit должен быть от 1 до {MAX_MESSAGES_PAGE}'}), 400
+        omit = [f for f in request.args.get('omit', '').split(',') if f]
+        unknown = set(omit) - OMITTABLE_FIELDS
+        if unknown:
+            return jsonify({'error': f'Нельзя опустить поля: {", ".join(sorted(unknown))}'}), 400
+        messages, has_more = chat_store.read_window(chat_id, before, limit)
+        if messages is None:
+            return jsonify({'error': 'Чат не найден'}), 404
+        if omit:
+            messages = [omit_fields(m, omit) for m in messages]
+        cursor = next((m.get('id') for m in messages if not chat_store.is_transient(m)), None)
+        return jsonify({
+            'messages': messages,
+            'has_more': has_more,
+            # Значение before для следующей (более старой) страницы
+            'before': cursor if has_more else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<chat_id>/messages/<int:message_id>', methods=['GET'])
+def get_chat_message(chat_id, message_id):
+    """Одно сообщение целиком (например, рассуждения, опущенные в странице)"""
+    try:
+        message = chat_store.read_message(chat_id, message_id)
+        if message is None:
+            return jsonify({'error': 'Сообщение не найдено'}), 404
+        return jsonify(message)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<chat_id>/messages', methods=['POST'])
+def add_chat_message(chat_id):
+    """Добавить или заменить одно сообщение, не пересылая чат целиком"""
+    try:
+        message = request.get_json(silent=True)
+        if not isinstance(message, dict) or message.get('id') is None or not message.get('sender'):
+            return jsonify({'error': 'Нужно сообщение с полями id и sender'}), 400
+        if chat_store.is_transient(message):
+            return jsonify({'error': 'Индикатор загрузки не сохраняется'}), 400
+        if not chat_store.chat_exists(chat_id):
+            return jsonify({'error': 'Чат не найден'}), 404
+        chat_store.put_message(chat_id, message)
+        return jsonify(message)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<chat_id>/events')
+def chat_events(chat_id):
+    """Поток событий чата (Server-Sent Events): новые и изменённые сообщения
+    и фрагменты ответа модели по мере генерации"""
+    if not chat_store.chat_exists(chat_id):
+        return jsonify({'error': 'Чат не найден'}), 404
+    last_id = request.args.get('last_id', type=int)
+
+    def stream():
+        # Подписываемся до чтения файла, чтобы не пропустить события между ними
+        sub = bus.subscribe(chat_id)
+        try:
+            yield "retry: 2000\n\n"
+            # Досылаем сообщения, появившиеся после последнего известного клиенту.
+            # Клиент держит последнюю страницу чата, поэтому читаем только ее
+            messages, _ = chat_store.read_window(chat_id, limit=EVENTS_SYNC_LIMIT)
+            messages = messages or []
+            ids = [m.get('id') for m in messages]
+            start = ids.index(last_id) if last_id in ids else 0
+            yield format_sse(0, 'sync', {'messages': messages[start:], 'ids': ids})
+            while True:
+                try:
+                    seq, event, data = sub.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(seq, event, data)
+        finally:
+            bus.unsubscribe(chat_id, sub)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/chats/<chat_id>', methods=['PUT'])
 def update_chat(chat_id):
     """Обновить чат"""
     try:
         data = request.get_json()
-        file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
         
-        if not os.path.exists(file_path):
+        if not chat_store.chat_exists(chat_id):
             return jsonify({'error': 'Чат не найден'}), 404
             
         # Получаем reasoning_len из данных, по умолчанию 1000 если не указано
@@ -302,11 +799,37 @@ def update_chat(chat_id):
         # Обновляем время изменения
         data['updated_at'] = datetime.now().isoformat()
         
-        # Сохраняем обновленные данные
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Дописываем в журнал только то, что изменилось
+        chat_data = chat_store.save_chat(chat_id, data)
             
-        return jsonify(data)
+        return jsonify(chat_data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<chat_id>', methods=['PATCH'])
+def patch_chat(chat_id):
+    """Изменить поля чата (название, модель, системный промпт, reasoning_len)
+    без пересылки сообщений: дописывается одна запись заголовка"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not data:
+            return jsonify({'error': 'Нужен объект с изменяемыми полями'}), 400
+        unknown = set(data) - HEADER_FIELDS
+        if unknown:
+            return jsonify({'error': f'Нельзя изменить поля: {", ".join(sorted(unknown))}'}), 400
+        for field in ('title', 'model', 'system_prompt'):
+            if field in data and data[field] is not None and not isinstance(data[field], str):
+                return jsonify({'error': f'Поле {field} должно быть строкой'}), 400
+        if 'reasoning_len' in data:
+            try:
+                data['reasoning_len'] = max(0, min(2500, int(data['reasoning_len'])))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'reasoning_len должно быть числом'}), 400
+        if not chat_store.chat_exists(chat_id):
+            return jsonify({'error': 'Чат не найден'}), 404
+        data['updated_at'] = datetime.now().isoformat()
+        chat_store.update_header(chat_id, data)
+        return jsonify(chat_store.read_header(chat_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -314,15 +837,25 @@ def update_chat(chat_id):
 def delete_chat(chat_id):
     """Удалить чат"""
     try:
-        file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-        if not os.path.exists(file_path):
+        if not chat_store.delete_chat(chat_id):
             return jsonify({'error': 'Чат не найден'}), 404
             
-        os.remove(file_path)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@app.route('/api/chats/<chat_id>/messages/<int:message_id>', methods=['DELETE'])
+def delete_chat_message(chat_id, message_id):
+    """Удалить одно сообщение, не пересылая чат целиком"""
+    try:
+        if not chat_store.chat_exists(chat_id):
+            return jsonify({'error': 'Чат не найден'}), 404
+        chat_store.delete_message(chat_id, message_id)
+        bus.publish(chat_id, 'removed', {'id': message_id})
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/ai/send_message', methods=['POST'])
 def send_ai_message():
     """Отправка сообщения ИИ и сохранение ответа в чат"""
@@ -334,14 +867,10 @@ def send_ai_message():
         if not chat_id or not user_message:
             return jsonify({'error': 'Необходимо указать chat_id и message'}), 400
         
-        # Загружаем чат
-        file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-        if not os.path.exists(file_path):
+        # Проверяем, что чат существует
+        if not chat_store.chat_exists(chat_id):
             return jsonify({'error': 'Чат не найден'}), 404
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        
         # Вызываем ваш ИИ API
         ai_response = call_ai_api(user_message)
         
@@ -353,16 +882,8 @@ def send_ai_message():
             'timestamp': datetime.now().isoformat()
         }
         
-        # Добавляем ответ ИИ в чат
-        if 'messages' not in chat_data:
-            chat_data['messages'] = []
-        
-        chat_data['messages'].append(ai_message)
-        chat_data['updated_at'] = datetime.now().isoformat()
-        
-        # Сохраняем обновленный чат
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
+        # Дописываем ответ ИИ в журнал чата
+        chat_store.put_message(chat_id, ai_message)
         
         return jsonify({'success': True, 'ai_message': ai_message})
         
@@ -371,7 +892,7 @@ def send_ai_message():
     
 @app.route('/api/create_request', methods=['POST'])
 def create_request():
-    """Создание файла запроса для локального API и запуск api_sender.py"""
+    """Постановка запроса к ИИ в очередь обработки"""
     try:
         data = request.get_json()
         chat_filename = data.get('chat')
@@ -379,68 +900,102 @@ def create_request():
         if not chat_filename:
             return jsonify({'error': 'Не указан файл чата'}), 400
             
-        # Проверяем, что файл чата существует
-        chat_path = os.path.join(CHATS_DIR, chat_filename)
-        if not os.path.exists(chat_path):
+        # Проверяем, что чат существует
+        if not chat_store.chat_exists(chat_store.chat_id_from_filename(chat_filename)):
             return jsonify({'error': 'Файл чата не найден'}), 404
         
-        # 1. Создаем файл request.json в директории config
-        request_data = {
-            "chat": chat_filename
-        }
-        
-        config_path = os.path.join(CONFIG_DIR, 'request.json')
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(request_data, f, ensure_ascii=False, indent=2)
-        
-        # 2. Запускаем api_sender.py
+        dispatcher = get_dispatcher()
+        if data.get('no_cache'):
+            # Перегенерация: ответ нужен новый, а не из кэша
+            from sender import bypass_cache
+            bypass_cache(chat_store.chat_id_from_filename(chat_filename))
         try:
-            # Запускаем скрипт в отдельном процессе
-            subprocess.Popen([sys.executable, 'api_sender.pyw'], 
-                           stdout=subprocess.PIPE, 
-                           stderr=subprocess.PIPE)
-            # Если вы хотите видеть вывод скрипта в консоли, используйте:
-            # subprocess.Popen([sys.executable, 'api_sender.py'])
-        except FileNotFoundError:
-            return jsonify({'error': 'Файл api_sender.py не найден'}), 500
-        except Exception as e:
-            return jsonify({'error': f'Ошибка запуска api_sender.py: {str(e)}'}), 500
+            # Единое имя файла: по нему диспетчер держит один запрос на чат
+            job = dispatcher.submit(f"{chat_store.chat_id_from_filename(chat_filename)}.json")
+        except QueueFullError as e:
+            response = jsonify({'error': f'Сервер перегружен, повторите запрос позже. {str(e)}'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
         
-        return jsonify({'success': True, 'message': 'Запрос создан и обрабатывается'})
+        result = {'success': True, 'job_id': job['id'], 'status': job['status'], 'message': 'Запрос создан и обрабатывается'}
+        if job.get('coalesced'):
+            # Запрос этого чата уже ждет в очереди - ответ построится по новому сообщению
+            result['coalesced'] = True
+        if job.get('superseded'):
+            result['superseded'] = job['superseded']
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/council', methods=['POST'])
+def start_council_round():
+    """Вопрос консилиуму: ответы всех участников приходят в чат консилиума"""
+    data = request.get_json(silent=True) or {}
+    prompt = (data.get('prompt') or '').strip()
+    if not prompt:
+        return jsonify({'error': 'Не указан вопрос'}), 400
+    try:
+        timeout = float(data.get('timeout') or 0) or None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный timeout'}), 400
+    engine = get_council()
+    models = resolve_models(data.get('models'))
+    chat_id = data.get('chat')
+    if chat_id:
+        if not chat_store.chat_exists(chat_id):
+            return jsonify({'error': 'Чат не найден'}), 404
+        if data.get('models') is None:
+            # Участники берутся из самого чата консилиума
+            models = None
+    else:
+        chat_id = engine.create_council(models, data.get('title'))['id']
+    summary_model = None
+    if data.get('summary_model') is not None:
+        summary_model = resolve_models([data['summary_model']])[0]
+    kwargs = {'timeout': timeout} if timeout else {}
+    try:
+        info = engine.submit(chat_id, prompt, models, summary_model=summary_model, reasoning_max=int(data.get('reasoning_len') or 0), **kwargs)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(info), 202
+
+@app.route('/api/council/<round_id>', methods=['GET'])
+def get_council_round(round_id):
+    """Состояние раунда консилиума"""
+    info = get_council().get_round(round_id)
+    if not info:
+        return jsonify({'error': 'Раунд не найден'}), 404
+    return jsonify(info)
+
+@app.route('/api/requests/<job_id>', methods=['GET'])
+def get_request_status(job_id):
+    """Получить состояние запроса к ИИ"""
+    job = get_dispatcher().get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Запрос не найден'}), 404
+    return jsonify(job)
+
+@app.route('/api/requests/<job_id>/cancel', methods=['POST'])
+def cancel_request(job_id):
+    """Отменить запрос к ИИ: ожидание в очереди или уже идущую генерацию"""
+    if not get_dispatcher().cancel(job_id):
+        return jsonify({'error': 'Запрос не найден или уже завершен'}), 404
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/api/chats/<chat_id>/cancel', methods=['POST'])
+def cancel_chat_request(chat_id):
+    """Остановить генерацию ответа в чате"""
+    job_id = get_dispatcher().cancel_chat(f"{chat_id}.json")
+    if job_id is None:
+        return jsonify({'error': 'Для чата нет выполняющегося запроса'}), 404
+    return jsonify({'success': True, 'job_id': job_id})
     
 @app.route('/api/devlog')
 def get_devlog():
     """Получить содержимое файла devlog.html без первой строки (комментария)"""
     try:
-        if os.path.exists(DEVLOG_FILE_PATH):
-            with open(DEVLOG_FILE_PATH, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            if not lines:
-                 # Если файл пустой
-                return jsonify({'content': '', 'shouldShow': False}), 204
-
-            # Проверяем первую строку на наличие комментария //show = false
-            first_line = lines[0].strip() if lines else ""
-            should_show = "//show = false" not in first_line
-            
-            # Если нужно показывать, возвращаем содержимое БЕЗ первой строки
-            if should_show:
-                # Объединяем все строки, кроме первой
-                content_without_first_line = "".join(lines[1:]) if len(lines) > 1 else ""
-                return jsonify({
-                    'content': content_without_first_line, # Отправляем без первой строки
-                    'shouldShow': True
-                })
-            else:
-                # Если не нужно показывать, можно отправить пустой контент
-                return jsonify({'content': '', 'shouldShow': False})
-        else:
-            # Если файла нет, возвращаем пустой ответ
-            return jsonify({'content': '', 'shouldShow': False}), 204
+        return cached_json_response(devlog_file, lambda result: result)
     except Exception as e:
         print(f"Ошибка чтения devlog.html: {e}")
         return jsonify({'error': 'Ошибка чтения файла devlog'}), 500
@@ -460,6 +1015,7 @@ def hide_devlog():
                 
                 with open(DEVLOG_FILE_PATH, 'w', encoding='utf-8') as f:
                     f.writelines(lines)
+                devlog_file.invalidate()
                     
             return jsonify({'success': True})
         else:
@@ -471,24 +1027,38 @@ def hide_devlog():
 def call_ai_api(message):
     return f"Это ответ ИИ на ваше сообщение: '{message}'. Не переживайте, однажды эта заглушка сменится на нормальный ответ."
 
-def start_server():
-    app.run(host='127.0.0.1', port=5001, debug=True, use_reloader=False)
+def start_server(args):
+    server.serve(app, args.host, args.port, args.threads, args.connection_limit, args.channel_timeout)
 
 if __name__ == '__main__':
+    import logging
+    import server
+    args = server.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
     # Создаем файл настроек при первом запуске
     if not os.path.exists(SETTINGS_FILE):
         save_settings(DEFAULT_SETTINGS)
-    
-    # Запускаем Flask в отдельном потоке
-    t = threading.Thread(target=start_server)
+
+    if args.headless:
+        # Только сервер: API доступно без окна приложения
+        start_server(args)
+        sys.exit(0)
+
+    # Запускаем сервер в отдельном потоке
+    t = threading.Thread(target=start_server, args=(args,))
     t.daemon = True
     t.start()
 
+    # Окно нужно только в настольном режиме - импортируем его здесь
+    import webview
+
     # Открываем окно с интерфейсом
+    url = f'http://{args.host}:{args.port}'
     settings = load_settings()
     if settings.get('fullscreen', False):
-        webview.create_window('Synedrion', 'http://127.0.0.1:5001', width=1200, height=800, fullscreen=True)
+        webview.create_window('Synedrion', url, width=1200, height=800, fullscreen=True)
     else:
-        webview.create_window('Synedrion', 'http://127.0.0.1:5001', width=1200, height=800)
+        webview.create_window('Synedrion', url, width=1200, height=800)
     
     webview.start()  # Запускает цикл GUI
\ No newline at end of file
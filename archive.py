@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta
+import threading
+import argparse
+import logging
+import zlib
+import json
+import time
+import os
+import re
+
+import db
+import chat_store
+
+logger = logging.getLogger("synedrion.archive")
+
+# Чаты, не менявшиеся дольше ARCHIVE_DAYS дней, переносятся в архив
+ARCHIVE_DAYS = 30
+# Размер сегмента, после которого начинается новый
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Сегмент переписывается, когда в нем больше этой доли удаленных данных
+SEGMENT_MIN_GARBAGE = 0.5
+COMPRESS_LEVEL = 6
+
+_SEGMENT_RE = re.compile(r'^segment-(\d{6})\.bin$')
+
+
+class ChatArchive:
+    """Архив давно не менявшихся чатов.
+
+    Журнал чата (chats/<id>.jsonl, уже без устаревших записей) сжимается
+    zlib и дописывается в конец сегмента chats/archive/segment-NNNNNN.bin,
+    а смещение и длина записываются в индекс chats/archive/index.db. Так
+    один чат читается из архива без распаковки всего сегмента, а в каталоге
+    чатов остаются только активные файлы.
+
+    Каталог и поиск не меняются: архивный чат виден в списке как обычно.
+    chat_store читает архивные чаты прозрачно, а при открытии чата или
+    записи в него возвращает журнал на место (rehydrate) и удаляет чат из
+    индекса. Место, занятое такими чатами в сегментах, освобождает
+    compact_segments().
+    """
+
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = db.connect(os.path.join(directory, 'index.db'))
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived (
+                chat_id TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                raw_bytes INTEGER NOT NULL,
+                updated_at TEXT,
+                archived_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS archived_segment ON archived (segment)")
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.bin")
+
+    def _segments(self):
+        return sorted(int(m.group(1)) for m in map(_SEGMENT_RE.match, os.listdir(self.directory)) if m)
+
+    def _active_segment(self):
+        """Сегмент для дозаписи: последний, пока он не заполнен"""
+        segments = self._segments()
+        if segments and os.path.getsize(self.segment_path(segments[-1])) < self.segment_max_bytes:
+            return segments[-1]
+        return (segments[-1] + 1) if segments else 1
+
+    def _write_blob(self, blob):
+        segment = self._active_segment()
+        with open(self.segment_path(segment), 'ab') as f:
+            offset = f.tell()
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, offset
+
+    def _read_blob(self, segment, offset, length):
+        with open(self.segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def contains(self, chat_id):
+        return self._conn.execute("SELECT 1 FROM archived WHERE chat_id = ?", (chat_id,)).fetchone() is not None
+
+    def stamp(self, chat_id):
+        """Положение чата в архиве (для ETag) или None"""
+        row = self._conn.execute("SELECT segment, offset, length FROM archived WHERE chat_id = ?", (chat_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def ids(self):
+        return [row[0] for row in self._conn.execute("SELECT chat_id FROM archived")]
+
+    def add(self, chat_id, text, updated_at=None):
+        """Сохраняет текст журнала чата в архив. Возвращает размер в сегменте"""
+        raw = text.encode('utf-8')
+        blob = zlib.compress(raw, COMPRESS_LEVEL)
+        with self._lock:
+            segment, offset = self._write_blob(blob)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archived (chat_id, segment, offset, length, raw_bytes, updated_at, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, segment, offset, len(blob), len(raw), updated_at, datetime.now().isoformat())
+            )
+        return len(blob)
+
+    def read(self, chat_id):
+        """Текст журнала архивного чата или None"""
+        with self._lock:
+            row = self._conn.execute("SELECT segment, offset, length FROM archived WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                return None
+            blob = self._read_blob(row['segment'], row['offset'], row['length'])
+        return zlib.decompress(blob).decode('utf-8')
+
+    def remove(self, chat_id):
+        """Убирает чат из индекса; место в сегменте освободит compact_segments"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM archived WHERE chat_id = ?", (chat_id,)).rowcount > 0
+
+    def archive_chat(self, chat_id, cutoff=None):
+        """Переносит чат в архив, если он не менялся после cutoff (ISO-время).
+
+        Возвращает (байт было, байт стало) или None, если чат пропущен.
+        """
+        with chat_store.chat_lock(chat_id):
+            path = chat_store.log_path(chat_id)
+            # Чат, для которого сейчас генерируется ответ, не трогаем
+            if not os.path.exists(path) or os.path.exists(chat_store.state_path(chat_id)):
+                return None
+            chat, _ = chat_store.read_log(chat_id)
+            if chat is None or (cutoff and (chat.get('updated_at') or '') >= cutoff):
+                return None
+            before = os.path.getsize(path)
+            after = self.add(chat_id, chat_store.render_log(chat), chat.get('updated_at'))
+            os.remove(path)
+        return before, after
+
+    def archive_cold(self, days=ARCHIVE_DAYS, candidates=None):
+        """Переносит в архив чаты, не менявшиеся days дней, и сжимает сегменты.
+
+        candidates - id чатов для проверки (например, из каталога по
+        updated_at); по умолчанию проверяются все журналы в каталоге чатов.
+        Возвращает отчет с освобожденным местом.
+        """
+        started = time.time()
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        if candidates is None:
+            candidates = [name[:-6] for name in os.listdir(chat_store.CHATS_DIR) if name.endswith('.jsonl')]
+        archived = 0
+        bytes_before = 0
+        bytes_after = 0
+        for chat_id in candidates:
+            try:
+                result = self.archive_chat(chat_id, cutoff)
+            except (OSError, ValueError):
+                logger.warning(f"Не удалось перенести чат {chat_id} в архив", exc_info=True)
+                continue
+            if result:
+                archived += 1
+                bytes_before += result[0]
+                bytes_after += result[1]
+        segments_reclaimed = self.compact_segments()
+        report = {
+            'archived': archived,
+            'bytes_before': bytes_before,
+            'bytes_after': bytes_after,
+            'segments_reclaimed': segments_reclaimed,
+            'reclaimed': bytes_before - bytes_after + segments_reclaimed,
+            'seconds': round(time.time() - started, 3)
+        }
+        logger.info(f"Архивация чатов: {report}")
+        return report
+
+    def compact_segments(self, min_garbage=SEGMENT_MIN_GARBAGE):
+        """Переписывает сегменты, в которых много удаленных данных.
+
+        Живые записи переносятся в текущий сегмент, старый файл удаляется.
+        Возвращает число освобожденных байт.
+        """
+        reclaimed = 0
+        with self._lock:
+            active = self._active_segment()
+            live = dict(self._conn.execute("SELECT segment, SUM(length) FROM archived GROUP BY segment").fetchall())
+            for segment in self._segments():
+                if segment == active:
+                    continue
+                path = self.segment_path(segment)
+                size = os.path.getsize(path)
+                used = live.get(segment, 0)
+                if size == 0 or 1 - used / size < min_garbage:
+                    continue
+                rows = self._conn.execute(
+                    "SELECT chat_id, offset, length FROM archived WHERE segment = ?", (segment,)
+                ).fetchall()
+                for row in rows:
+                    blob = self._read_blob(segment, row['offset'], row['length'])
+                    new_segment, offset = self._write_blob(blob)
+                    self._conn.execute(
+                        "UPDATE archived SET segment = ?, offset = ? WHERE chat_id = ?",
+                        (new_segment, offset, row['chat_id'])
+                    )
+                os.remove(path)
+                reclaimed += size - used
+        return reclaimed
+
+    def stats(self):
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0), COALESCE(SUM(raw_bytes), 0) FROM archived").fetchone()
+        segments = self._segments()
+        return {
+            'chats': row[0],
+            'live_bytes': row[1],
+            'raw_bytes': row[2],
+            'segments': len(segments),
+            'segment_bytes': sum(os.path.getsize(self.segment_path(s)) for s in segments)
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Перенос давно не менявшихся чатов в архив")
+    parser.add_argument('--days', type=int, default=ARCHIVE_DAYS, help="архивировать чаты старше стольких дней")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    args = parse_args()
+    if chat_store.is_shared():
+        raise SystemExit("Архив недоступен при общем хранилище чатов (SYNEDRION_STORAGE)")
+    chat_archive = ChatArchive(os.path.join(chat_store.CHATS_DIR, 'archive'))
+    chat_store.set_archive(chat_archive)
+    report = chat_archive.archive_cold(args.days)
+    report['archive'] = chat_archive.stats()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,94 @@
+"""Генератор синтетических чатов для нагрузочных тестов.
+
+    python bench/corpus.py --out /tmp/synedrion-bench/chats --chats 1000 --messages 20 --big-chats 2 --big-messages 10000
+
+Чаты записываются в формате chat_store (журналы <id>.jsonl). Одинаковый
+--seed дает одинаковый набор чатов.
+"""
+from datetime import datetime, timedelta
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "запрос ответ модель ключ сервер поток журнал чат сообщение история контекст лимит очередь "
+    "python flask sqlite индекс поиск кэш задержка пропускная способность память процесс "
+    "функция класс модуль ошибка тест данные файл строка список словарь время дата"
+).split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def make_chat(rng, index, messages, start):
+    """Чат с чередующимися сообщениями пользователя и ответами ИИ"""
+    created = start + timedelta(minutes=index)
+    chat = {
+        'id': f"bench-{index:06d}",
+        'title': sentence(rng, 4) if rng.random() < 0.7 else None,
+        'model': rng.choice(["qwen/qwen3-coder:free", "deepseek/deepseek-r1-0528-qwen3-8b:free"]),
+        'system_prompt': '',
+        'reasoning_len': 0,
+        'created_at': created.isoformat(),
+        'updated_at': created.isoformat(),
+        'messages': []
+    }
+    base_id = int(created.timestamp() * 1000)
+    for i in range(messages):
+        timestamp = (created + timedelta(seconds=i)).isoformat()
+        if i % 2 == 0:
+            chat['messages'].append({'id': base_id + i, 'sender': 'user', 'text': sentence(rng, rng.randint(5, 40)), 'timestamp': timestamp})
+        else:
+            answer = "[RESPONSE]\n" + " ".join(sentence(rng, 12) for _ in range(rng.randint(1, 8))) + "\n[/RESPONSE]"
+            chat['messages'].append({'id': base_id + i, 'sender': 'ai', 'reasoning': '', 'answer': answer, 'text': answer + " ", 'timestamp': timestamp})
+    return chat
+
+def generate(out, chats=1000, messages=20, big_chats=0, big_messages=10000, seed=1):
+    """Создает чаты в каталоге out и возвращает описание набора"""
+    os.makedirs(out, exist_ok=True)
+    # chat_store читает каталог чатов при импорте
+    os.environ['SYNEDRION_CHATS_DIR'] = out
+    sys.path.insert(0, BASE_DIR)
+    import chat_store
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    started = time.time()
+    total = 0
+    ids = {'regular': [], 'big': []}
+    for index in range(chats + big_chats):
+        big = index >= chats
+        chat = make_chat(rng, index, big_messages if big else messages, start)
+        chat_store.create_chat(chat)
+        ids['big' if big else 'regular'].append(chat['id'])
+        total += len(chat['messages'])
+    return {
+        'dir': out,
+        'chats': chats + big_chats,
+        'messages': total,
+        'seed': seed,
+        'ids': ids,
+        'seconds': round(time.time() - started, 2)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор чатов для нагрузочных тестов")
+    parser.add_argument('--out', required=True, help="каталог чатов")
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20, help="сообщений в обычном чате")
+    parser.add_argument('--big-chats', type=int, default=0, help="число больших чатов")
+    parser.add_argument('--big-messages', type=int, default=10000, help="сообщений в большом чате")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    info = generate(args.out, args.chats, args.messages, args.big_chats, args.big_messages, args.seed)
+    info.pop('ids')
+    print(json.dumps(info, ensure_ascii=False))
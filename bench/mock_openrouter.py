@@ -0,0 +1,153 @@
+"""Локальная заглушка OpenRouter для нагрузочных тестов.
+
+Отвечает на POST /api/v1/keys, DELETE /api/v1/keys/<hash> и
+POST /api/v1/chat/completions (обычный и потоковый ответ) с настраиваемой
+задержкой (общей или своей для отдельных моделей) и долей ошибок 429 и 502.
+
+    python bench/mock_openrouter.py --port 8765 --latency 0.5 --rate-429 0.05
+
+Приложение направляется на заглушку переменной окружения
+SYNEDRION_API_BASE=http://127.0.0.1:8765/api/v1
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import random
+import json
+import time
+import uuid
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, token_delay=0.01, tokens=50, rate_429=0.0, rate_502=0.0, reset_after=2.0, seed=None, model_latency=None):
+        # Задержка до первого токена и между токенами (секунды)
+        self.latency = latency
+        # Задержка до первого токена для отдельных моделей: {model: секунды}
+        self.model_latency = model_latency or {}
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        # Через сколько секунд "сбрасывается" лимит в X-RateLimit-Reset
+        self.reset_after = reset_after
+        self.random = random.Random(seed)
+        self.stats = {'keys_created': 0, 'keys_deleted': 0, 'completions': 0, '429': 0, '502': 0}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self._json(200, self.config.stats)
+        self._json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_DELETE(self):
+        if self.path.startswith('/api/v1/keys/'):
+            self.config.stats['keys_deleted'] += 1
+            return self._json(200, {'deleted': True})
+        self._json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_POST(self):
+        if self.path == '/api/v1/keys':
+            self._body()
+            self.config.stats['keys_created'] += 1
+            key_hash = uuid.uuid4().hex
+            return self._json(200, {'key': f"sk-or-mock-{key_hash}", 'data': {'hash': key_hash}})
+        if self.path == '/api/v1/chat/completions':
+            return self._completion(self._body())
+        self._json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def _completion(self, payload):
+        config = self.config
+        config.stats['completions'] += 1
+        roll = config.random.random()
+        if roll < config.rate_429:
+            config.stats['429'] += 1
+            reset = str(int((time.time() + config.reset_after) * 1000))
+            return self._json(429, {'error': {
+                'code': 429,
+                'message': 'Rate limit exceeded',
+                'metadata': {'headers': {'X-RateLimit-Reset': reset}}
+            }}, {'X-RateLimit-Reset': reset})
+        if roll < config.rate_429 + config.rate_502:
+            config.stats['502'] += 1
+            return self._json(502, {'error': {'code': 502, 'message': 'Bad gateway'}})
+        time.sleep(config.model_latency.get(payload.get('model'), config.latency))
+        words = [f"слово{i}" for i in range(config.tokens)]
+        content = "[RESPONSE]\n" + " ".join(words) + "\n[/RESPONSE]"
+        usage = {'prompt_tokens': sum(len(m.get('content') or '') for m in payload.get('messages', [])) // 3, 'completion_tokens': config.tokens}
+        if not payload.get('stream'):
+            return self._json(200, {
+                'id': uuid.uuid4().hex,
+                'model': payload.get('model'),
+                'choices': [{'message': {'role': 'assistant', 'content': content}}],
+                'usage': usage
+            })
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        parts = ["[RESPONSE]\n"] + [w + " " for w in words] + ["\n[/RESPONSE]"]
+        for part in parts:
+            chunk = {'choices': [{'delta': {'content': part}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if config.token_delay:
+                time.sleep(config.token_delay)
+        self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {}}], 'usage': usage})}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def make_server(host='127.0.0.1', port=0, **options):
+    """Сервер заглушки (port=0 - любой свободный порт: server.server_address[1])"""
+    handler = type('Handler', (MockHandler,), {'config': MockConfig(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка OpenRouter")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help="задержка до первого токена, с")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="задержка между токенами, с")
+    parser.add_argument('--tokens', type=int, default=50, help="токенов в ответе")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--rate-502', type=float, default=0.0, help="доля ответов 502")
+    parser.add_argument('--model-latency', action='append', default=[], metavar='MODEL=SECONDS',
+                        help="задержка до первого токена для отдельной модели (можно повторять)")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(
+        args.host, args.port, latency=args.latency, token_delay=args.token_delay, tokens=args.tokens,
+        rate_429=args.rate_429, rate_502=args.rate_502, seed=args.seed,
+        model_latency={model: float(seconds) for model, seconds in (item.rsplit('=', 1) for item in args.model_latency)}
+    )
+    print(f"Заглушка OpenRouter: http://{args.host}:{server.server_address[1]}/api/v1")
+    server.serve_forever()
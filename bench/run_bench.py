@@ -0,0 +1,323 @@
+"""Нагрузочный тест Synedrion с локальной заглушкой OpenRouter.
+
+Создает набор чатов (bench/corpus.py), запускает заглушку OpenRouter
+(bench/mock_openrouter.py) и приложение в режиме --headless, прогоняет
+сценарии с заданной параллельностью и печатает JSON с p50/p95/p99,
+пропускной способностью и пиковой памятью сервера:
+
+    python bench/run_bench.py --chats 1000 --big-chats 1 --concurrency 16 --output result.json
+
+Результаты разных версий сравниваются по полям scenarios.<имя>.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import threading
+import argparse
+import platform
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_openrouter
+
+SEARCH_WORDS = ["запрос", "модель", "sqlite", "очередь", "память", "функция"]
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, errors, seconds):
+    values = sorted(latencies)
+    return {
+        'requests': len(values) + errors,
+        'errors': errors,
+        'p50_ms': _ms(percentile(values, 50)),
+        'p95_ms': _ms(percentile(values, 95)),
+        'p99_ms': _ms(percentile(values, 99)),
+        'mean_ms': _ms(sum(values) / len(values)) if values else None,
+        'max_ms': _ms(values[-1]) if values else None,
+        'throughput_rps': round(len(values) / seconds, 2) if seconds else None,
+        'seconds': round(seconds, 3)
+    }
+
+def _ms(value):
+    return None if value is None else round(value * 1000, 2)
+
+
+class ServerProcess:
+    """Приложение в режиме --headless в отдельном процессе"""
+
+    def __init__(self, workdir, chats_dir, api_base, port, threads):
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, SYNEDRION_API_BASE=api_base, SYNEDRION_CHATS_DIR=chats_dir, PYTHONUNBUFFERED='1')
+        self.log = open(os.path.join(workdir, 'server.log'), 'w', encoding='utf-8')
+        started = time.time()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, 'app.py'), '--headless', '--port', str(port), '--threads', str(threads)],
+            cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        self.startup_seconds = self._wait_ready(started)
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        threading.Thread(target=self._sample_rss, daemon=True).start()
+
+    def _wait_ready(self, started, timeout=600):
+        while time.time() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Сервер завершился с кодом {self.process.returncode}, см. server.log")
+            try:
+                if requests.get(f"{self.url}/api/version", timeout=1).ok:
+                    return round(time.time() - started, 3)
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("Сервер не запустился")
+
+    def rss_kb(self):
+        """Текущая память процесса (КБ); на Linux - из /proc, иначе через psutil"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        try:
+            import psutil
+            return psutil.Process(self.process.pid).memory_info().rss // 1024
+        except Exception:
+            return None
+
+    def _sample_rss(self):
+        while not self._stop.wait(0.2):
+            rss = self.rss_kb()
+            if rss:
+                self._peak_rss = max(self._peak_rss, rss)
+
+    def peak_rss_kb(self):
+        # VmHWM - точный пик на Linux; на других системах - максимум замеров
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return self._peak_rss or None
+
+    def stop(self):
+        self._stop.set()
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def run_scenario(name, fn, total, concurrency):
+    """Выполняет fn(session, i) total раз в concurrency потоков"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def task(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            fn(local.session, i)
+        except Exception as e:
+            with lock:
+                errors[0] += 1
+                if errors[0] <= 3:
+                    print(f"[{name}] {e}", file=sys.stderr)
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, range(total)))
+    result = summarize(latencies, errors[0], time.perf_counter() - started)
+    print(f"{name}: p50={result['p50_ms']} ms p95={result['p95_ms']} ms rps={result['throughput_rps']} errors={result['errors']}", file=sys.stderr)
+    return result
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.url}: {response.status_code}")
+    return response
+
+
+def end_to_end(url, session, timeout=120):
+    """Новый чат -> сообщение -> create_request -> ответ из потока событий.
+
+    Возвращает время до первого фрагмента ответа (секунды).
+    """
+    chat = check(session.post(f"{url}/api/chats", json={'title': None, 'model': 'bench/mock'})).json()
+    chat_id = chat['id']
+    chat['messages'] = [{'id': int(time.time() * 1000), 'sender': 'user', 'text': 'Вопрос для нагрузочного теста', 'timestamp': ''}]
+    check(session.put(f"{url}/api/chats/{chat_id}", json=chat))
+    started = time.perf_counter()
+    first_token = None
+    with session.get(f"{url}/api/chats/{chat_id}/events", stream=True, timeout=timeout) as events:
+        check(events)
+        check(session.post(f"{url}/api/create_request", json={'chat': f"{chat_id}.json"}))
+        event = None
+        for line in events.iter_lines(decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:') and event in ('delta', 'message'):
+                if event == 'delta' and first_token is None:
+                    first_token = time.perf_counter() - started
+                if event == 'message':
+                    data = json.loads(line[5:])
+                    if data.get('sender') == 'error':
+                        raise RuntimeError(f"Ошибка ответа: {data.get('text', '')[:80]}")
+                    if data.get('sender') == 'ai' and data.get('answer'):
+                        break
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("Нет ответа")
+    return first_token
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def app_version():
+    try:
+        with open(os.path.join(BASE_DIR, 'VERSION.txt'), encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Synedrion")
+    parser.add_argument('--workdir', help="рабочий каталог (по умолчанию временный)")
+    parser.add_argument('--keep', action='store_true', help="не удалять рабочий каталог")
+    parser.add_argument('--reuse-corpus', action='store_true', help="использовать уже созданные чаты из workdir")
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--big-chats', type=int, default=1)
+    parser.add_argument('--big-messages', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help="запросов в сценарии чтения")
+    parser.add_argument('--e2e', type=int, default=50, help="сквозных запросов send -> answer")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--threads', type=int, default=64, help="потоков сервера")
+    parser.add_argument('--latency', type=float, default=0.2, help="задержка заглушки до первого токена, с")
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-502', type=float, default=0.0)
+    parser.add_argument('--output', help="файл для JSON с результатами (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='synedrion-bench-')
+    chats_dir = os.path.join(workdir, 'chats')
+    os.makedirs(workdir, exist_ok=True)
+
+    mock = mock_openrouter.make_server(
+        latency=args.latency, token_delay=args.token_delay, tokens=args.tokens,
+        rate_429=args.rate_429, rate_502=args.rate_502, seed=args.seed
+    )
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{mock.server_address[1]}/api/v1"
+
+    corpus = {'reused': True}
+    if not (args.reuse_corpus and os.path.isdir(chats_dir)):
+        shutil.rmtree(chats_dir, ignore_errors=True)
+        output = subprocess.check_output([
+            sys.executable, os.path.join(BENCH_DIR, 'corpus.py'), '--out', chats_dir,
+            '--chats', str(args.chats), '--messages', str(args.messages),
+            '--big-chats', str(args.big_chats), '--big-messages', str(args.big_messages), '--seed', str(args.seed)
+        ], text=True)
+        corpus = json.loads(output.strip().splitlines()[-1])
+    regular = [f"bench-{i:06d}" for i in range(args.chats)]
+    big = [f"bench-{i:06d}" for i in range(args.chats, args.chats + args.big_chats)]
+
+    # Очередь не должна отклонять запросы сквозного сценария
+    with open(os.path.join(workdir, 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump({'max_workers': 8, 'queue_size': max(32, args.concurrency * 4), 'models': []}, f)
+
+    server = ServerProcess(workdir, chats_dir, api_base, args.port, args.threads)
+    url = server.url
+    rng = random.Random(args.seed)
+    scenarios = {}
+    try:
+        scenarios['list_chats_page'] = run_scenario(
+            'list_chats_page', lambda s, i: check(s.get(f"{url}/api/chats?limit=50")), args.requests, args.concurrency)
+        scenarios['list_chats_full'] = run_scenario(
+            'list_chats_full', lambda s, i: check(s.get(f"{url}/api/chats")), max(1, args.requests // 10), args.concurrency)
+        scenarios['get_chat'] = run_scenario(
+            'get_chat', lambda s, i: check(s.get(f"{url}/api/chats/{rng.choice(regular)}")), args.requests, args.concurrency)
+        if big:
+            scenarios['get_big_chat'] = run_scenario(
+                'get_big_chat', lambda s, i: check(s.get(f"{url}/api/chats/{rng.choice(big)}")), max(1, args.requests // 10), args.concurrency)
+        scenarios['search'] = run_scenario(
+            'search', lambda s, i: check(s.get(f"{url}/api/search", params={'q': rng.choice(SEARCH_WORDS)})), args.requests, args.concurrency)
+        scenarios['create_request'] = run_scenario(
+            'create_request', lambda s, i: check(s.post(f"{url}/api/create_request", json={'chat': f"{rng.choice(regular)}.json"})),
+            max(1, args.requests // 10), args.concurrency)
+        # Дожидаемся, пока очередь разберет запросы предыдущего сценария
+        time.sleep(args.latency + 1)
+        first_tokens = []
+        scenarios['send_to_answer'] = run_scenario(
+            'send_to_answer', lambda s, i: first_tokens.append(end_to_end(url, s)), args.e2e, args.concurrency)
+        ttft = sorted(t for t in first_tokens if t is not None)
+        scenarios['send_to_answer']['first_token_p50_ms'] = _ms(percentile(ttft, 50))
+        scenarios['send_to_answer']['first_token_p95_ms'] = _ms(percentile(ttft, 95))
+        peak_rss = server.peak_rss_kb()
+    finally:
+        server.stop()
+        mock.shutdown()
+
+    result = {
+        'version': app_version(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'corpus': corpus,
+        'server': {'startup_seconds': server.startup_seconds, 'peak_rss_kb': peak_rss},
+        'mock': dict(mock.RequestHandlerClass.config.stats),
+        'scenarios': scenarios
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+if __name__ == '__main__':
+    main()
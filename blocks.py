@@ -0,0 +1,162 @@
+import re
+
+# Блоки ответа по протоколу системного промпта: [RESPONSE]...[/RESPONSE],
+# [CODE:язык]...[/CODE]; [THOUGHTS] встречается, если модель пишет
+# рассуждения прямо в ответ. Текст вне блоков сохраняется как блок 'text'.
+_TAG_RE = re.compile(r'\[(/?)(RESPONSE|THOUGHTS|CODE)(?::\s*([^\]\n]*?))?\s*\]')
+# Самая длинная метка, которую имеет смысл ждать: '[CODE:' + язык + ']'
+MAX_TAG_CHARS = 64
+
+_TYPES = {'RESPONSE': 'response', 'THOUGHTS': 'thoughts', 'CODE': 'code'}
+
+
+class BlockParser:
+    """Разбор ответа модели на блоки по мере поступления фрагментов.
+
+    feed(part) разбирает только новый фрагмент и возвращает изменения
+    блоков для клиента: [{'index', 'type', 'language', 'append', 'closed'}].
+    Метка, разрезанная между фрагментами, ждет следующего фрагмента.
+    Нарушения протокола не ломают разбор: блок, не закрытый до следующей
+    метки или до конца ответа, остается с closed=False, лишние закрывающие
+    метки пропускаются, а внутри [CODE] любые метки, кроме [/CODE], - часть
+    кода.
+
+    blocks() - итоговый список: тип, язык, содержимое и смещения содержимого
+    (start, end) в тексте ответа.
+    """
+
+    def __init__(self):
+        # Еще не разобранный конец текста (начало возможной метки) и его смещение
+        self._buffer = ''
+        self._offset = 0
+        self._blocks = []
+        self._open = None
+        # Пробелы вне блоков: станут началом блока 'text' или пропадут перед меткой
+        self._gap = ''
+        self._gap_start = 0
+
+    def _start(self, block_type, start, language=None):
+        block = {
+            'index': len(self._blocks), 'type': block_type, 'language': language,
+            'start': start, 'end': None, 'closed': False, 'parts': []
+        }
+        self._blocks.append(block)
+        self._open = block
+        return block
+
+    def _change(self, changes, block, text=''):
+        if changes and changes[-1]['index'] == block['index']:
+            change = changes[-1]
+            change['append'] += text
+        else:
+            change = {'index': block['index'], 'type': block['type'], 'language': block['language'], 'append': text}
+            changes.append(change)
+        change['closed'] = block['closed']
+        block['parts'].append(text)
+
+    def _close(self, changes, end, closed):
+        block = self._open
+        if block is not None:
+            block['end'] = end
+            block['closed'] = closed
+            self._open = None
+            self._change(changes, block)
+
+    def _text(self, changes, text, start):
+        """Текст вне меток - в открытый блок или в новый блок 'text'"""
+        if not text:
+            return
+        if self._open is None:
+            if not text.strip():
+                # Пробелы и переводы строк между блоками не создают блок
+                if not self._gap:
+                    self._gap_start = start
+                self._gap += text
+                return
+            if self._gap:
+                text, start = self._gap + text, self._gap_start
+                self._gap = ''
+            self._start('text', start)
+        self._change(changes, self._open, text)
+
+    def feed(self, part):
+        text = self._buffer + part
+        pos = 0
+        changes = []
+        while True:
+            bracket = text.find('[', pos)
+            if bracket == -1:
+                self._text(changes, text[pos:], self._offset + pos)
+                pos = len(text)
+                break
+            match = _TAG_RE.match(text, bracket)
+            if match is None:
+                tail = text[bracket:]
+                if ']' not in tail and '\n' not in tail and len(tail) < MAX_TAG_CHARS:
+                    # Возможно, начало метки - ждем продолжения
+                    self._text(changes, text[pos:bracket], self._offset + pos)
+                    pos = bracket
+                    break
+                self._text(changes, text[pos:bracket + 1], self._offset + pos)
+                pos = bracket + 1
+                continue
+            self._text(changes, text[pos:bracket], self._offset + pos)
+            self._tag(changes, match, self._offset)
+            pos = match.end()
+        self._buffer = text[pos:]
+        self._offset += pos
+        return changes
+
+    def _tag(self, changes, match, offset):
+        closing, name, language = match.group(1), _TYPES[match.group(2)], match.group(3)
+        start, end = offset + match.start(), offset + match.end()
+        self._gap = ''
+        block = self._open
+        if block is not None and block['type'] == 'code' and not (closing and name == 'code'):
+            # Внутри кода метки - обычный текст
+            self._text(changes, match.group(0), start)
+            return
+        if closing:
+            if block is not None and block['type'] in (name, 'text'):
+                self._close(changes, start, closed=block['type'] == name)
+            # Закрывающая метка без открытой - пропускаем
+            return
+        if block is not None:
+            # Новый блок до закрытия предыдущего
+            self._close(changes, start, closed=block['type'] == 'text')
+        language = ((language or '').strip() or 'text') if name == 'code' else None
+        self._change(changes, self._start(name, end, language))
+
+    def finish(self):
+        """Конец ответа: недописанная метка становится текстом, открытый блок закрывается"""
+        changes = []
+        self._text(changes, self._buffer, self._offset)
+        self._offset += len(self._buffer)
+        self._buffer = ''
+        if self._open is not None:
+            self._close(changes, self._offset, closed=self._open['type'] == 'text')
+        return changes
+
+    def blocks(self):
+        result = []
+        for block in self._blocks:
+            content = ''.join(block['parts'])
+            item = {
+                'type': block['type'],
+                'content': content,
+                'start': block['start'],
+                'end': block['start'] + len(content),
+                'closed': block['closed']
+            }
+            if block['language']:
+                item['language'] = block['language']
+            result.append(item)
+        return result
+
+
+def parse_blocks(text):
+    """Блоки готового ответа"""
+    parser = BlockParser()
+    parser.feed(text or '')
+    parser.finish()
+    return parser.blocks()
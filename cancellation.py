@@ -0,0 +1,62 @@
+import threading
+
+
+class Cancelled(Exception):
+    """Запрос отменен (пользователем или более новым запросом того же чата)"""
+
+
+class CancelToken:
+    """Признак отмены одного запроса.
+
+    cancel() выставляет признак и вызывает обработчики on_cancel - так
+    отмена сразу закрывает соединение и будит ожидание ключа, а не ждет,
+    пока код сам проверит признак. wait() заменяет time.sleep в местах,
+    где запрос ждет: отмена прерывает ожидание.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        """Регистрирует callback() на отмену; возвращает функцию, снимающую его.
+
+        Если запрос уже отменен, callback вызывается сразу.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled("Запрос отменен")
+
+    def wait(self, timeout):
+        """Ждет timeout секунд; при отмене выбрасывает Cancelled сразу"""
+        if self._event.wait(timeout):
+            raise Cancelled("Запрос отменен")
@@ -0,0 +1,188 @@
+from datetime import datetime
+import threading
+import base64
+import json
+
+import db
+import chat_store
+
+ORDER_COLUMNS = ('created_at', 'updated_at', 'title')
+PREVIEW_LEN = 30
+
+
+def make_preview(text):
+    """Превью чата без названия - начало первого сообщения пользователя"""
+    text = text or ''
+    return text[:PREVIEW_LEN] + '...' if len(text) > PREVIEW_LEN else text
+
+def display_title(row):
+    return row['title'] or row['preview'] or 'Пустой чат'
+
+def encode_cursor(value, chat_id):
+    raw = json.dumps([value, chat_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        value, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, chat_id
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+
+
+class ChatCatalog:
+    """Каталог чатов в SQLite для быстрого вывода списка.
+
+    Хранит только то, что нужно списку (название, превью, модель, даты),
+    и обновляется из записей журнала через chat_store.add_listener, поэтому
+    GET /api/chats не читает файлы чатов. Список отдается страницами по
+    курсору (значение столбца сортировки и id последнего чата страницы).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = db.connect(path)
+        # RLock: rebuild() может вызвать on_change через перевод старых чатов в журнал
+        self._lock = threading.RLock()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chats (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                preview TEXT,
+                model TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        for column in ORDER_COLUMNS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS chats_{column} ON chats ({column}, id)")
+
+    def _upsert(self, chat_id, chat, ts):
+        preview = None
+        for message in chat.get('messages', []):
+            if message.get('sender') == 'user':
+                preview = make_preview(message.get('text'))
+                break
+        ts = ts or datetime.now().isoformat()
+        created_at = chat.get('created_at') or ts
+        self._conn.execute("""
+            INSERT OR REPLACE INTO chats (id, title, preview, model, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (chat_id, chat.get('title'), preview, chat.get('model'), created_at, chat.get('updated_at') or ts))
+
+    def on_change(self, op, chat_id, record):
+        """Обработчик записей журнала (см. chat_store.add_listener)"""
+        ts = record.get('ts')
+        with self._lock:
+            if op == 'create':
+                self._upsert(chat_id, record['chat'], ts)
+            elif op == 'delete':
+                self._conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            elif op == 'header':
+                fields = record.get('chat', {})
+                assignments = ['updated_at = MAX(updated_at, ?)']
+                params = [fields.get('updated_at') or ts]
+                for column in ('title', 'model', 'created_at'):
+                    if column in fields:
+                        assignments.append(f"{column} = ?")
+                        params.append(fields[column])
+                self._conn.execute(f"UPDATE chats SET {', '.join(assignments)} WHERE id = ?", params + [chat_id])
+            elif op in ('put', 'del'):
+                self._conn.execute("UPDATE chats SET updated_at = MAX(updated_at, ?) WHERE id = ?", (ts, chat_id))
+                message = record.get('message') or {}
+                if op == 'put' and message.get('sender') == 'user':
+                    self._conn.execute(
+                        "UPDATE chats SET preview = ? WHERE id = ? AND preview IS NULL",
+                        (make_preview(message.get('text')), chat_id)
+                    )
+
+    def list(self, limit=None, cursor=None, order='created_at', direction='desc'):
+        """Страница списка чатов и курсор следующей страницы (None - страниц больше нет)"""
+        if order not in ORDER_COLUMNS:
+            raise ValueError(f"Недопустимая сортировка: {order}")
+        if direction not in ('asc', 'desc'):
+            raise ValueError(f"Недопустимое направление сортировки: {direction}")
+        op = '<' if direction == 'desc' else '>'
+        sql = "SELECT * FROM chats"
+        params = []
+        if cursor:
+            value, chat_id = decode_cursor(cursor)
+            sql += f" WHERE ({order} {op} ?) OR ({order} = ? AND id {op} ?)"
+            params += [value, value, chat_id]
+        sql += f" ORDER BY {order} {direction}, id {direction}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][order], rows[-1]['id'])
+        chats = [{
+            'id': row['id'],
+            'title': display_title(row),
+            'model': row['model'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        } for row in rows]
+        return chats, next_cursor
+
+    def title(self, chat_id):
+        """Отображаемое название чата или None, если его нет в каталоге"""
+        row = self._conn.execute("SELECT title, preview FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return display_title(row) if row else None
+
+    def updated_before(self, cutoff):
+        """id чатов, не менявшихся после cutoff (ISO-время)"""
+        return [row[0] for row in self._conn.execute("SELECT id FROM chats WHERE updated_at < ?", (cutoff,))]
+
+    def find(self, before=None, after=None, model=None, page=1000):
+        """id чатов по фильтру: менялись до before / не раньше after (ISO-время), модель.
+
+        Генератор: каталог читается страницами по page id, поэтому перебор
+        всех чатов не держит их список в памяти и не мешает удалять найденные.
+        """
+        conditions = []
+        params = []
+        if before:
+            conditions.append("updated_at < ?")
+            params.append(before)
+        if after:
+            conditions.append("updated_at >= ?")
+            params.append(after)
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        last = ''
+        while True:
+            rows = self._conn.execute(
+                f"SELECT id FROM chats WHERE {' AND '.join(conditions + ['id > ?'])} ORDER BY id LIMIT ?",
+                params + [last, page]
+            ).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < page:
+                return
+            last = rows[-1][0]
+
+    def count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    def rebuild(self):
+        """Заполняет каталог заново по файлам чатов (разовая операция)"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM chats")
+                for chat_id in chat_store.list_chat_ids():
+                    try:
+                        chat, _ = chat_store.read_log(chat_id)
+                    except Exception:
+                        continue
+                    if chat is not None:
+                        self._upsert(chat_id, chat, chat.get('updated_at'))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.count()
@@ -0,0 +1,606 @@
+from datetime import datetime
+from contextlib import contextmanager
+import threading
+import logging
+import weakref
+import json
+import time
+import os
+
+import storage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Каталог с чатами можно переопределить (SYNEDRION_CHATS_DIR), например для bench/
+CHATS_DIR = os.environ.get('SYNEDRION_CHATS_DIR') or os.path.join(BASE_DIR, 'chats')
+os.makedirs(CHATS_DIR, exist_ok=True)
+
+# Журнал перезаписывается целиком, только когда устаревших записей
+# становится больше, чем живых сообщений (и не меньше COMPACT_MIN_RECORDS)
+COMPACT_MIN_RECORDS = 64
+
+LOADING_MARKER = '[LOADING:'
+
+# Сообщений на странице read_window по умолчанию
+PAGE_SIZE = 50
+# Сколько записей журнала read_window читает после набранной страницы -
+# на случай записей, чуть нарушающих порядок id
+WINDOW_MARGIN = 16
+
+# Как часто экземпляр с общим хранилищем читает ленту изменений других (секунды)
+SYNC_INTERVAL = 1.0
+
+logger = logging.getLogger("synedrion.chat_store")
+
+
+# Хранилище чатов в виде журнала с дозаписью.
+#
+# Каждый чат - файл chats/<id>.jsonl, по одной JSON-записи на строку:
+#   {"op": "header", "chat": {...}}   - поля чата (title, model, ...), частичное обновление
+#   {"op": "put", "message": {...}}   - новое сообщение или новая версия сообщения с тем же id
+#   {"op": "del", "id": ...}          - удаление сообщения
+# У каждой записи есть "ts" - время записи. Изменение чата дописывает в конец
+# файла только новые записи, а не переписывает весь чат.
+#
+# Временное состояние (индикатор загрузки [LOADING]) хранится отдельно в
+# chats/<id>.state.json и не попадает в журнал.
+#
+# Чаты старого формата chats/<id>.json переводятся в журнал при первом обращении.
+#
+# Давно не менявшиеся чаты могут быть перенесены в архив (archive.py, см.
+# set_archive): read_log читает их прямо из архива, а load_chat и запись в
+# чат возвращают журнал в каталог чатов.
+#
+# Открытие длинного чата не читает журнал целиком: read_window читает его с
+# конца и собирает только последнюю страницу сообщений, read_header - только
+# записи заголовка.
+#
+# Подписчики (add_listener) получают каждую записанную запись журнала - так
+# каталог чатов и другие индексы обновляются без повторного чтения файлов.
+#
+# Запись в чат идет под блокировкой этого чата (chat_lock): разные чаты
+# пишутся параллельно, а запросы к одному чату не перемешивают строки журнала.
+# Файлы целиком (перезапись журнала, состояние) пишутся во временный файл и
+# подменяются через os.replace, поэтому читатель не видит недописанный файл.
+#
+# Журналы и состояние хранит _backend (storage.py): файлы каталога чатов или,
+# если задана SYNEDRION_STORAGE, общая база нескольких экземпляров приложения.
+# Тогда изменения других экземпляров приходят подписчикам через start_sync.
+# Архив и чаты старого формата - только локальные файлы каталога чатов.
+
+_backend = storage.create_backend(CHATS_DIR)
+_listeners = []
+_archive = None
+_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+# Чаты, блокировку которых в общем хранилище держит текущий поток
+_held = threading.local()
+
+
+def add_listener(listener, remote_only=False):
+    """Регистрирует listener(op, chat_id, record), вызываемый после каждой записи.
+
+    op - 'create', 'header', 'put', 'del' или 'delete' (удаление чата).
+    При общем хранилище listener получает и изменения других экземпляров;
+    remote_only - только их (например, для потоков событий, которые о своих
+    изменениях узнают напрямую).
+    """
+    _listeners.append((listener, remote_only))
+
+def is_shared():
+    """Чаты хранятся в общей базе нескольких экземпляров"""
+    return _backend.shared
+
+def set_archive(archive):
+    """Подключает архив чатов (archive.ChatArchive)"""
+    global _archive
+    _archive = archive
+
+def _notify(op, chat_id, record, remote=False):
+    for listener, remote_only in list(_listeners):
+        if remote_only and not remote:
+            continue
+        try:
+            listener(op, chat_id, record)
+        except Exception:
+            logger.exception(f"Ошибка обработчика изменений чата {chat_id}")
+
+
+@contextmanager
+def _local_lock(chat_id):
+    with _locks_guard:
+        lock = _locks.get(chat_id)
+        if lock is None:
+            lock = _locks[chat_id] = threading.RLock()
+    with lock:
+        yield
+
+@contextmanager
+def chat_lock(chat_id):
+    """Блокировка одного чата; повторный захват тем же потоком разрешен.
+
+    При общем хранилище блокируется и чат в базе (_backend.lock), иначе два
+    экземпляра могли бы одновременно прочитать, слить и записать один чат
+    (save_chat) и потерять изменения друг друга.
+    """
+    with _local_lock(chat_id):
+        held = getattr(_held, 'chats', None)
+        if held is None:
+            held = _held.chats = set()
+        if not _backend.shared or chat_id in held:
+            yield
+            return
+        held.add(chat_id)
+        try:
+            with _backend.lock(chat_id):
+                yield
+        finally:
+            held.discard(chat_id)
+
+def _check_id(chat_id):
+    if not chat_id or os.path.basename(chat_id) != chat_id or chat_id.startswith('.'):
+        raise ValueError(f"Некорректный id чата: {chat_id}")
+    return chat_id
+
+def valid_id(chat_id):
+    """id можно использовать как имя журнала чата"""
+    try:
+        return isinstance(chat_id, str) and bool(_check_id(chat_id))
+    except ValueError:
+        return False
+
+def chat_id_from_filename(filename):
+    """'<id>.json' (формат, который передает клиент) -> '<id>'"""
+    return filename[:-5] if filename.endswith('.json') else filename
+
+def log_path(chat_id):
+    """Файл журнала чата (только для файлового хранилища)"""
+    return _backend.log_path(_check_id(chat_id))
+
+def state_path(chat_id):
+    return _backend.state_path(_check_id(chat_id))
+
+def legacy_path(chat_id):
+    return os.path.join(CHATS_DIR, f"{_check_id(chat_id)}.json")
+
+def is_transient(message):
+    """Индикатор загрузки или еще не завершенный потоковый ответ - такие
+    сообщения не сохраняются в журнал"""
+    if message.get('streaming'):
+        return True
+    return message.get('sender') == 'ai' and LOADING_MARKER in (message.get('text') or '')
+
+def _now():
+    return datetime.now().isoformat()
+
+_dumps = storage.dumps
+
+def _header_of(chat):
+    return {k: v for k, v in chat.items() if k != 'messages'}
+
+def _append(chat_id, records):
+    ts = _now()
+    for record in records:
+        record.setdefault('ts', ts)
+    with chat_lock(chat_id):
+        # FileNotFoundError, если чат удален: дозапись создала бы журнал без заголовка
+        _backend.append(_check_id(chat_id), records)
+        for record in records:
+            _notify(record['op'], chat_id, record)
+
+def render_log(chat):
+    """Текст журнала чата: заголовок и по одной записи на сообщение"""
+    ts = chat.get('updated_at') or _now()
+    lines = [_dumps({'op': 'header', 'chat': _header_of(chat), 'ts': ts}) + '\n']
+    for message in chat.get('messages', []):
+        lines.append(_dumps({'op': 'put', 'message': message, 'ts': ts}) + '\n')
+    return ''.join(lines)
+
+def _write_log(chat_id, chat, change=None):
+    """Записывает журнал заново; change - вид изменения для ленты общего хранилища"""
+    _backend.write(_check_id(chat_id), render_log(chat), change)
+
+def _migrate_legacy(chat_id):
+    path = legacy_path(chat_id)
+    if not os.path.exists(path) or _backend.exists(chat_id):
+        return
+    with chat_lock(chat_id):
+        # Другой поток мог перевести чат, пока мы ждали блокировку
+        if not os.path.exists(path) or _backend.exists(chat_id):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            chat = json.load(f)
+        chat['messages'] = [m for m in chat.get('messages', []) if not is_transient(m)]
+        _write_log(chat_id, chat, 'create')
+        os.remove(path)
+        _notify('create', chat_id, {'op': 'create', 'chat': chat, 'ts': chat.get('updated_at') or _now()})
+
+def _restore_archived(chat_id):
+    """Возвращает журнал архивного чата в каталог чатов"""
+    if _archive is None or _backend.exists(chat_id) or not _archive.contains(chat_id):
+        return
+    with chat_lock(chat_id):
+        if _backend.exists(chat_id):
+            return
+        text = _archive.read(chat_id)
+        if text is None:
+            return
+        _backend.write(chat_id, text)
+        _archive.remove(chat_id)
+        logger.info(f"Чат {chat_id} возвращен из архива")
+
+def _materialize(chat_id):
+    """Журнал чата в каталоге чатов перед записью: из архива или старого формата"""
+    _restore_archived(chat_id)
+    _migrate_legacy(chat_id)
+
+def chat_exists(chat_id):
+    try:
+        return (_backend.exists(_check_id(chat_id)) or os.path.exists(legacy_path(chat_id))
+                or (_archive is not None and _archive.contains(chat_id)))
+    except ValueError:
+        return False
+
+def chat_stamp(chat_id):
+    """Отметки (mtime, размер) файлов чата - меняются при любом изменении чата.
+
+    None, если чата нет.
+    """
+    stamp = _backend.stamp(_check_id(chat_id))
+    if stamp:
+        return stamp
+    try:
+        st = os.stat(legacy_path(chat_id))
+        return ('legacy', st.st_mtime_ns, st.st_size)
+    except OSError:
+        pass
+    archived = _archive.stamp(chat_id) if _archive is not None else None
+    return ('archive', archived) if archived else None
+
+def list_chat_ids():
+    ids = set(_backend.ids())
+    for filename in os.listdir(CHATS_DIR):
+        # Чаты старого формата
+        if filename.endswith('.json') and not filename.endswith('.state.json'):
+            ids.add(filename[:-5])
+    if _archive is not None:
+        ids.update(_archive.ids())
+    return sorted(ids)
+
+def read_log(chat_id):
+    """Собирает чат из журнала. Возвращает (чат, число записей) или (None, 0).
+
+    Архивный чат читается из архива и остается в нем.
+    """
+    _migrate_legacy(chat_id)
+    lines = _backend.lines(_check_id(chat_id))
+    if lines is not None:
+        return _parse_log(lines)
+    text = _archive.read(chat_id) if _archive is not None else None
+    if text is None:
+        return None, 0
+    return _parse_log(text.splitlines())
+
+def _parse_log(lines):
+    chat = {}
+    messages = {}
+    records = 0
+    last_ts = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Недописанная строка после сбоя - пропускаем
+            continue
+        records += 1
+        op = record.get('op')
+        if op == 'header':
+            chat.update(record.get('chat', {}))
+        elif op == 'put':
+            message = record['message']
+            messages[message.get('id')] = message
+        elif op == 'del':
+            messages.pop(record.get('id'), None)
+        last_ts = record.get('ts') or last_ts
+    chat['messages'] = list(messages.values())
+    if last_ts and last_ts > chat.get('updated_at', ''):
+        chat['updated_at'] = last_ts
+    return chat, records
+
+def read_state(chat_id):
+    text = _backend.read_state(_check_id(chat_id))
+    if not text:
+        return None
+    try:
+        return json.loads(text).get('message')
+    except ValueError:
+        return None
+
+def load_chat(chat_id):
+    """Чат целиком вместе с индикатором загрузки, если ответ еще генерируется.
+
+    Открытый архивный чат возвращается из архива в каталог чатов.
+    """
+    _restore_archived(chat_id)
+    chat, records = read_log(chat_id)
+    if chat is None:
+        return None
+    if records >= COMPACT_MIN_RECORDS and records > 2 * len(chat['messages']) + 1:
+        try:
+            compact(chat_id)
+        except OSError:
+            # Сжатие необязательно - повторится при следующем чтении
+            logger.warning(f"Не удалось сжать журнал чата {chat_id}", exc_info=True)
+    transient = read_state(chat_id)
+    if transient and all(m.get('id') != transient.get('id') for m in chat['messages']):
+        chat['messages'].append(transient)
+    return chat
+
+def _reverse_records(chat_id):
+    """Записи журнала от последней к первой или None, если чата нет"""
+    _migrate_legacy(chat_id)
+    lines = _backend.reverse_lines(_check_id(chat_id))
+    if lines is None:
+        text = _archive.read(chat_id) if _archive is not None else None
+        if text is None:
+            return None
+        lines = reversed(text.splitlines())
+    return (record for record in map(_load_record, lines) if record is not None)
+
+def _load_record(line):
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        # Недописанная строка после сбоя - пропускаем
+        return None
+
+def _order_key(message_id):
+    """Порядок сообщений в странице: id - время создания в мс"""
+    return message_id if isinstance(message_id, (int, float)) else -1
+
+def read_window(chat_id, before=None, limit=PAGE_SIZE):
+    """Последние limit сообщений чата с id меньше before.
+
+    Журнал читается с конца и только до набранной страницы, поэтому время
+    не зависит от длины чата. Для последней страницы (before=None)
+    добавляется индикатор загрузки, если ответ еще генерируется.
+    Возвращает (сообщения по возрастанию id, есть ли более старые) или
+    (None, False), если чата нет.
+    """
+    records = _reverse_records(chat_id)
+    if records is None:
+        return None, False
+    found = {}
+    skipped = set()
+    margin = None
+    for record in records:
+        op = record.get('op')
+        if op == 'del':
+            # Запись удаления идет после записи сообщения - оно уже не встретится
+            skipped.add(record.get('id'))
+        elif op == 'put':
+            message = record.get('message') or {}
+            message_id = message.get('id')
+            if message_id in skipped or message_id in found:
+                continue
+            if before is not None and _order_key(message_id) >= before:
+                skipped.add(message_id)
+                continue
+            # Первая встреченная с конца версия сообщения - последняя
+            found[message_id] = message
+        if margin is None and len(found) > limit:
+            margin = WINDOW_MARGIN
+        elif margin is not None:
+            margin -= 1
+            if margin <= 0:
+                break
+    messages = sorted(found.values(), key=lambda m: _order_key(m.get('id')))
+    has_more = len(messages) > limit
+    messages = messages[-limit:] if limit else []
+    if before is None:
+        transient = read_state(chat_id)
+        if transient and transient.get('id') not in found:
+            messages.append(transient)
+    return messages, has_more
+
+def read_message(chat_id, message_id):
+    """Последняя версия одного сообщения или None"""
+    records = _reverse_records(chat_id)
+    for record in records or ():
+        op = record.get('op')
+        if op == 'del' and record.get('id') == message_id:
+            return None
+        if op == 'put' and (record.get('message') or {}).get('id') == message_id:
+            return record['message']
+    transient = read_state(chat_id)
+    if transient and transient.get('id') == message_id:
+        return transient
+    return None
+
+_HEADER_PREFIX = '{"op":"header"'
+
+def read_header(chat_id):
+    """Поля чата без сообщений или None, если чата нет.
+
+    Разбираются только записи заголовка: остальные строки журнала
+    отбрасываются, не доходя до json.loads.
+    """
+    _migrate_legacy(chat_id)
+    lines = _backend.lines(_check_id(chat_id), op='header')
+    if lines is not None:
+        last = next(_reverse_records(chat_id) or iter(()), None)
+    else:
+        text = _archive.read(chat_id) if _archive is not None else None
+        if text is None:
+            return None
+        lines = [line for line in text.splitlines() if line.startswith(_HEADER_PREFIX)]
+        last = next((r for r in map(_load_record, reversed(text.splitlines())) if r is not None), None)
+    chat = {}
+    for record in map(_load_record, lines):
+        if record is not None:
+            chat.update(record.get('chat', {}))
+    chat.pop('messages', None)
+    last_ts = last.get('ts') if last else None
+    if last_ts and last_ts > chat.get('updated_at', ''):
+        chat['updated_at'] = last_ts
+    return chat
+
+def compact(chat_id):
+    """Переписывает журнал, убирая устаревшие версии и удаленные сообщения"""
+    with chat_lock(chat_id):
+        # Журнал перечитывается под блокировкой: переданная копия могла устареть
+        chat, _ = read_log(chat_id)
+        if chat is None:
+            return
+        _write_log(chat_id, chat)
+
+def create_chat(chat):
+    chat = dict(chat)
+    chat['messages'] = [m for m in chat.get('messages', []) if not is_transient(m)]
+    with chat_lock(chat['id']):
+        _write_log(chat['id'], chat, 'create')
+        _notify('create', chat['id'], {'op': 'create', 'chat': chat, 'ts': chat.get('updated_at') or _now()})
+    return chat
+
+def update_header(chat_id, fields):
+    _materialize(chat_id)
+    _append(chat_id, [{'op': 'header', 'chat': fields}])
+
+def put_message(chat_id, message):
+    """Добавляет сообщение или новую версию сообщения с тем же id"""
+    _materialize(chat_id)
+    _append(chat_id, [{'op': 'put', 'message': message}])
+
+def delete_message(chat_id, message_id):
+    _materialize(chat_id)
+    _append(chat_id, [{'op': 'del', 'id': message_id}])
+
+def _newer(message_id, newest):
+    """Сообщение появилось позже копии клиента (id сообщений - время в мс)"""
+    try:
+        return newest is not None and message_id > newest
+    except TypeError:
+        return False
+
+def save_chat(chat_id, chat):
+    """Сохраняет присланный клиентом чат, дописывая только отличия от журнала.
+
+    Слияние идет по id сообщений. Сообщения, которых нет у клиента, но которые
+    новее его последнего сообщения, добавлены сервером (ответ ИИ) после того,
+    как клиент получил чат, - они сохраняются, а не удаляются.
+    """
+    with chat_lock(chat_id):
+        _materialize(chat_id)
+        current, _ = read_log(chat_id)
+        if current is None:
+            return create_chat(dict(chat, id=chat_id))
+        records = []
+        header = _header_of(chat)
+        current_header = _header_of(current)
+        changed = {k: v for k, v in header.items() if current_header.get(k) != v}
+        if changed:
+            records.append({'op': 'header', 'chat': changed})
+        current_messages = {m.get('id'): m for m in current['messages']}
+        new_ids = set()
+        for message in chat.get('messages', []):
+            if is_transient(message):
+                continue
+            new_ids.add(message.get('id'))
+            if current_messages.get(message.get('id')) != message:
+                records.append({'op': 'put', 'message': message})
+        newest = max((i for i in new_ids if isinstance(i, (int, float))), default=None)
+        for message_id in current_messages:
+            if message_id not in new_ids and not _newer(message_id, newest):
+                records.append({'op': 'del', 'id': message_id})
+        if records:
+            _append(chat_id, records)
+        return load_chat(chat_id)
+
+def set_transient(chat_id, message):
+    """Сохраняет индикатор загрузки, не трогая журнал чата"""
+    with chat_lock(chat_id):
+        if not chat_exists(chat_id):
+            # Чат удалили, пока генерировался ответ
+            return
+        _backend.write_state(chat_id, json.dumps({'message': message}, ensure_ascii=False))
+
+def clear_transient(chat_id):
+    with chat_lock(chat_id):
+        _backend.clear_state(_check_id(chat_id))
+
+def delete_chat(chat_id):
+    """Удаляет все файлы чата. Возвращает False, если чата не было"""
+    with chat_lock(chat_id):
+        found = _backend.delete(_check_id(chat_id))
+        if os.path.exists(legacy_path(chat_id)):
+            os.remove(legacy_path(chat_id))
+            found = True
+        if _archive is not None and _archive.remove(chat_id):
+            found = True
+        if found:
+            _notify('delete', chat_id, {'op': 'delete', 'ts': _now()})
+    return found
+
+
+def _read_cursor(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def start_sync(cursor_path, on_gap=None):
+    """Применяет изменения других экземпляров из ленты общего хранилища.
+
+    Позиция ленты хранится в cursor_path. Если экземпляр отстал дальше,
+    чем хранится лента (или запускается впервые), вызывается on_gap() -
+    локальные индексы нужно перестроить целиком. Для файлового хранилища
+    ничего не делает.
+    """
+    if not _backend.shared:
+        return None
+    cursor = _read_cursor(cursor_path)
+    last, first = _backend.position()
+    if cursor is None or (first is not None and cursor < first - 1) or cursor > last:
+        cursor = last
+        if on_gap:
+            on_gap()
+
+    def apply(chat_id, op, record):
+        if op == 'create':
+            # Чат целиком в ленту не пишется - читаем его
+            chat, _ = read_log(chat_id)
+            if chat is None:
+                return
+            record = {'op': 'create', 'chat': chat, 'ts': chat.get('updated_at') or _now()}
+        _notify(op, chat_id, record, remote=True)
+
+    def apply_locked(chat_id, op, record):
+        # Под локальной блокировкой чата: перестроение индексов (search_index.rebuild)
+        # не перезапишет применяемое изменение устаревшей копией чата
+        with _local_lock(chat_id):
+            apply(chat_id, op, record)
+
+    def loop():
+        position = cursor
+        while True:
+            try:
+                changes, new_position = _backend.changes(position)
+                for chat_id, op, record in changes:
+                    apply_locked(chat_id, op, record)
+                if new_position != position:
+                    position = new_position
+                    storage.write_atomic(cursor_path, str(position))
+                    # Лента могла не уместиться в одну выборку - читаем дальше без паузы
+                    continue
+            except Exception:
+                logger.exception("Ошибка чтения ленты изменений общего хранилища")
+            time.sleep(SYNC_INTERVAL)
+
+    thread = threading.Thread(target=loop, name="chat-sync", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime
+import tempfile
+import zipfile
+import logging
+import json
+import time
+
+import chat_store
+import storage
+
+logger = logging.getLogger("synedrion.chat_transfer")
+
+EXPORT_FORMATS = ('ndjson', 'zip')
+
+# Чатов в одной порции импорта и потоков записи по умолчанию
+IMPORT_BATCH = 100
+IMPORT_WORKERS = 4
+MAX_IMPORT_BATCH = 1000
+MAX_IMPORT_WORKERS = 16
+# Наибольший размер одного чата (строки NDJSON или файла в zip)
+MAX_CHAT_BYTES = 64 * 1024 * 1024
+# Сколько ошибок перечисляется в отчете импорта (считаются все)
+MAX_REPORTED_ERRORS = 100
+# Загруженный zip до этого размера держится в памяти, больше - во временном файле
+ZIP_SPOOL_BYTES = 8 * 1024 * 1024
+# Загрузка читается кусками такого размера
+READ_CHUNK = 1024 * 1024
+CONFLICT_MODES = ('skip', 'replace')
+
+
+# Перенос чатов целиком: выгрузка, загрузка и удаление по фильтру.
+#
+# Выгрузка - поток: NDJSON (по чату на строку) или zip с файлами <id>.json
+# в формате старых chats/<id>.json. Чаты читаются и отдаются по одному, поэтому
+# память не зависит от их числа. Загрузка принимает те же форматы, проверяет
+# каждый чат и пишет их порциями в несколько потоков; в памяти находится не
+# больше нескольких порций. Чат с id, который уже есть, пропускается или
+# заменяется (on_conflict), повтор id внутри загрузки пропускается.
+
+
+def export_chat(chat_id):
+    """Чат для выгрузки (без индикатора загрузки) или None, если его уже нет"""
+    chat, _ = chat_store.read_log(chat_id)
+    if chat is None:
+        return None
+    chat['id'] = chat_id
+    return chat
+
+def export_ndjson(chat_ids):
+    """Генератор строк NDJSON (bytes), по одной на чат"""
+    for chat_id in chat_ids:
+        chat = export_chat(chat_id)
+        if chat is not None:
+            yield (storage.dumps(chat) + '\n').encode('utf-8')
+
+
+class _ChunkWriter:
+    """Файл без seek для zipfile: записанное забирается кусками через take()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def export_zip(chat_ids):
+    """Генератор кусков zip-архива (bytes) с файлами <id>.json.
+
+    zipfile пишет в поток без seek (размеры - в дескрипторах после данных),
+    поэтому архив отдается по мере сборки, по куску на чат.
+    """
+    out = _ChunkWriter()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for chat_id in chat_ids:
+            chat = export_chat(chat_id)
+            if chat is None:
+                continue
+            info = zipfile.ZipInfo(f"{chat_id}.json", time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, json.dumps(chat, ensure_ascii=False, indent=2))
+            yield out.take()
+    # Центральный каталог архива пишется при закрытии
+    yield out.take()
+
+
+def validate_chat(chat):
+    """Проверяет чат из загрузки и приводит его к виду create_chat.
+
+    ValueError с описанием, если чат нельзя сохранить.
+    """
+    if not isinstance(chat, dict):
+        raise ValueError("Чат должен быть JSON-объектом")
+    if not chat_store.valid_id(chat.get('id')):
+        raise ValueError(f"Некорректный id чата: {chat.get('id')!r}")
+    for field in ('title', 'model', 'system_prompt', 'created_at', 'updated_at'):
+        if chat.get(field) is not None and not isinstance(chat[field], str):
+            raise ValueError(f"Поле {field} должно быть строкой")
+    messages = chat.get('messages', [])
+    if not isinstance(messages, list):
+        raise ValueError("Поле messages должно быть списком")
+    for message in messages:
+        if not isinstance(message, dict) or message.get('id') is None or not message.get('sender'):
+            raise ValueError("Каждое сообщение должно быть объектом с полями id и sender")
+    try:
+        reasoning_len = max(0, min(2500, int(chat.get('reasoning_len', 1000))))
+    except (TypeError, ValueError):
+        raise ValueError("Поле reasoning_len должно быть числом")
+    now = datetime.now().isoformat()
+    return dict(
+        chat,
+        messages=messages,
+        reasoning_len=reasoning_len,
+        created_at=chat.get('created_at') or now,
+        updated_at=chat.get('updated_at') or chat.get('created_at') or now
+    )
+
+
+def _parse(data, where):
+    try:
+        return validate_chat(json.loads(data)), where
+    except ValueError as e:
+        # json.JSONDecodeError - тоже ValueError
+        return None, dict(where, error=str(e))
+
+def _lines(stream):
+    """Строки потока кусками по READ_CHUNK байт.
+
+    readline потока запроса (werkzeug) читает мелкими порциями и на больших
+    загрузках во много раз медленнее. Строка длиннее MAX_CHAT_BYTES не
+    накапливается: вместо нее отдается None.
+    """
+    pieces = []
+    size = 0
+    oversized = False
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        lines = chunk.split(b'\n')
+        for line in lines[:-1]:
+            pieces.append(line)
+            yield None if oversized else b''.join(pieces)
+            pieces, size, oversized = [], 0, False
+        pieces.append(lines[-1])
+        size += len(lines[-1])
+        if size > MAX_CHAT_BYTES:
+            pieces, size, oversized = [], 0, True
+    if size or oversized:
+        yield None if oversized else b''.join(pieces)
+
+def read_ndjson(stream):
+    """Чаты из потока NDJSON: генератор пар (чат, место) или (None, ошибка).
+
+    Место - {'line': номер строки}, ошибка - оно же с полем error.
+    """
+    for number, line in enumerate(_lines(stream), 1):
+        if line is None:
+            yield None, {'line': number, 'error': f"Чат больше {MAX_CHAT_BYTES} байт"}
+        elif line.strip():
+            yield _parse(line, {'line': number})
+
+def spool_upload(stream):
+    """Загруженный zip во временный файл (zipfile нужен seek)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def read_zip(fileobj):
+    """Чаты из zip-архива с файлами <id>.json: генератор пар, как read_ndjson.
+
+    zipfile.BadZipFile, если это не zip.
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            where = {'entry': info.filename}
+            if not info.filename.endswith('.json'):
+                yield None, dict(where, error="Ожидается файл <id>.json")
+            elif info.file_size > MAX_CHAT_BYTES:
+                yield None, dict(where, error=f"Чат больше {MAX_CHAT_BYTES} байт")
+            else:
+                yield _parse(archive.read(info), where)
+
+
+def _write_batch(batch, on_conflict):
+    result = {'imported': 0, 'replaced': 0, 'skipped': 0, 'errors': []}
+    for chat, where in batch:
+        chat_id = chat['id']
+        try:
+            with chat_store.chat_lock(chat_id):
+                exists = chat_store.chat_exists(chat_id)
+                if exists and on_conflict == 'skip':
+                    result['skipped'] += 1
+                    continue
+                if exists:
+                    # Удаление убирает и копии чата в архиве и старом формате
+                    chat_store.delete_chat(chat_id)
+                chat_store.create_chat(chat)
+            result['replaced' if exists else 'imported'] += 1
+        except Exception as e:
+            logger.exception(f"Не удалось сохранить чат {chat_id} при загрузке")
+            result['errors'].append(dict(where, id=chat_id, error=str(e)))
+    return result
+
+def import_chats(items, on_conflict='skip', batch=IMPORT_BATCH, workers=IMPORT_WORKERS):
+    """Сохраняет чаты из read_ndjson/read_zip и возвращает отчет.
+
+    Чаты пишутся порциями по batch в workers потоков; читается не больше
+    двух порций на поток вперед, поэтому память ограничена. В памяти за всю
+    загрузку копятся только id чатов - для пропуска повторов.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"on_conflict должен быть одним из: {', '.join(CONFLICT_MODES)}")
+    report = {'imported': 0, 'replaced': 0, 'skipped': 0, 'failed': 0, 'duplicates': 0, 'errors': []}
+
+    def add_error(error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append(error)
+
+    def collect(future):
+        result = future.result()
+        for key in ('imported', 'replaced', 'skipped'):
+            report[key] += result[key]
+        for error in result['errors']:
+            add_error(error)
+
+    seen = set()
+    pending = deque()
+    current = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-import") as pool:
+        def submit():
+            pending.append(pool.submit(_write_batch, list(current), on_conflict))
+            current.clear()
+            while len(pending) >= 2 * workers:
+                collect(pending.popleft())
+
+        for chat, where in items:
+            if chat is None:
+                add_error(where)
+                continue
+            if chat['id'] in seen:
+                report['duplicates'] += 1
+                continue
+            seen.add(chat['id'])
+            current.append((chat, where))
+            if len(current) >= batch:
+                submit()
+        if current:
+            submit()
+        while pending:
+            collect(pending.popleft())
+    return report
+
+
+def delete_chats(chat_ids):
+    """Удаляет чаты по списку (или генератору) id; возвращает число удаленных"""
+    deleted = 0
+    for chat_id in chat_ids:
+        try:
+            if chat_store.delete_chat(chat_id):
+                deleted += 1
+        except Exception:
+            logger.exception(f"Не удалось удалить чат {chat_id}")
+    return deleted
@@ -0,0 +1,76 @@
+import threading
+import hashlib
+import time
+import os
+
+# Как часто проверять mtime файла (секунды). Изменения, сделанные самим
+# приложением, видны сразу через invalidate()
+CHECK_INTERVAL = 1.0
+
+
+def file_stamp(path):
+    """(mtime в нс, размер) файла или None, если его нет"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def make_etag(*parts):
+    """Сильный ETag из байтов ответа или из отметок файлов"""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode('utf-8'))
+    return f'"{h.hexdigest()}"'
+
+
+class CachedFile:
+    """Разобранное содержимое файла в памяти процесса.
+
+    parse(path) вызывается только когда файл изменился (другие mtime или
+    размер) или после invalidate(); parse должен сам обрабатывать отсутствие
+    файла. Значение общее для всех вызывающих - менять его нельзя.
+    render(key, fn) запоминает производные от значения (тело ответа, ETag)
+    до следующего изменения файла.
+    """
+
+    def __init__(self, path, parse, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.parse = parse
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._value = None
+        self._loaded = False
+        self._checked_at = 0
+        self._rendered = {}
+
+    def get(self):
+        with self._lock:
+            return self._refresh()
+
+    def render(self, key, fn):
+        with self._lock:
+            value = self._refresh()
+            if key not in self._rendered:
+                self._rendered[key] = fn(value)
+            return self._rendered[key]
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.check_interval:
+            return self._value
+        stamp = file_stamp(self.path)
+        self._checked_at = now
+        if self._loaded and stamp == self._stamp:
+            return self._value
+        self._value = self.parse(self.path)
+        self._stamp = stamp
+        self._loaded = True
+        self._rendered = {}
+        return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._rendered = {}
@@ -0,0 +1,204 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import logging
+import json
+import time
+
+import db
+
+logger = logging.getLogger("synedrion.context")
+
+# Размер контекста модели по умолчанию и известные исключения (токены)
+DEFAULT_CONTEXT = 32000
+MODEL_CONTEXT = {
+    "deepseek/deepseek-r1-0528-qwen3-8b:free": 32000,
+    "qwen/qwen3-coder:free": 262000,
+}
+# Верхняя граница промпта независимо от размера контекста модели:
+# длинный промпт - это задержка и стоимость
+MAX_PROMPT_TOKENS = 24000
+# Запас под ответ модели (без учета рассуждений) и под краткое содержание
+ANSWER_RESERVE = 4000
+SUMMARY_RESERVE = 1000
+
+# Старые сообщения уходят в краткое содержание блоками по SUMMARY_CHUNK,
+# поэтому граница окна сдвигается редко и каждое содержание считается один раз
+SUMMARY_CHUNK = 10
+# Сколько символов одного сообщения попадает в запрос на краткое содержание
+SUMMARY_MESSAGE_CHARS = 4000
+
+SUMMARY_PROMPT = "Составь краткое содержание диалога пользователя с ИИ: факты, решения, договоренности и открытые вопросы. Не больше 300 слов, без вступлений."
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: ~3 символа на токен для смеси кириллицы и кода"""
+    return len(text or '') // 3 + 1
+
+def message_tokens(message):
+    # +4 - служебная разметка роли в формате чата
+    return estimate_tokens(message.get('content')) + 4
+
+def context_budget(model, reasoning_max=0):
+    """Сколько токенов промпта можно отправить модели"""
+    context = MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)
+    return max(1000, min(MAX_PROMPT_TOKENS, context - ANSWER_RESERVE - reasoning_max))
+
+def to_turns(messages):
+    """Сообщения чата -> [(сообщение, сообщение для API)].
+
+    Рассуждения прошлых ответов не отправляются: модели они не нужны, а
+    занимают больше всего места. Сообщение об ошибке убирает вопрос перед ним.
+    """
+    turns = []
+    for message in messages:
+        if message.get("sender") == "ai":
+            turns.append((message, {"role": "assistant", "content": message.get("answer", "")}))
+        elif message.get("sender") == "user":
+            turns.append((message, {"role": "user", "content": message.get("text", "")}))
+        elif message.get("sender") == "error" and turns:
+            turns.pop()
+    return turns
+
+def range_digest(messages):
+    """Отпечаток содержимого диапазона: правка старого сообщения делает содержание недействительным"""
+    h = hashlib.sha1()
+    for message in messages:
+        h.update(json.dumps([message.get('id'), message.get('text'), message.get('answer')], ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+class SummaryCache:
+    """Кэш кратких содержаний начала чатов в SQLite.
+
+    Ключ - чат и диапазон id сообщений (первое, последнее); вместе с
+    содержанием хранится отпечаток диапазона для проверки актуальности.
+    """
+
+    def __init__(self, path):
+        self._conn = db.connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                chat_id TEXT NOT NULL,
+                first_id TEXT NOT NULL,
+                last_id TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, first_id, last_id)
+            )
+        """)
+
+    def best(self, chat_id, messages):
+        """Самое длинное актуальное содержание начала messages: (число сообщений, текст)"""
+        if not messages:
+            return 0, None
+        rows = self._conn.execute(
+            "SELECT count, last_id, digest, summary FROM summaries WHERE chat_id = ? AND first_id = ? AND count <= ? ORDER BY count DESC",
+            (chat_id, str(messages[0].get('id')), len(messages))
+        ).fetchall()
+        for row in rows:
+            covered = messages[:row['count']]
+            if str(covered[-1].get('id')) == row['last_id'] and range_digest(covered) == row['digest']:
+                return row['count'], row['summary']
+        return 0, None
+
+    def put(self, chat_id, messages, summary):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO summaries (chat_id, first_id, last_id, count, digest, summary, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, str(messages[0].get('id')), str(messages[-1].get('id')), len(messages), range_digest(messages), summary, time.time())
+        )
+
+    def delete_chat(self, chat_id):
+        self._conn.execute("DELETE FROM summaries WHERE chat_id = ?", (chat_id,))
+
+    def on_change(self, op, chat_id, record):
+        """Обработчик записей журнала (см. chat_store.add_listener)"""
+        if op == 'delete':
+            self.delete_chat(chat_id)
+
+
+class ContextBuilder:
+    """Собирает историю для запроса в пределах бюджета токенов модели.
+
+    В запрос попадают системный промпт, краткое содержание начала диалога
+    (если есть) и столько последних сообщений, сколько помещается в бюджет.
+    Краткое содержание считается в фоне функцией summarize(model, messages)
+    и кэшируется в SummaryCache: пока его нет, начало диалога просто не
+    отправляется, а запрос пользователя не ждет.
+    """
+
+    def __init__(self, cache, summarize=None):
+        self.cache = cache
+        self.summarize = summarize
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarizer')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def build(self, chat_id, system_prompt, messages, model, reasoning_max=0):
+        turns = to_turns(messages)
+        budget = context_budget(model, reasoning_max)
+        system = {"role": "system", "content": system_prompt}
+        used = message_tokens(system) + SUMMARY_RESERVE
+        kept = 0
+        for _, turn in reversed(turns):
+            cost = message_tokens(turn)
+            # Последнее сообщение отправляется всегда, даже если не помещается
+            if kept and used + cost > budget:
+                break
+            used += cost
+            kept += 1
+        dropped = len(turns) - kept
+        if not dropped:
+            return [system] + [turn for _, turn in turns]
+        # Граница окна выравнивается по блокам краткого содержания
+        dropped = min(len(turns) - 1, -(-dropped // SUMMARY_CHUNK) * SUMMARY_CHUNK)
+        head = [message for message, _ in turns[:dropped]]
+        covered, summary = self.cache.best(chat_id, head)
+        if covered < len(head):
+            self._schedule(chat_id, model, head)
+        history = [system]
+        if summary:
+            history.append({"role": "system", "content": f"Краткое содержание начала диалога:\n{summary}"})
+        history += [turn for _, turn in turns[dropped:]]
+        logger.info(f"Контекст {chat_id}: {len(turns) - dropped} из {len(turns)} сообщений, содержание {covered} сообщений, бюджет {budget}")
+        return history
+
+    def _schedule(self, chat_id, model, head):
+        if not self.summarize:
+            return
+        key = (chat_id, len(head))
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._summarize_range, key, chat_id, model, head)
+
+    def _summarize_range(self, key, chat_id, model, head):
+        """Наращивает содержание блоками: предыдущее содержание + следующий блок"""
+        try:
+            covered, summary = self.cache.best(chat_id, head)
+            while covered < len(head):
+                chunk = head[covered:covered + SUMMARY_CHUNK]
+                parts = []
+                if summary:
+                    parts.append(f"Краткое содержание предыдущей части:\n{summary}")
+                for message, turn in to_turns(chunk):
+                    role = "Пользователь" if turn["role"] == "user" else "ИИ"
+                    parts.append(f"{role}: {turn['content'][:SUMMARY_MESSAGE_CHARS]}")
+                summary = self.summarize(model, [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": "\n\n".join(parts)}
+                ])
+                covered += len(chunk)
+                self.cache.put(chat_id, head[:covered], summary)
+            logger.info(f"Краткое содержание {chat_id} обновлено: {covered} сообщений")
+        except Exception:
+            logger.exception(f"Не удалось составить краткое содержание {chat_id}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,206 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import threading
+import logging
+import uuid
+import time
+
+from events import bus
+import chat_store
+
+logger = logging.getLogger("synedrion.council")
+
+# Время на ответ всех участников раунда (секунды). Ответы, пришедшие позже,
+# дописываются в чат по мере готовности с пометкой late
+ROUND_TIMEOUT = 90
+# Сколько раундов хранить в памяти для GET /api/council/<id>
+ROUNDS_HISTORY = 100
+
+COUNCIL_PROMPT = "Ты участник консилиума: несколько ИИ отвечают на один вопрос. Ты - {name}. Ответы других участников приходят как сообщения пользователя с их именем."
+SUMMARY_PROMPT = "Ниже ответы участников консилиума на вопрос пользователя. Сведи их в один итоговый ответ: общие выводы, расхождения и чья позиция убедительнее."
+
+
+def message_text(answer, reasoning):
+    """Текст сообщения ИИ в формате, который понимает клиент"""
+    if reasoning:
+        return f"[THOUGHTS]\n{reasoning}\n[/THOUGHTS]\n{answer}"
+    return answer + " "
+
+
+class CouncilEngine:
+    """Консилиум: один вопрос нескольким моделям одновременно.
+
+    Вопрос рассылается всем участникам параллельно через пул потоков, так что
+    раунд длится примерно столько, сколько отвечает самая медленная модель,
+    но не дольше timeout. Каждый ответ сразу сохраняется в чат консилиума с
+    указанием модели (поля model и model_name) и публикуется подписчикам
+    чата. Опционально после раунда модель summary_model сводит ответы в итог.
+
+    complete(models, messages, reasoning_max, timeout=...) - функция запроса
+    к модели (sender.complete), system_prompt - базовый системный промпт.
+    """
+
+    def __init__(self, complete, system_prompt='', max_workers=16):
+        self.complete = complete
+        self.system_prompt = system_prompt
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='council')
+        self._rounds = {}
+        self._lock = threading.Lock()
+
+    def create_council(self, models, title=None):
+        """Создает чат консилиума с участниками models ([{'name', 'url'}, ...])"""
+        now = datetime.now().isoformat()
+        return chat_store.create_chat({
+            'id': f"council_{uuid.uuid4().hex}",
+            'title': title,
+            'mode': 'council',
+            'models': models,
+            'messages': [],
+            'created_at': now,
+            'updated_at': now
+        })
+
+    def submit(self, chat_id, prompt, models=None, timeout=ROUND_TIMEOUT, summary_model=None, reasoning_max=0):
+        """Запускает раунд в фоне и возвращает его описание"""
+        chat = chat_store.load_chat(chat_id)
+        if chat is None:
+            raise FileNotFoundError(f"Чат не найден: {chat_id}")
+        models = models or chat.get('models') or []
+        if not models:
+            raise ValueError("Не выбраны участники консилиума")
+        round_id = uuid.uuid4().hex
+        user_message = {
+            'id': int(time.time() * 1000),
+            'sender': 'user',
+            'text': prompt,
+            'timestamp': datetime.now().isoformat()
+        }
+        chat_store.put_message(chat_id, user_message)
+        bus.publish(chat_id, 'message', user_message)
+        info = {
+            'id': round_id,
+            'chat': chat_id,
+            'status': 'running',
+            'models': [m['url'] for m in models],
+            'answered': [],
+            'failed': [],
+            'late': [],
+            'started_at': time.time(),
+            'finished_at': None
+        }
+        with self._lock:
+            self._rounds[round_id] = info
+            while len(self._rounds) > ROUNDS_HISTORY:
+                self._rounds.pop(next(iter(self._rounds)))
+        history = chat['messages'] + [user_message]
+        thread = threading.Thread(
+            target=self._run_round,
+            args=(info, history, models, timeout, summary_model, reasoning_max),
+            name=f"council-{round_id[:8]}",
+            daemon=True
+        )
+        thread.start()
+        return dict(info)
+
+    def get_round(self, round_id):
+        with self._lock:
+            info = self._rounds.get(round_id)
+            return dict(info) if info else None
+
+    def _run_round(self, info, history, models, timeout, summary_model, reasoning_max):
+        base_id = int(time.time() * 1000)
+        futures = {}
+        for index, model in enumerate(models):
+            messages = self._messages_for(model, history)
+            future = self._executor.submit(self.complete, [model['url']], messages, reasoning_max, timeout=timeout)
+            futures[future] = (base_id + index + 1, model)
+        done, pending = wait(futures, timeout=timeout)
+        answers = []
+        for future in done:
+            message_id, model = futures[future]
+            message = self._save_answer(info, future, message_id, model)
+            if message and message['sender'] == 'ai':
+                answers.append(message)
+        # Опоздавшие ответы не задерживают раунд, но сохраняются, когда придут
+        for future in pending:
+            message_id, model = futures[future]
+            future.add_done_callback(lambda f, message_id=message_id, model=model: self._save_answer(info, f, message_id, model, late=True))
+        if summary_model and answers:
+            self._summarize(info, history, answers, summary_model, base_id + len(models) + 1, timeout, reasoning_max)
+        with self._lock:
+            info['status'] = 'done'
+            info['finished_at'] = time.time()
+        logger.info(f"Раунд консилиума {info['id']} завершен: ответили {len(answers)} из {len(models)}")
+
+    def _messages_for(self, model, history):
+        """История чата с точки зрения участника model"""
+        prompt = COUNCIL_PROMPT.format(name=model.get('name') or model['url'])
+        messages = [{"role": "system", "content": f"{self.system_prompt}\n{prompt}"}]
+        for message in history:
+            if message.get('sender') == 'user':
+                messages.append({"role": "user", "content": message.get('text', '')})
+            elif message.get('sender') == 'ai':
+                if message.get('model') == model['url']:
+                    messages.append({"role": "assistant", "content": message.get('answer', '')})
+                else:
+                    name = message.get('model_name') or message.get('model') or 'ИИ'
+                    messages.append({"role": "user", "content": f"[{name}]\n{message.get('answer', '')}"})
+        return messages
+
+    def _save_answer(self, info, future, message_id, model, late=False, summary=False):
+        chat_id = info['chat']
+        try:
+            result = future.result()
+            content = result['choices'][0]['message']
+            message = {
+                'id': message_id,
+                'sender': 'ai',
+                'model': model['url'],
+                'model_name': model.get('name') or model['url'],
+                'reasoning': content.get('reasoning', ''),
+                'answer': content.get('content', ''),
+                'text': message_text(content.get('content', ''), content.get('reasoning', '')),
+                'timestamp': datetime.now().isoformat()
+            }
+            if late:
+                message['late'] = True
+            if summary:
+                message['summary'] = True
+            status = 'late' if late else 'answered'
+        except Exception as e:
+            logger.error(f"Участник консилиума {model['url']} не ответил: {e}")
+            message = {
+                'id': message_id,
+                'sender': 'error',
+                'model': model['url'],
+                'text': f"{model.get('name') or model['url']}: {e}",
+                'timestamp': datetime.now().isoformat()
+            }
+            status = 'failed'
+        try:
+            chat_store.put_message(chat_id, message)
+        except Exception:
+            # Чат могли удалить, пока модель отвечала
+            logger.exception(f"Не удалось сохранить ответ консилиума в {chat_id}")
+            return None
+        bus.publish(chat_id, 'message', message)
+        with self._lock:
+            info[status].append(model['url'])
+        return message
+
+    def _summarize(self, info, history, answers, summary_model, message_id, timeout, reasoning_max):
+        messages = [{"role": "system", "content": f"{self.system_prompt}\n{SUMMARY_PROMPT}"}]
+        question = next((m.get('text', '') for m in reversed(history) if m.get('sender') == 'user'), '')
+        parts = [f"Вопрос:\n{question}"]
+        for answer in answers:
+            parts.append(f"[{answer['model_name']}]\n{answer['answer']}")
+        messages.append({"role": "user", "content": "\n\n".join(parts)})
+        future = self._executor.submit(self.complete, [summary_model['url']], messages, reasoning_max, timeout=timeout)
+        wait([future], timeout=timeout)
+        if future.done():
+            self._save_answer(info, future, message_id, summary_model, summary=True)
+        else:
+            future.add_done_callback(lambda f: self._save_answer(info, f, message_id, summary_model, late=True, summary=True))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
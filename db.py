@@ -0,0 +1,19 @@
+import sqlite3
+import os
+
+
+def connect(path):
+    """Открывает базу SQLite для совместного использования потоками приложения.
+
+    WAL позволяет читать базу во время записи, а busy_timeout заставляет
+    конкурентных писателей ждать, а не падать с "database is locked".
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
@@ -0,0 +1,263 @@
+import threading
+import logging
+import queue
+import time
+
+import metrics
+from cancellation import CancelToken
+
+logger = logging.getLogger("synedrion.dispatcher")
+
+
+class QueueFullError(Exception):
+    """Очередь запросов переполнена, новый запрос не может быть принят"""
+
+
+class Dispatcher:
+    """Пул рабочих потоков, обрабатывающих запросы к ИИ внутри приложения.
+
+    Заменяет запуск отдельного процесса api_sender.pyw на каждое сообщение:
+    запросы записываются в JobStore, а постоянные рабочие потоки выполняют
+    их через handler(chat, cancel_token). Если в очереди уже queue_size
+    ожидающих запросов, submit() выбрасывает QueueFullError, и вызывающий
+    код может попросить клиента повторить позже.
+
+    Для одного чата одновременно выполняется не больше одного запроса.
+    Новый запрос к чату, запрос которого еще ждет в очереди, объединяется с
+    ним (ответ все равно строится по последнему состоянию чата), а запрос к
+    чату, для которого уже идет генерация, отменяет ее и начинается, как
+    только отмененный запрос освободит рабочий поток и ключ.
+
+    С общим хранилищем (store.shared) за очередью следят несколько
+    экземпляров приложения: каждый отмечает свои запросы, забирает брошенные
+    остановившимися экземплярами и передает отмену запросов, идущих на
+    других экземплярах, через store.request_cancel.
+    """
+
+    # Сколько новый запрос чата ждет завершения отмененного предыдущего
+    SUPERSEDE_WAIT = 30
+
+    # Сколько завершённых задач хранить для запросов статуса
+    FINISHED_HISTORY = 1000
+
+    # Как часто экземпляр с общим хранилищем отмечает свои запросы и проверяет чужие (секунды)
+    HEARTBEAT_INTERVAL = 2
+
+    def __init__(self, handler, store, max_workers=4, queue_size=32):
+        self.handler = handler
+        self.store = store
+        self.max_workers = max(1, int(max_workers))
+        self.queue_size = max(1, int(queue_size))
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._finished_count = 0
+        # Время постановки в очередь для замера ожидания (только задачи этого процесса)
+        self._enqueued = {}
+        # Запросы этого процесса (id -> {job_id, chat, state, token, done, previous})
+        # и текущий запрос каждого чата
+        self._jobs = {}
+        self._active = {}
+        # Брошенные запросы других экземпляров, уже поставленные в очередь этого
+        self._adopted = set()
+
+    def start(self):
+        """Запускает рабочие потоки и возвращает в работу сохранённые запросы.
+
+        Повторный вызов ничего не делает.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            interrupted = self.store.recover()
+            if interrupted:
+                logger.warning(f"Запросов, прерванных перезапуском: {interrupted}")
+            for job_id in self.store.pending(abandoned=self.store.shared):
+                self._queue.put(job_id)
+            for i in range(self.max_workers):
+                t = threading.Thread(target=self._worker, name=f"dispatcher-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            if self.store.shared:
+                t = threading.Thread(target=self._heartbeat_loop, name="dispatcher-heartbeat", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, chat_filename):
+        """Ставит запрос в очередь и возвращает описание задачи.
+
+        Если запрос этого чата уже ждет в очереди, возвращается он (с
+        'coalesced': True); выполняющийся запрос чата отменяется, а его id
+        возвращается в 'superseded'.
+        """
+        self.start()
+        with self._lock:
+            current = self._active.get(chat_filename)
+            if current and current['state'] == 'queued' and not current['token'].cancelled:
+                job = self.store.get(current['job_id'])
+                if job:
+                    metrics.observe('enqueue', 0, status='coalesced')
+                    return dict(job, coalesced=True)
+        with metrics.span('enqueue') as labels:
+            job = self.store.enqueue(chat_filename, limit=self.queue_size)
+            labels['status'] = 'queued' if job else 'rejected'
+        if job is None:
+            raise QueueFullError(f"В очереди уже {self.queue_size} запросов")
+        entry = self._new_entry(job)
+        with self._lock:
+            previous = self._active.get(chat_filename)
+            entry['previous'] = previous['done'] if previous else None
+            self._active[chat_filename] = entry
+            self._enqueued[job['id']] = time.perf_counter()
+        if previous:
+            # Новый запрос заменяет выполняющийся (или одновременно поставленный)
+            logger.info(f"Запрос {previous['job_id']} заменен запросом {job['id']}")
+            self._cancel_entry(previous)
+            job['superseded'] = previous['job_id']
+        elif self.store.shared:
+            # Запрос чата мог идти на другом экземпляре
+            for other in self.store.active(chat_filename):
+                if other['id'] != job['id'] and self._cancel_remote(other['id']):
+                    logger.info(f"Запрос {other['id']} другого экземпляра заменен запросом {job['id']}")
+                    job['superseded'] = other['id']
+        self._queue.put(job['id'])
+        return job
+
+    def cancel(self, job_id):
+        """Отменяет запрос. False, если он уже завершен или неизвестен"""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is None:
+            return self.store.shared and self._cancel_remote(job_id)
+        self._cancel_entry(entry)
+        return True
+
+    def cancel_chat(self, chat_filename):
+        """Отменяет текущий запрос чата; возвращает его id или None"""
+        with self._lock:
+            entry = self._active.get(chat_filename)
+        if entry is None:
+            if self.store.shared:
+                for other in self.store.active(chat_filename):
+                    if self._cancel_remote(other['id']):
+                        return other['id']
+            return None
+        self._cancel_entry(entry)
+        return entry['job_id']
+
+    def _cancel_remote(self, job_id):
+        """Отмена запроса другого экземпляра: ожидающий отменяется сразу,
+        выполняющийся - его владельцем при следующей отметке"""
+        return self.store.cancel(job_id) or self.store.request_cancel(job_id)
+
+    def _new_entry(self, job):
+        entry = {
+            'job_id': job['id'],
+            'chat': job['chat'],
+            'state': 'queued',
+            'token': CancelToken(),
+            'done': threading.Event(),
+            'previous': None
+        }
+        with self._lock:
+            self._jobs[job['id']] = entry
+        return entry
+
+    def _cancel_entry(self, entry):
+        entry['token'].cancel()
+        if self.store.cancel(entry['job_id']):
+            # Запрос еще не начат - рабочий поток его пропустит
+            self._release(entry)
+
+    def _release(self, entry):
+        entry['done'].set()
+        with self._lock:
+            self._jobs.pop(entry['job_id'], None)
+            if self._active.get(entry['chat']) is entry:
+                del self._active[entry['chat']]
+
+    def get_job(self, job_id):
+        """Текущее состояние задачи или None, если она неизвестна"""
+        return self.store.get(job_id)
+
+    def stats(self):
+        """Размер очереди и число задач в каждом статусе"""
+        return {
+            'workers': self.max_workers,
+            'queue_size': self.queue_size,
+            'jobs': self.store.counts()
+        }
+
+    def _finish(self, job_id, status, error=None):
+        self.store.finish(job_id, status, error)
+        with self._lock:
+            self._finished_count += 1
+            prune = self._finished_count % 100 == 0
+        if prune:
+            self.store.prune(self.FINISHED_HISTORY)
+
+    def _heartbeat_loop(self):
+        """Общее хранилище: отметка своих запросов, отмена по просьбе других
+        экземпляров, запросы остановившихся экземпляров"""
+        while True:
+            time.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                with self._lock:
+                    entries = dict(self._jobs)
+                for job_id in self.store.heartbeat(list(entries)):
+                    logger.info(f"Запрос {job_id} отменен другим экземпляром")
+                    entries[job_id]['token'].cancel()
+                interrupted = self.store.recover()
+                if interrupted:
+                    logger.warning(f"Запросов, прерванных остановкой других экземпляров: {interrupted}")
+                for job_id in self.store.pending(abandoned=True):
+                    with self._lock:
+                        if job_id in entries or job_id in self._adopted:
+                            continue
+                        self._adopted.add(job_id)
+                    self._queue.put(job_id)
+            except Exception:
+                logger.exception("Ошибка отметки запросов в общем хранилище")
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self._lock:
+                    enqueued = self._enqueued.pop(job_id, None)
+                    self._adopted.discard(job_id)
+                job = self.store.claim(job_id)
+                if job is None:
+                    # Запрос отменили, пока он ждал в очереди
+                    continue
+                if enqueued is not None:
+                    metrics.observe('queue_wait', time.perf_counter() - enqueued)
+                with self._lock:
+                    entry = self._jobs.get(job_id)
+                if entry is None:
+                    # Запрос, восстановленный после перезапуска
+                    entry = self._new_entry(job)
+                if entry['previous'] is not None:
+                    # Отмененный предыдущий запрос чата еще дописывает свое - ждем
+                    entry['previous'].wait(self.SUPERSEDE_WAIT)
+                entry['state'] = 'running'
+                started = time.perf_counter()
+                try:
+                    if entry['token'].cancelled:
+                        status = 'cancelled'
+                    else:
+                        ok = self.handler(job['chat'], entry['token'])
+                        status = 'done' if ok is not False else 'failed'
+                    if entry['token'].cancelled:
+                        status = 'cancelled'
+                    self._finish(job_id, status)
+                except Exception as e:
+                    status = 'cancelled' if entry['token'].cancelled else 'failed'
+                    if status == 'failed':
+                        logger.exception(f"Ошибка обработки задачи {job_id}")
+                    self._finish(job_id, status, str(e))
+                finally:
+                    self._release(entry)
+                metrics.observe('process', time.perf_counter() - started, status=status)
+            finally:
+                self._queue.task_done()
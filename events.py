@@ -0,0 +1,64 @@
+import threading
+import queue
+import json
+
+
+class ChatEventBus:
+    """Рассылка событий чатов подписчикам внутри процесса.
+
+    Обработчик запросов публикует новые и изменённые сообщения и фрагменты
+    ответа модели, а эндпоинт /api/chats/<id>/events передаёт их клиенту
+    через Server-Sent Events. Очередь каждого подписчика ограничена: если
+    клиент не успевает читать, его очередь сбрасывается и он получает
+    событие resync, после которого должен перечитать чат целиком.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._subscribers = {}
+        self._sequence = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, chat_id):
+        sub = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(chat_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, chat_id, sub):
+        with self._lock:
+            subs = self._subscribers.get(chat_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[chat_id]
+
+    def has_subscribers(self, chat_id):
+        with self._lock:
+            return bool(self._subscribers.get(chat_id))
+
+    def publish(self, chat_id, event, data):
+        with self._lock:
+            subs = list(self._subscribers.get(chat_id, ()))
+            if not subs:
+                return
+            seq = self._sequence.get(chat_id, 0) + 1
+            self._sequence[chat_id] = seq
+        item = (seq, event, data)
+        for sub in subs:
+            try:
+                sub.put_nowait(item)
+            except queue.Full:
+                # Клиент отстал: вместо потерянных событий просим его перечитать чат
+                with sub.mutex:
+                    sub.queue.clear()
+                sub.put_nowait((seq, 'resync', {}))
+
+
+def format_sse(seq, event, data):
+    """Форматирует событие в текстовом формате Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n"
+
+
+bus = ChatEventBus()
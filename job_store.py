@@ -0,0 +1,191 @@
+from datetime import datetime
+import threading
+import time
+import uuid
+
+from storage import SqlDatabase, INSTANCE_ID
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+# Запрос, владелец которого не отмечался столько секунд, считается брошенным
+# (экземпляр приложения остановился): ожидающий забирает другой экземпляр,
+# а выполнявшийся помечается failed
+STALE_AFTER = 30
+
+
+class JobStore:
+    """Журнал запросов к ИИ в базе SQLite (или в общей базе, см. storage.py).
+
+    Каждый запрос получает собственную запись с уникальным id, статусом
+    (queued/running/done/failed/cancelled) и временем постановки в очередь,
+    поэтому одновременные запросы из разных чатов больше не перезаписывают
+    друг друга, как это было с общим файлом config/request.json.
+
+    В общей базе (shared=True) у запроса есть владелец - экземпляр, который
+    его поставил или забрал, - и время последней отметки владельца
+    (heartbeat). claim атомарен, поэтому запрос выполняет ровно один
+    экземпляр, а отмену запроса, идущего на другом экземпляре, передает
+    флаг cancel_requested.
+    """
+
+    def __init__(self, database, shared=False, instance=INSTANCE_ID):
+        self.db = SqlDatabase.sqlite(database) if isinstance(database, str) else database
+        self.shared = shared
+        self.instance = instance
+        self._lock = threading.Lock()
+        self.db.create([
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                chat TEXT NOT NULL,
+                status TEXT NOT NULL,
+                enqueued_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                error TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, enqueued_at)"
+        ])
+        # Столбцы для нескольких экземпляров - в базах, созданных до их появления
+        columns = self.db.columns('jobs')
+        for column, definition in (('owner', 'TEXT'), ('heartbeat_at', 'REAL'), ('cancel_requested', 'INTEGER NOT NULL DEFAULT 0')):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def enqueue(self, chat, limit=None):
+        """Добавляет запрос со статусом queued.
+
+        Возвращает None, если в очереди уже limit ожидающих запросов.
+        """
+        job = {
+            'id': str(uuid.uuid4()),
+            'chat': chat,
+            'status': 'queued',
+            'enqueued_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None
+        }
+        with self._lock, self.db.transaction():
+            if limit is not None and self.count('queued') >= limit:
+                return None
+            self.db.execute(
+                "INSERT INTO jobs (id, chat, status, enqueued_at, owner, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job['id'], job['chat'], job['status'], job['enqueued_at'], self.instance, time.time())
+            )
+        return job
+
+    def get(self, job_id):
+        return self.db.query_one(
+            "SELECT id, chat, status, enqueued_at, started_at, finished_at, error FROM jobs WHERE id = ?",
+            (job_id,)
+        )
+
+    def count(self, status):
+        return self.db.scalar("SELECT COUNT(*) AS n FROM jobs WHERE status = ?", (status,))
+
+    def counts(self):
+        rows = self.db.query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row['status']: row['n'] for row in rows}
+
+    def pending(self, abandoned=False):
+        """Идентификаторы ожидающих запросов в порядке постановки.
+
+        abandoned - только брошенные: их владелец давно не отмечался.
+        """
+        if abandoned:
+            rows = self.db.query(
+                "SELECT id FROM jobs WHERE status = 'queued' AND (heartbeat_at IS NULL OR heartbeat_at < ?) ORDER BY enqueued_at",
+                (time.time() - STALE_AFTER,)
+            )
+        else:
+            rows = self.db.query("SELECT id FROM jobs WHERE status = 'queued' ORDER BY enqueued_at")
+        return [row['id'] for row in rows]
+
+    def active(self, chat):
+        """Ожидающие и выполняющиеся запросы чата (на любом экземпляре)"""
+        return self.db.query(
+            "SELECT id, status, owner FROM jobs WHERE chat = ? AND status IN ('queued', 'running')",
+            (chat,)
+        )
+
+    def claim(self, job_id):
+        """Переводит запрос из queued в running; None, если его уже забрали"""
+        with self._lock:
+            if not self.db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, heartbeat_at = ? WHERE id = ? AND status = 'queued'",
+                (datetime.now().isoformat(), self.instance, time.time(), job_id)
+            ):
+                return None
+        return self.get(job_id)
+
+    def cancel(self, job_id):
+        """Отменяет запрос, который еще ждет в очереди; False, если его уже забрали"""
+        with self._lock:
+            return self.db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (datetime.now().isoformat(), job_id)
+            ) > 0
+
+    def request_cancel(self, job_id):
+        """Просит владельца отменить выполняющийся запрос; False, если он не выполняется"""
+        with self._lock:
+            return self.db.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                (job_id,)
+            ) > 0
+
+    def heartbeat(self, job_ids):
+        """Отмечает запросы этого экземпляра живыми.
+
+        Возвращает id тех из них, отмену которых запросил другой экземпляр.
+        """
+        if not job_ids:
+            return set()
+        placeholders = ', '.join('?' * len(job_ids))
+        with self._lock:
+            self.db.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND id IN ({placeholders})",
+                (time.time(), self.instance, *job_ids)
+            )
+        rows = self.db.query(
+            f"SELECT id FROM jobs WHERE cancel_requested = 1 AND status = 'running' AND id IN ({placeholders})",
+            tuple(job_ids)
+        )
+        return {row['id'] for row in rows}
+
+    def finish(self, job_id, status, error=None):
+        with self._lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (status, datetime.now().isoformat(), error, job_id)
+            )
+
+    def recover(self):
+        """Помечает прерванные запросы как failed.
+
+        В своей базе прерваны все running (приложение перезапустилось); в
+        общей - только те, чей владелец давно не отмечался.
+        """
+        with self._lock:
+            if not self.shared:
+                return self.db.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE status = 'running'",
+                    (datetime.now().isoformat(), 'Обработка прервана перезапуском приложения')
+                )
+            return self.db.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (datetime.now().isoformat(), 'Экземпляр приложения, выполнявший запрос, остановлен', time.time() - STALE_AFTER)
+            )
+
+    def prune(self, keep=1000):
+        """Удаляет старые завершённые запросы, оставляя последние keep"""
+        with self._lock:
+            self.db.execute("""
+                DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND id NOT IN (
+                    SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled')
+                    ORDER BY finished_at DESC LIMIT ?
+                )
+            """, (keep,))
@@ -0,0 +1,394 @@
+import threading
+import hashlib
+import logging
+import time
+import os
+
+from rate_limiter import RateLimiter
+from storage import INSTANCE_ID
+import metrics
+
+logger = logging.getLogger("synedrion.key_pool")
+
+# Адрес API можно подменить (SYNEDRION_API_BASE), например на локальную заглушку bench/
+API_BASE = os.environ.get("SYNEDRION_API_BASE", "https://openrouter.ai/api/v1").rstrip("/")
+KEYS_URL = f"{API_BASE}/keys"
+# Имя, под которым пул создает ключи (видно в списке ключей OpenRouter)
+KEY_NAME = "synedrion-pool"
+
+# Общее хранилище: как часто экземпляр отмечает свои ключи и сверяет паузы
+# лимитов с другими (секунды) и через сколько ключи молчащего экземпляра
+# считаются брошенными и удаляются
+REGISTRY_INTERVAL = 5
+KEY_STALE_AFTER = 120
+
+
+class KeyProvisioningError(Exception):
+    """Не удалось получить API ключ для запроса"""
+
+
+class KeyLease:
+    """Выданный пулом API ключ вместе с ключом провижининга, которым он создан"""
+
+    def __init__(self, key, key_hash, parent):
+        self.key = key
+        self.hash = key_hash
+        self.parent = parent
+        self.created_at = time.time()
+        self.uses = 0
+        self.in_use = False
+
+    def __repr__(self):
+        return f"<KeyLease {self.hash}>"
+
+
+def fingerprint(provisioning_key):
+    """Имя ключа провижининга для общей базы - сам ключ туда не пишется"""
+    return hashlib.sha256(provisioning_key.encode()).hexdigest()[:16]
+
+
+class KeyRegistry:
+    """Ключи и паузы лимитов всех экземпляров приложения в общей базе.
+
+    Каждый экземпляр регистрирует созданные им ключи (только hash и
+    отпечаток аккаунта, без самого ключа) и регулярно отмечает их. Ключи
+    экземпляра, который перестал отмечаться, забирает и удаляет другой -
+    так остановленный узел не оставляет ключи на аккаунтах. Паузы лимитов
+    (429) тоже общие: аккаунт или модель, упершиеся в лимит на одном
+    экземпляре, не используются и остальными.
+    """
+
+    def __init__(self, database, instance=INSTANCE_ID):
+        self.db = database
+        self.instance = instance
+        self.db.create([
+            "CREATE TABLE IF NOT EXISTS api_keys (hash TEXT PRIMARY KEY, parent TEXT NOT NULL, owner TEXT NOT NULL, heartbeat_at REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS cooldowns (kind TEXT NOT NULL, name TEXT NOT NULL, until REAL NOT NULL, PRIMARY KEY (kind, name))"
+        ])
+
+    def register(self, lease):
+        self.db.execute(
+            "INSERT INTO api_keys (hash, parent, owner, heartbeat_at) VALUES (?, ?, ?, ?)",
+            (lease.hash, fingerprint(lease.parent), self.instance, time.time())
+        )
+
+    def unregister(self, lease):
+        self.db.execute("DELETE FROM api_keys WHERE hash = ?", (lease.hash,))
+
+    def heartbeat(self):
+        self.db.execute("UPDATE api_keys SET heartbeat_at = ? WHERE owner = ?", (time.time(), self.instance))
+
+    def adopt_orphans(self, parents):
+        """Забирает ключи молчащих экземпляров, созданные аккаунтами parents
+        (отпечатки): [(hash, отпечаток аккаунта)]"""
+        now = time.time()
+        rows = self.db.query("SELECT hash, parent FROM api_keys WHERE heartbeat_at < ?", (now - KEY_STALE_AFTER,))
+        adopted = []
+        for row in rows:
+            if row['parent'] not in parents:
+                continue
+            # Забирает ровно один экземпляр: остальные не найдут строку со старой отметкой
+            if self.db.execute(
+                "UPDATE api_keys SET owner = ?, heartbeat_at = ? WHERE hash = ? AND heartbeat_at < ?",
+                (self.instance, now, row['hash'], now - KEY_STALE_AFTER)
+            ):
+                adopted.append((row['hash'], row['parent']))
+        return adopted
+
+    def cooldown(self, kind, name, until):
+        self.db.execute("""
+            INSERT INTO cooldowns (kind, name, until) VALUES (?, ?, ?)
+            ON CONFLICT (kind, name) DO UPDATE SET
+                until = CASE WHEN excluded.until > cooldowns.until THEN excluded.until ELSE cooldowns.until END
+        """, (kind, name, until))
+
+    def cooldowns(self):
+        """Действующие паузы всех экземпляров: {(kind, name): until}"""
+        rows = self.db.query("SELECT kind, name, until FROM cooldowns WHERE until > ?", (time.time(),))
+        return {(row['kind'], row['name']): row['until'] for row in rows}
+
+
+class KeyLeaseManager:
+    """Пул заранее созданных API ключей OpenRouter.
+
+    Раньше на каждое сообщение создавался новый ключ (POST /keys) и
+    удалялся после ответа (DELETE /keys/<hash>) - две лишние сетевые
+    операции на критическом пути. Теперь ключи создаются заранее фоновым
+    потоком, выдаются запросам через acquire()/release() и переиспользуются.
+    Ключ удаляется, когда исчерпал max_uses или прожил дольше max_age.
+
+    Лимиты ключей провижининга учитывает RateLimiter: ключи аккаунта,
+    упершегося в лимит (429) или исчерпавшего запросы в минуту, не выдаются,
+    пока он недоступен, и новые ключи создаются другими.
+
+    registry (KeyRegistry) - общий учет ключей и пауз лимитов, когда
+    несколько экземпляров приложения работают с одними аккаунтами.
+    """
+
+    def __init__(self, session, provisioning_keys, limiter=None, min_idle=2, max_keys=8, max_uses=100, max_age=1800, registry=None):
+        self.session = session
+        self.provisioning_keys = list(provisioning_keys)
+        self.min_idle = min_idle
+        self.max_keys = max_keys
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self._leases = []
+        self._provisioning = 0
+        self.limiter = limiter or RateLimiter()
+        self._next_parent = 0
+        self._cond = threading.Condition()
+        self._refill_event = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.registry = registry
+        self._parents = {fingerprint(p): p for p in self.provisioning_keys}
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._refill_loop, name="key-pool", daemon=True)
+        self._thread.start()
+        self._refill_event.set()
+
+    # --- Выдача ключей ---
+
+    def acquire(self, timeout=30, cancel=None):
+        """Выдает свободный ключ, при необходимости создавая новый.
+
+        Если все аккаунты на паузе, ждет, пока какой-нибудь освободится.
+        Отмена cancel (CancelToken) прерывает ожидание исключением Cancelled.
+        """
+        deadline = time.time() + timeout
+        remove = cancel.on_cancel(self._wake) if cancel else None
+        try:
+            lease = self._wait_idle(deadline, cancel)
+        finally:
+            if remove:
+                remove()
+        if lease:
+            return lease
+        # Свободных ключей нет - создаем новый прямо в запросе
+        try:
+            lease = self._provision()
+        finally:
+            with self._cond:
+                self._provisioning -= 1
+        with self._cond:
+            lease.in_use = True
+            lease.uses += 1
+            self._leases.append(lease)
+        return lease
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _wait_idle(self, deadline, cancel=None):
+        """Свободный ключ или None, если вызывающему нужно создать новый"""
+        with self._cond:
+            while True:
+                if cancel:
+                    cancel.check()
+                lease = self._pick_idle()
+                if lease:
+                    lease.in_use = True
+                    lease.uses += 1
+                    self._refill_event.set()
+                    return lease
+                wake = self._next_parent_delay()
+                if not wake and len(self._leases) + self._provisioning < self.max_keys:
+                    self._provisioning += 1
+                    return None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise KeyProvisioningError("Нет свободных API ключей")
+                # Окончание паузы не будит ожидающих, поэтому ждем не дольше нее
+                self._cond.wait(min(remaining, wake) if wake else remaining)
+
+    def release(self, lease, cooldown_until=None):
+        """Возвращает ключ в пул.
+
+        cooldown_until - unix-время сброса лимита (из X-RateLimit-Reset),
+        если запрос получил 429: ключи этого провижининга до тех пор не выдаются.
+        """
+        retire = False
+        with self._cond:
+            lease.in_use = False
+            if cooldown_until:
+                self.limiter.cooldown('key', lease.parent, cooldown_until)
+            if lease.uses >= self.max_uses or self._expired(lease):
+                retire = lease in self._leases
+                if retire:
+                    self._leases.remove(lease)
+            self._cond.notify_all()
+        if retire:
+            self._delete(lease)
+        self._refill_event.set()
+
+    def discard(self, lease):
+        """Удаляет ключ, который перестал работать (например, 401)"""
+        with self._cond:
+            if lease in self._leases:
+                self._leases.remove(lease)
+            self._cond.notify_all()
+        self._delete(lease)
+        self._refill_event.set()
+
+    def cooldown_until(self, parent):
+        return self.limiter.cooldown_until('key', parent)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'keys': len(self._leases),
+                'in_use': sum(1 for l in self._leases if l.in_use),
+                'provisioning': self._provisioning,
+                'cooling_down': sum(1 for p in self.provisioning_keys if self.cooldown_until(p) > time.time())
+            }
+
+    def shutdown(self):
+        """Останавливает пул и удаляет все созданные им ключи"""
+        self._stopped = True
+        self._refill_event.set()
+        with self._cond:
+            leases = list(self._leases)
+            self._leases.clear()
+        for lease in leases:
+            self._delete(lease)
+
+    # --- Внутреннее ---
+
+    def _expired(self, lease):
+        return time.time() - lease.created_at > self.max_age
+
+    def _available(self, lease):
+        return not self.limiter.delay(key=lease.parent)
+
+    def _next_parent_delay(self):
+        """Через сколько секунд освободится хотя бы один аккаунт (0 - уже свободен)"""
+        return min(self.limiter.delay(key=p) for p in self.provisioning_keys)
+
+    def _pick_idle(self):
+        idle = [l for l in self._leases if not l.in_use and not self._expired(l) and self._available(l)]
+        if not idle:
+            return None
+        # Равномерно расходуем ключи: берем наименее использованный
+        return min(idle, key=lambda l: l.uses)
+
+    def _choose_parent(self):
+        with self._cond:
+            count = len(self.provisioning_keys)
+            for i in range(count):
+                parent = self.provisioning_keys[(self._next_parent + i) % count]
+                if not self.limiter.delay(key=parent):
+                    self._next_parent = (self._next_parent + i + 1) % count
+                    return parent
+            # Все на паузе - берем тот, что освободится раньше
+            return min(self.provisioning_keys, key=lambda p: self.limiter.delay(key=p))
+
+    def _provision(self):
+        parent = self._choose_parent()
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                KEYS_URL,
+                headers={"Authorization": f"Bearer {parent}", "Content-Type": "application/json"},
+                json={"name": KEY_NAME},
+                timeout=30
+            )
+            response.raise_for_status()
+            data = response.json()
+            lease = KeyLease(data["key"], data["data"]["hash"], parent)
+            self._registry('register', lease)
+        except Exception as e:
+            metrics.observe('key_provision', time.perf_counter() - started, status='error')
+            metrics.KEY_OPERATIONS.inc(op='create', status='error')
+            logger.error(f"Ошибка при получении ключа API: {e}")
+            raise KeyProvisioningError(str(e)) from e
+        metrics.observe('key_provision', time.perf_counter() - started, status='ok')
+        metrics.KEY_OPERATIONS.inc(op='create', status='ok')
+        logger.info(f"Новый API ключ получен: {lease.hash}")
+        return lease
+
+    def _delete(self, lease):
+        with metrics.span('key_delete') as labels:
+            try:
+                response = self.session.delete(
+                    f"{KEYS_URL}/{lease.hash}",
+                    headers={"Authorization": f"Bearer {lease.parent}"},
+                    timeout=30
+                )
+                labels['status'] = str(response.status_code)
+                logger.info(f"API ключ удалён: {lease.hash} ({response.status_code})")
+            except Exception as e:
+                labels['status'] = 'error'
+                logger.warning(f"Ошибка при удалении API ключа {lease.hash}: {e}")
+        metrics.KEY_OPERATIONS.inc(op='delete', status=labels['status'])
+        self._registry('unregister', lease)
+
+    def _registry(self, action, *args):
+        """Вызов общего учета ключей; сбой базы не мешает выдавать ключи"""
+        if self.registry is None:
+            return None
+        try:
+            return getattr(self.registry, action)(*args)
+        except Exception:
+            logger.exception(f"Ошибка общего учета ключей ({action})")
+            return None
+
+    def _sync_registry(self):
+        """Отметка своих ключей, обмен паузами лимитов, удаление брошенных ключей"""
+        if self.registry is None:
+            return
+        self._registry('heartbeat')
+        # Свои паузы - в общую базу, паузы других экземпляров - в свой RateLimiter
+        for (kind, name), until in self.limiter.cooldowns().items():
+            self._registry('cooldown', kind, fingerprint(name) if kind == 'key' else name, until)
+        for (kind, name), until in (self._registry('cooldowns') or {}).items():
+            if kind == 'key':
+                name = self._parents.get(name)
+                if name is None:
+                    continue
+            self.limiter.cooldown(kind, name, until)
+        for key_hash, parent in self._registry('adopt_orphans', set(self._parents)) or []:
+            logger.info(f"Удаление ключа остановленного экземпляра: {key_hash}")
+            self._delete(KeyLease(None, key_hash, self._parents[parent]))
+
+    def _any_parent_available(self):
+        return self._next_parent_delay() == 0
+
+    def _idle_count(self):
+        return sum(1 for l in self._leases if not l.in_use and not self._expired(l) and self._available(l))
+
+    def _refill_loop(self):
+        """Фоновое поддержание min_idle свободных ключей и удаление просроченных"""
+        while not self._stopped:
+            self._refill_event.wait(REGISTRY_INTERVAL if self.registry else 60)
+            self._refill_event.clear()
+            if self._stopped:
+                break
+            self._sync_registry()
+            with self._cond:
+                expired = [l for l in self._leases if not l.in_use and self._expired(l)]
+                for lease in expired:
+                    self._leases.remove(lease)
+            for lease in expired:
+                self._delete(lease)
+            while not self._stopped:
+                with self._cond:
+                    if (self._idle_count() >= self.min_idle
+                            or len(self._leases) + self._provisioning >= self.max_keys
+                            or not self._any_parent_available()):
+                        break
+                    self._provisioning += 1
+                try:
+                    lease = self._provision()
+                except KeyProvisioningError:
+                    with self._cond:
+                        self._provisioning -= 1
+                    # Повторим при следующем пробуждении
+                    break
+                with self._cond:
+                    self._provisioning -= 1
+                    self._leases.append(lease)
+                    self._cond.notify_all()
@@ -0,0 +1,167 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime
+import threading
+import logging
+import atexit
+import queue
+import json
+import time
+import os
+
+import metrics
+
+# Размер очереди записей: при переполнении новые записи отбрасываются,
+# а не задерживают запрос
+QUEUE_SIZE = 10000
+# Ротация журнала по размеру и по времени (секунды), число старых файлов
+MAX_BYTES = 10 * 1024 * 1024
+ROTATE_INTERVAL = 24 * 60 * 60
+BACKUP_COUNT = 7
+# Сколько символов сообщения и тела ответа (payload) попадает в журнал
+MAX_MESSAGE_CHARS = 2000
+MAX_PAYLOAD_CHARS = 2000
+# Тела успешных ответов пишутся только у каждой N-й записи; у предупреждений
+# и ошибок - всегда
+PAYLOAD_SAMPLE = 20
+
+DROPPED = metrics.REGISTRY.counter('synedrion_log_dropped_total', "Записи журнала, отброшенные из-за переполнения очереди")
+
+_setup_lock = threading.Lock()
+_listeners = {}
+
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit} символов)"
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler для очереди с ограниченным размером.
+
+    В вызывающем потоке запись только кладется в очередь: сообщение
+    форматируется, обрезается и пишется на диск потоком QueueListener.
+    """
+
+    def prepare(self, record):
+        # Стандартный prepare форматирует запись в вызывающем потоке - здесь
+        # это делает слушатель; traceback сохраняем, пока он есть
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class PayloadSampler(logging.Filter):
+    """Оставляет тело ответа (extra={'payload': ...}) у каждой N-й записи
+    уровня INFO и ниже; у остальных заменяет его размером"""
+
+    def __init__(self, every=PAYLOAD_SAMPLE):
+        super().__init__()
+        self.every = max(1, every)
+        self._count = 0
+
+    def filter(self, record):
+        if getattr(record, 'payload', None) is not None and record.levelno < logging.WARNING:
+            self._count += 1
+            if self._count % self.every:
+                record.payload_omitted = True
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': truncate(record.getMessage(), MAX_MESSAGE_CHARS)
+        }
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            text = json.dumps(payload, ensure_ascii=False, default=str)
+            if getattr(record, 'payload_omitted', False):
+                data['payload_chars'] = len(text)
+            else:
+                data['payload'] = truncate(text, MAX_PAYLOAD_CHARS)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Формат консоли как раньше, но с обрезанными длинными сообщениями"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+
+    def formatMessage(self, record):
+        record.message = truncate(record.message, MAX_MESSAGE_CHARS)
+        return super().formatMessage(record)
+
+
+class RotatingLogFile(RotatingFileHandler):
+    """Ротация и по размеру (max_bytes), и по времени (interval секунд)"""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, interval=ROTATE_INTERVAL, backup_count=BACKUP_COUNT):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+def setup(name, path, console=True, max_bytes=MAX_BYTES, interval=ROTATE_INTERVAL, backup_count=BACKUP_COUNT):
+    """Подключает к логгеру name асинхронную запись в path (JSON) и в консоль.
+
+    Повторный вызов для того же логгера ничего не делает. Очередь
+    дописывается на диск при завершении процесса (shutdown).
+    """
+    with _setup_lock:
+        logger = logging.getLogger(name)
+        if name in _listeners:
+            return logger
+        if not _listeners:
+            atexit.register(shutdown)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_handler = RotatingLogFile(path, max_bytes, interval, backup_count)
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.addFilter(PayloadSampler())
+        handlers = [file_handler]
+        if console:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(TextFormatter())
+            handlers.append(stream_handler)
+        log_queue = queue.Queue(QUEUE_SIZE)
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
+        logger.addHandler(BoundedQueueHandler(log_queue))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        return logger
+
+
+def shutdown():
+    """Дописывает оставшиеся в очередях записи и останавливает слушателей"""
+    with _setup_lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+    for listener in listeners:
+        listener.stop()
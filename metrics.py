@@ -0,0 +1,172 @@
+from contextlib import contextmanager
+import threading
+import bisect
+import time
+
+# Границы корзин гистограмм задержек (секунды): от записи на диск до ответа модели
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Счетчик с метками: inc(1, model='...', status='200')"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, labels, None, value) for labels, value in sorted(values.items())]
+
+
+class Histogram:
+    """Гистограмма с метками в формате Prometheus (накопительные корзины, _sum, _count)"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [счетчики корзин..., сумма, количество]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(data) for key, data in self._values.items()}
+        result = []
+        for labels, data in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                result.append((self.name + '_bucket', labels, ('le', _format_value(bound)), cumulative))
+            result.append((self.name + '_bucket', labels, ('le', '+Inf'), data[-1]))
+            result.append((self.name + '_sum', labels, None, data[-2]))
+            result.append((self.name + '_count', labels, None, data[-1]))
+        return result
+
+
+class Gauge:
+    """Значения, которые считаются в момент запроса метрик: fn() -> {метки: значение}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def samples(self):
+        try:
+            values = self.fn() or {}
+        except Exception:
+            return []
+        return [(self.name, tuple(sorted(labels)), None, value) for labels, value in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, fn):
+        """Регистрирует (или заменяет) вычисляемую метрику"""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, fn)
+            return self._metrics[name]
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels, extra)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'synedrion_stage_seconds',
+    "Длительность этапов обработки сообщения: enqueue, queue_wait, process, key_acquire, "
+    "key_provision, key_delete, ttfb, first_token, completion, history_write"
+)
+COMPLETIONS = REGISTRY.counter('synedrion_completions_total', "Запросы к OpenRouter по моделям и кодам ответа")
+TOKENS = REGISTRY.counter('synedrion_tokens_total', "Токены запросов и ответов по моделям")
+KEY_OPERATIONS = REGISTRY.counter('synedrion_key_operations_total', "Создание и удаление ключей API")
+HTTP_SECONDS = REGISTRY.histogram('synedrion_http_request_seconds', "Время обработки запросов к API приложения")
+HTTP_REQUESTS = REGISTRY.counter('synedrion_http_requests_total', "Запросы к API приложения по маршрутам и кодам ответа")
+
+
+def observe(stage, seconds, **labels):
+    STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+
+@contextmanager
+def span(stage, **labels):
+    """Замеряет блок как этап stage; при исключении добавляет status="error".
+
+    Внутри блока метки можно дополнить: with span('x') as extra: extra['model'] = m
+    """
+    extra = dict(labels)
+    started = time.perf_counter()
+    try:
+        yield extra
+    except BaseException:
+        extra.setdefault('status', 'error')
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, **extra)
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import deque
+
+# Модель "auto" в настройках чата: запрос уходит самой быстрой здоровой модели
+AUTO_MODEL = 'auto'
+
+# Скользящее окно: последние WINDOW исходов, но не старше MAX_AGE секунд -
+# иначе модель, однажды признанная нездоровой, так бы и не получила новых запросов
+WINDOW = 50
+MAX_AGE = 15 * 60
+# Доля ошибок, после которой модель считается нездоровой, и минимум исходов для такого вывода
+MAX_ERROR_RATE = 0.5
+MIN_SAMPLES = 3
+# Время до первого токена для модели, у которой были только ошибки. Модель
+# совсем без исходов идет в начало списка: один запрос, чтобы ее измерить
+DEFAULT_LATENCY = 10.0
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelHealth:
+    """Скользящая статистика моделей: время до первого токена и доля ошибок.
+
+    record() вызывается после каждой попытки запроса к модели; rank()
+    упорядочивает модели для маршрутизации "auto", а latency() дает p95
+    для решения, когда дублировать запрос на резервную модель.
+    """
+
+    def __init__(self, window=WINDOW, max_age=MAX_AGE):
+        self.window = window
+        self.max_age = max_age
+        self._latency = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def _samples(self, store, model, now):
+        samples = store.get(model)
+        if samples is None:
+            samples = store[model] = deque(maxlen=self.window)
+        while samples and samples[0][0] < now - self.max_age:
+            samples.popleft()
+        return samples
+
+    def record(self, model, latency=None, ok=True):
+        """Исход попытки: latency - секунды до первого токена (None, если его не было)"""
+        now = time.time()
+        with self._lock:
+            if latency is not None:
+                self._samples(self._latency, model, now).append((now, latency))
+            self._samples(self._outcomes, model, now).append((now, ok))
+
+    def latency(self, model, q=0.5):
+        """Квантиль q времени до первого токена или None, если замеров нет"""
+        with self._lock:
+            samples = self._samples(self._latency, model, time.time())
+            return _quantile([value for _, value in samples], q) if samples else None
+
+    def error_rate(self, model):
+        with self._lock:
+            samples = self._samples(self._outcomes, model, time.time())
+            if not samples:
+                return 0.0
+            return sum(1 for _, ok in samples if not ok) / len(samples)
+
+    def healthy(self, model):
+        with self._lock:
+            samples = self._samples(self._outcomes, model, time.time())
+            if len(samples) < MIN_SAMPLES:
+                return True
+            errors = sum(1 for _, ok in samples if not ok)
+        return errors / len(samples) <= MAX_ERROR_RATE
+
+    def rank(self, models):
+        """Модели по возрастанию p50, нездоровые - в конце списка"""
+        def key(item):
+            index, model = item
+            latency = self.latency(model)
+            if latency is None:
+                with self._lock:
+                    tried = bool(self._samples(self._outcomes, model, time.time()))
+                latency = DEFAULT_LATENCY if tried else 0
+            return (not self.healthy(model), latency, index)
+        return [model for _, model in sorted(enumerate(models), key=key)]
+
+    def stats(self):
+        with self._lock:
+            models = sorted(set(self._latency) | set(self._outcomes))
+        result = {}
+        for model in models:
+            p50, p95 = self.latency(model, 0.5), self.latency(model, 0.95)
+            with self._lock:
+                outcomes = len(self._samples(self._outcomes, model, time.time()))
+            result[model] = {
+                'p50': None if p50 is None else round(p50, 3),
+                'p95': None if p95 is None else round(p95, 3),
+                'error_rate': round(self.error_rate(model), 3),
+                'samples': outcomes,
+                'healthy': self.healthy(model)
+            }
+        return result
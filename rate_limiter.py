@@ -0,0 +1,152 @@
+import threading
+import random
+import time
+import re
+
+# Лимит бесплатных моделей OpenRouter - 20 запросов в минуту на аккаунт
+DEFAULT_RATE = 20
+DEFAULT_PERIOD = 60
+
+
+class TokenBucket:
+    """Ведро токенов: rate запросов за period секунд, не больше capacity подряд"""
+
+    def __init__(self, rate, period=DEFAULT_PERIOD, capacity=None):
+        self.fill_rate = rate / period
+        self.capacity = capacity or rate
+        self.tokens = float(self.capacity)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится свободный токен"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.fill_rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """Учет лимитов OpenRouter по ключам и по моделям.
+
+    Для каждого ключа провижининга (аккаунта) и каждой модели ведется ведро
+    токенов и время окончания паузы. Паузу выставляет ответ 429: до момента
+    из X-RateLimit-Reset ключ или модель не используются. Запрос, которому
+    сейчас нечего выдать, ждет в очереди, а не получает ошибку.
+    """
+
+    def __init__(self, key_rate=DEFAULT_RATE, model_rate=DEFAULT_RATE, period=DEFAULT_PERIOD):
+        self.rates = {'key': key_rate, 'model': model_rate}
+        self.period = period
+        self._buckets = {}
+        self._cooldowns = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, kind, name):
+        bucket = self._buckets.get((kind, name))
+        if bucket is None and self.rates.get(kind):
+            bucket = self._buckets[(kind, name)] = TokenBucket(self.rates[kind], self.period)
+        return bucket
+
+    def _delay(self, kind, name, now):
+        delay = max(0, self._cooldowns.get((kind, name), 0) - now)
+        bucket = self._bucket(kind, name)
+        if bucket:
+            delay = max(delay, bucket.delay(now))
+        return delay
+
+    def delay(self, key=None, model=None):
+        """Сколько секунд ждать, пока ключ и модель станут доступны (0 - можно сейчас)"""
+        now = time.time()
+        with self._lock:
+            delays = [0]
+            if key is not None:
+                delays.append(self._delay('key', key, now))
+            if model is not None:
+                delays.append(self._delay('model', model, now))
+            return max(delays)
+
+    def try_acquire(self, key, model):
+        """Списывает по токену с ключа и модели. Возвращает 0 или время ожидания"""
+        now = time.time()
+        with self._lock:
+            delay = max(self._delay('key', key, now), self._delay('model', model, now))
+            if delay:
+                return delay
+            for kind, name in (('key', key), ('model', model)):
+                bucket = self._bucket(kind, name)
+                if bucket:
+                    bucket.take(now)
+            return 0
+
+    def cooldown(self, kind, name, until):
+        """Ставит ключ ('key') или модель ('model') на паузу до unix-времени until"""
+        with self._lock:
+            self._cooldowns[(kind, name)] = max(self._cooldowns.get((kind, name), 0), until)
+
+    def cooldown_until(self, kind, name):
+        with self._lock:
+            return self._cooldowns.get((kind, name), 0)
+
+    def choose_model(self, models):
+        """Первая доступная модель из списка, иначе та, что освободится раньше"""
+        delays = [(self.delay(model=model), i, model) for i, model in enumerate(models)]
+        for delay, _, model in delays:
+            if not delay:
+                return model
+        return min(delays)[2]
+
+    def cooldowns(self):
+        """Действующие паузы: {(kind, name): unix-время окончания}"""
+        now = time.time()
+        with self._lock:
+            return {name: until for name, until in self._cooldowns.items() if until > now}
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                f"{kind}:{name}": round(until - now, 1)
+                for (kind, name), until in self._cooldowns.items() if until > now
+            }
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Экспоненциальная задержка со случайным разбросом (full jitter)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_reset(response=None, response_json=None):
+    """Время сброса лимита (unix, секунды) из X-RateLimit-Reset или None.
+
+    OpenRouter присылает его заголовком ответа либо в error.metadata.headers
+    тела ответа, в миллисекундах.
+    """
+    reset = None
+    if response is not None:
+        reset = response.headers.get('X-RateLimit-Reset')
+    if not reset and response_json:
+        reset = (((response_json.get('error') or {}).get('metadata') or {}).get('headers') or {}).get('X-RateLimit-Reset')
+    try:
+        reset = float(reset)
+    except (TypeError, ValueError):
+        return None
+    # Значения в секундах тоже встречаются
+    return reset / 1000 if reset > 1e11 else reset
+
+
+def error_status(error):
+    """HTTP-код ошибки requests, в том числе ошибки, пришедшей в потоке ответа"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code
+    match = re.match(r'\s*(\d{3})\b', str(error))
+    return int(match.group(1)) if match else None
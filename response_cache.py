@@ -0,0 +1,99 @@
+import threading
+import hashlib
+import json
+import time
+
+import db
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+def make_key(model, messages, reasoning_max=0):
+    """SHA-256 нормализованного запроса: модель, сообщения и бюджет рассуждений.
+
+    Порядок ключей и пробелы по краям текста на ключ не влияют.
+    """
+    normalized = {
+        'model': model,
+        'messages': [{'role': m.get('role'), 'content': (m.get('content') or '').strip()} for m in messages],
+        'reasoning': reasoning_max or 0
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Кэш ответов моделей в SQLite.
+
+    Одинаковый запрос (перегенерация, тот же вопрос в новом чате) отдается
+    из кэша без обращения к OpenRouter. Записи живут ttl секунд; когда
+    суммарный размер ответов превышает max_bytes, удаляются давно не
+    использованные.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._conn = db.connect(path)
+        self._lock = threading.Lock()
+        # Должно быть задано до создания таблиц, иначе место после удаления не освобождается
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    def get(self, key):
+        """Сохраненные поля сообщения или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row['created_at'] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row['value'])
+
+    def put(self, key, model, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, raw, len(raw.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        removed = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            # Удаляем самые давно использованные записи, пока не уложимся в лимит
+            for row in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (row['key'],))
+                total -= row['size']
+                removed += 1
+        if removed:
+            self._conn.execute("PRAGMA incremental_vacuum")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("PRAGMA incremental_vacuum")
+
+    def stats(self):
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'entries': row[0], 'bytes': row[1]}
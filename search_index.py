@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+import threading
+import re
+
+import db
+import chat_store
+
+# Длина сниппета и сколько символов оставлять перед первым найденным словом
+SNIPPET_CHARS = 160
+SNIPPET_BEFORE = 40
+MIN_PREFIX = 3
+# Найденные слова в сниппете выделяются как жирный текст в сообщениях
+MARK_OPEN = '**'
+MARK_CLOSE = '**'
+
+_LOADING_RE = re.compile(r'\[LOADING:\d+\].*?\[/LOADING\]', re.S)
+
+
+def normalize(text):
+    """unicode61 не считает ё и е одной буквой - приводим сами"""
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def message_content(message):
+    """Текст сообщения для поиска: у ответа ИИ - сам ответ без рассуждений"""
+    if chat_store.is_transient(message):
+        return ''
+    if message.get('sender') == 'ai' and message.get('answer'):
+        return message['answer']
+    return _LOADING_RE.sub('', message.get('text') or '')
+
+def query_words(text):
+    return re.findall(r'\w+', normalize(text))
+
+def build_query(words):
+    """Слова запроса -> запрос FTS5: все слова, последнее - как префикс
+    (поиск по мере набора и другие окончания слова)"""
+    if not words:
+        return None
+    terms = ['"' + w.replace('"', '""') + '"' for w in words]
+    # Короткий префикс совпадает с огромным числом слов - ищем его целиком
+    if len(words[-1]) >= MIN_PREFIX:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def make_snippet(content, words):
+    """Фрагмент текста вокруг первого найденного слова с выделением слов.
+
+    Считается в Python по тексту документа: snippet() из FTS5 заново
+    разбирает запрос для каждой строки и на префиксных запросах медленный.
+    """
+    pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(w) for w in words) + r')\w*', re.I)
+    match = pattern.search(content)
+    start = max(0, match.start() - SNIPPET_BEFORE) if match else 0
+    end = start + SNIPPET_CHARS
+    fragment = content[start:end].replace('\n', ' ')
+    fragment = pattern.sub(lambda m: f"{MARK_OPEN}{m.group(0)}{MARK_CLOSE}", fragment)
+    return ('…' if start > 0 else '') + fragment + ('…' if end < len(content) else '')
+
+
+class SearchIndex:
+    """Полнотекстовый поиск по чатам (SQLite FTS5).
+
+    Индексируются тексты сообщений, названия и системные промпты чатов.
+    Таблица docs хранит документы с обычным индексом по (чат, сообщение),
+    а FTS5-таблица docs_fts ссылается на нее как на внешнее содержимое и
+    поддерживается триггерами. Индекс обновляется из записей журнала через
+    chat_store.add_listener, поэтому поиск не читает файлы чатов.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = db.connect(path)
+        self._lock = threading.RLock()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                message_id TEXT,
+                field TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS docs_chat ON docs (chat_id, message_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                content, content='docs', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+                INSERT INTO docs_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция; вложенная (перевод старого чата во время rebuild) идет в составе внешней"""
+        if self._conn.in_transaction:
+            yield
+            return
+        self._conn.execute("BEGIN")
+        try:
+            yield
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _put_field(self, chat_id, field, content):
+        self._conn.execute("DELETE FROM docs WHERE chat_id = ? AND message_id IS NULL AND field = ?", (chat_id, field))
+        if content:
+            self._conn.execute(
+                "INSERT INTO docs (chat_id, message_id, field, content) VALUES (?, NULL, ?, ?)",
+                (chat_id, field, normalize(content))
+            )
+
+    def _put_message(self, chat_id, message):
+        message_id = str(message.get('id'))
+        self._conn.execute("DELETE FROM docs WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+        content = message_content(message)
+        if content:
+            self._conn.execute(
+                "INSERT INTO docs (chat_id, message_id, field, content) VALUES (?, ?, ?, ?)",
+                (chat_id, message_id, message.get('sender') or 'message', normalize(content))
+            )
+
+    def _put_chat(self, chat_id, chat):
+        # Документы чата удаляются разом и вставляются одним executemany -
+        # без удаления по одному сообщению (загрузка и перестроение индекса)
+        self._conn.execute("DELETE FROM docs WHERE chat_id = ?", (chat_id,))
+        rows = [(None, field, normalize(chat.get(field))) for field in ('title', 'system_prompt') if chat.get(field)]
+        for message in chat.get('messages', []):
+            content = message_content(message)
+            if content:
+                rows.append((str(message.get('id')), message.get('sender') or 'message', normalize(content)))
+        self._conn.executemany(
+            "INSERT INTO docs (chat_id, message_id, field, content) VALUES (?, ?, ?, ?)",
+            [(chat_id, message_id, field, content) for message_id, field, content in rows]
+        )
+
+    def on_change(self, op, chat_id, record):
+        """Обработчик записей журнала (см. chat_store.add_listener)"""
+        with self._lock:
+            if op == 'create':
+                with self._transaction():
+                    self._put_chat(chat_id, record['chat'])
+            elif op == 'delete':
+                self._conn.execute("DELETE FROM docs WHERE chat_id = ?", (chat_id,))
+            elif op == 'header':
+                fields = record.get('chat', {})
+                for field in ('title', 'system_prompt'):
+                    if field in fields:
+                        self._put_field(chat_id, field, fields[field])
+            elif op == 'put':
+                self._put_message(chat_id, record['message'])
+            elif op == 'del':
+                self._conn.execute("DELETE FROM docs WHERE chat_id = ? AND message_id = ?", (chat_id, str(record.get('id'))))
+
+    def search(self, text, limit=20, offset=0, chat_id=None):
+        """Найденные документы по релевантности: чат, сообщение, поле, сниппет"""
+        words = query_words(text)
+        query = build_query(words)
+        if not query:
+            return []
+        # Сначала только id и ранг - FTS5 сортирует по rank без чтения документов
+        if chat_id:
+            rows = self._conn.execute("""
+                SELECT docs_fts.rowid AS id, docs_fts.rank AS rank
+                FROM docs_fts JOIN docs ON docs.id = docs_fts.rowid
+                WHERE docs_fts MATCH ? AND docs.chat_id = ?
+                ORDER BY docs_fts.rank LIMIT ? OFFSET ?
+            """, (query, chat_id, limit, offset)).fetchall()
+        else:
+            rows = self._conn.execute(
+                "SELECT rowid AS id, rank FROM docs_fts WHERE docs_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                (query, limit, offset)
+            ).fetchall()
+        if not rows:
+            return []
+        ranks = {row['id']: row['rank'] for row in rows}
+        placeholders = ','.join('?' * len(ranks))
+        docs = {doc['id']: doc for doc in self._conn.execute(
+            f"SELECT id, chat_id, message_id, field, content FROM docs WHERE id IN ({placeholders})", list(ranks)
+        )}
+        hits = []
+        for doc_id, rank in ranks.items():
+            doc = docs.get(doc_id)
+            if doc is None:
+                continue
+            message_id = doc['message_id']
+            hits.append({
+                'chat_id': doc['chat_id'],
+                'message_id': int(message_id) if message_id and message_id.isdigit() else message_id,
+                'field': doc['field'],
+                'snippet': make_snippet(doc['content'], words),
+                'rank': rank
+            })
+        return hits
+
+    def count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def rebuild(self):
+        """Строит индекс заново по файлам чатов (разовая операция).
+
+        Чаты переиндексируются по одному: каждый читается и записывается под
+        блокировкой этого чата (chat_store.chat_lock), а блокировка индекса
+        берется только на его запись. Поэтому сохранение сообщений во время
+        перестроения не ждет его окончания, а изменения, внесенные через
+        on_change, не затираются устаревшей копией чата.
+        """
+        chat_ids = set(chat_store.list_chat_ids())
+        for chat_id in chat_ids:
+            with chat_store.chat_lock(chat_id):
+                try:
+                    chat, _ = chat_store.read_log(chat_id)
+                except Exception:
+                    continue
+                with self._lock, self._transaction():
+                    if chat is not None:
+                        self._put_chat(chat_id, chat)
+                    else:
+                        self._conn.execute("DELETE FROM docs WHERE chat_id = ?", (chat_id,))
+        # Документы чатов, которых больше нет (созданные во время перестроения не трогаем)
+        indexed = [row[0] for row in self._conn.execute("SELECT DISTINCT chat_id FROM docs")]
+        for chat_id in indexed:
+            if chat_id in chat_ids:
+                continue
+            with chat_store.chat_lock(chat_id):
+                if not chat_store.chat_exists(chat_id):
+                    with self._lock:
+                        self._conn.execute("DELETE FROM docs WHERE chat_id = ?", (chat_id,))
+        with self._lock:
+            self._conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('optimize')")
+        return self.count()
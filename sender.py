@@ -0,0 +1,653 @@
+from datetime import datetime
+import threading
+import time
+import atexit
+import requests
+from requests.adapters import HTTPAdapter
+import json
+import os
+import logging
+import queue
+
+from events import bus
+from key_pool import KeyLeaseManager, KeyRegistry, KeyProvisioningError, API_BASE
+from context_builder import ContextBuilder, SummaryCache
+from response_cache import ResponseCache, make_key
+from rate_limiter import RateLimiter, backoff_delay, parse_reset, error_status
+import chat_store
+import storage
+import metrics
+from blocks import BlockParser, parse_blocks
+from cancellation import CancelToken, Cancelled
+from model_health import ModelHealth, AUTO_MODEL
+import log_pipeline
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOG_PATH = os.path.join(BASE_DIR, "config", "logs.log")
+
+# Все логгеры synedrion.* пишут через очередь: в потоке запроса - только постановка записи
+log_pipeline.setup("synedrion", LOG_PATH)
+logger = logging.getLogger("synedrion.sender")
+
+def load_json(path: str):
+    """Безопасная загрузка JSON"""
+    if not os.path.exists(path):
+        logger.error(f"Файл не найден: {path}")
+        raise FileNotFoundError(f"Файл не найден: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        logger.info(f"Файл успешно загружен: {path}")
+        return json.load(f)
+
+
+API_URL = f"{API_BASE}/chat/completions"
+
+# Ключи и базовый системный промпт читаются один раз при импорте модуля,
+# а не при обработке каждого сообщения
+KYES_PATH = os.path.join(BASE_DIR, "api_keys.json")
+if not os.path.exists(KYES_PATH): KYES_PATH = os.path.join(BASE_DIR, "api_keys.example.json")
+API_KEYS_P = load_json(KYES_PATH)
+
+# Одна сессия на все запросы к OpenRouter: соединения и TLS переиспользуются
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# Повторы при перегрузке: коды ответа, число попыток и общее время ожидания
+RETRY_STATUSES = (429, 502)
+MAX_ATTEMPTS = 5
+QUEUE_TIMEOUT = 300
+# Пауза аккаунта при 429 без X-RateLimit-Reset и пауза модели при лимите провайдера
+KEY_COOLDOWN = 60
+MODEL_COOLDOWN = 30
+
+LIMITER = RateLimiter()
+HEALTH = ModelHealth()
+
+# Дублирование запроса на резервную модель: ждем p95 основной модели до
+# первого токена, но не меньше HEDGE_MIN_DELAY; без замеров - HEDGE_DEFAULT_DELAY
+HEDGE_MIN_DELAY = 2
+HEDGE_DEFAULT_DELAY = 15
+
+# Модели настроек для "auto" и флаг дублирования; выставляет app.py из settings.json
+_routing = {'models': [], 'hedge': False}
+_routing_lock = threading.Lock()
+
+def configure_routing(models, hedge=False):
+    """Модели-кандидаты для "auto" (url из настроек) и режим дублирования запросов"""
+    with _routing_lock:
+        _routing['models'] = [m for m in models if m and m != AUTO_MODEL]
+        _routing['hedge'] = bool(hedge)
+
+def route_models(models):
+    """Раскрывает "auto" в модели настроек, от самой быстрой здоровой к медленным"""
+    with _routing_lock:
+        candidates = list(_routing['models'])
+    result = []
+    for model in models:
+        expanded = HEALTH.rank([m for m in candidates if m not in models]) if model == AUTO_MODEL else [model]
+        result.extend(m for m in expanded if m not in result)
+    if not result:
+        raise KeyProvisioningError("Нет моделей для режима auto")
+    return result
+
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+def get_key_pool():
+    """Пул API ключей; при первом вызове начинает заранее создавать ключи"""
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            # Несколько экземпляров с общей базой согласуют ключи и паузы лимитов через нее
+            database = storage.shared_database()
+            registry = KeyRegistry(database) if database else None
+            _key_pool = KeyLeaseManager(SESSION, API_KEYS_P, limiter=LIMITER, registry=registry)
+            _key_pool.start()
+            atexit.register(_key_pool.shutdown)
+        return _key_pool
+
+_context_builder = None
+_context_builder_lock = threading.Lock()
+
+def summarize(model, messages):
+    """Краткое содержание для ContextBuilder: обычный запрос к модели чата"""
+    result = complete([model], messages)
+    return result['choices'][0]['message']['content'].strip()
+
+def get_context_builder():
+    """Сборщик контекста с кэшем кратких содержаний в chats/summaries.db"""
+    global _context_builder
+    with _context_builder_lock:
+        if _context_builder is None:
+            cache = SummaryCache(os.path.join(chat_store.CHATS_DIR, "summaries.db"))
+            chat_store.add_listener(cache.on_change)
+            _context_builder = ContextBuilder(cache, summarize)
+        return _context_builder
+
+# Кэш ответов включается настройкой response_cache (по умолчанию выключен)
+RESPONSE_CACHE_PATH = os.path.join(BASE_DIR, "config", "responses.db")
+_response_cache = None
+_cache_bypass = set()
+_response_cache_lock = threading.Lock()
+
+def configure_response_cache(enabled):
+    """Включает или выключает кэш одинаковых запросов"""
+    global _response_cache
+    with _response_cache_lock:
+        if enabled and _response_cache is None:
+            _response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+        elif not enabled:
+            _response_cache = None
+
+def bypass_cache(chat_id):
+    """Следующий запрос чата пойдет к модели, даже если ответ есть в кэше (перегенерация)"""
+    with _response_cache_lock:
+        _cache_bypass.add(chat_id)
+
+def _take_cache(chat_id, chat):
+    """Кэш для запроса чата или None: кэш выключен, в чате no_cache или разовый обход"""
+    with _response_cache_lock:
+        if chat_id in _cache_bypass:
+            _cache_bypass.discard(chat_id)
+            return None
+        return None if chat.get("no_cache") else _response_cache
+
+with open(os.path.join(BASE_DIR, "config", "system_promt.txt"), "r", encoding="utf-8") as f:
+    BASE_SYSTEM_PROMPT = f.read()
+
+RATE_LIMIT_TEXT = "Выбранная модель сейчас недоступна из-за высокой нагрузки или тот ключ, котрый вам выпал врмено не работате попробуйте перезапустить. Попробуйте выбрать другую или попробйте позже."
+
+ERROR_TEXT = "⚠️При обработке запроса возникла ошибка⚠️\nЭто могло произойти из-за:\n❌Неработоспособности ключей API\n❌Ошибки в коде программы\n\nЕсли Вам срочно необходима помощь с решением проблемы, обратитесь в тех поддержку (смотрите раздел 'О приложении'). В противном случае попробуйте создать новый чат, перегенерировать текущий, или дождаться решения проблемы в новом обновлении."
+
+
+def iter_stream_chunks(response):
+    """Разбирает потоковый ответ OpenRouter (stream: true) на JSON-фрагменты"""
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        # Пустые строки разделяют события, строки с ':' - комментарии-keepalive
+        if not line or line.startswith(':') or not line.startswith('data:'):
+            continue
+        payload = line[5:].strip()
+        if payload == '[DONE]':
+            break
+        chunk = json.loads(payload)
+        if chunk.get('error'):
+            error = chunk['error']
+            raise requests.exceptions.HTTPError(f"{error.get('code', '')} Ошибка в потоке ответа: {error.get('message', '')}")
+        yield chunk
+
+
+def complete(models, messages, reasoning_max=0, on_delta=None, timeout=QUEUE_TIMEOUT, cancel=None):
+    """Запрос к первой доступной модели из models, дожидаясь свободного ключа.
+
+    На 429 и 502 запрос повторяется с экспоненциальной задержкой на другом
+    ключе или следующей модели, пока не истечет timeout: при перегрузке
+    пользователь видит ожидание, а не ошибку. Если ответить так и не
+    удалось, выбрасывается последняя ошибка. Отмена cancel прерывает и
+    ожидание, и уже идущий ответ исключением Cancelled.
+
+    Модель "auto" заменяется моделями настроек по скорости (см. route_models);
+    при включенном дублировании запрос идет через hedged_complete.
+    """
+    models = route_models(models)
+    with _routing_lock:
+        hedge = _routing['hedge']
+    if hedge and len(models) > 1:
+        return hedged_complete(models, messages, reasoning_max, on_delta, timeout, cancel)
+    return _complete(models, messages, reasoning_max, on_delta, timeout, cancel)
+
+
+def _complete(models, messages, reasoning_max=0, on_delta=None, timeout=QUEUE_TIMEOUT, cancel=None):
+    """Повторы запроса по списку моделей, см. complete()"""
+    cancel = cancel or CancelToken()
+    deadline = time.time() + timeout
+    streamed = []
+
+    def track(content_part, reasoning_part):
+        streamed.append(True)
+        if on_delta:
+            on_delta(content_part, reasoning_part)
+
+    attempt = 0
+    while True:
+        model = LIMITER.choose_model(models)
+        try:
+            return stream_completion(model, messages, reasoning_max, deadline, track, cancel)
+        except requests.exceptions.RequestException as e:
+            status = error_status(e)
+            # После первого фрагмента запрос уже не повторяем: клиент его получил
+            if status not in RETRY_STATUSES or streamed or attempt + 1 >= MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            if time.time() + delay >= deadline:
+                raise
+            attempt += 1
+            logger.warning(f"Ошибка {status} от {model}, повтор {attempt} через {delay:.1f} с")
+            cancel.wait(delay)
+
+
+
+def hedged_complete(models, messages, reasoning_max=0, on_delta=None, timeout=QUEUE_TIMEOUT, cancel=None):
+    """Запрос с дублированием: если основная модель не ответила за свое p95,
+    тот же запрос уходит следующей модели списка.
+
+    Побеждает ветка, первой приславшая фрагмент ответа: вторая сразу
+    отменяется, а в on_delta попадают только фрагменты победителя. Ошибка
+    одной ветки не прерывает другую; если не ответила ни одна, выбрасывается
+    ошибка основной.
+    """
+    cancel = cancel or CancelToken()
+    primary = LIMITER.choose_model(models)
+    backup = [m for m in models if m != primary]
+    p95 = HEALTH.latency(primary, 0.95)
+    hedge_delay = HEDGE_DEFAULT_DELAY if p95 is None else max(HEDGE_MIN_DELAY, p95)
+    started = time.time()
+    hedge_at = started + hedge_delay
+
+    results = queue.Queue()
+    lock = threading.Lock()
+    tokens = []
+    winner = []
+
+    def claim(index):
+        """Ветка index становится победителем, если победителя еще нет"""
+        with lock:
+            if not winner:
+                winner.append(index)
+                for other, token in enumerate(tokens):
+                    if other != index:
+                        token.cancel()
+                if index:
+                    # Основная модель отменена без ответа: ее время - не меньше прошедшего,
+                    # иначе медленная модель так и осталась бы первой для "auto"
+                    HEALTH.record(primary, time.time() - started)
+            return winner[0] == index
+
+    def start(branch_models):
+        index = len(tokens)
+        token = CancelToken()
+        tokens.append(token)
+
+        def forward(content_part, reasoning_part):
+            if not claim(index):
+                raise Cancelled("Ответила другая модель")
+            if on_delta:
+                on_delta(content_part, reasoning_part)
+
+        def run():
+            try:
+                results.put((index, _complete(branch_models, messages, reasoning_max, forward, timeout, token), None))
+            except Exception as e:
+                results.put((index, None, e))
+        threading.Thread(target=run, name=f"hedge-{index}", daemon=True).start()
+
+    # Отмена запроса отменяет обе ветки
+    remove = cancel.on_cancel(lambda: [token.cancel() for token in list(tokens)])
+    try:
+        start([primary] + backup)
+        pending = 1
+        errors = {}
+        while pending:
+            hedged = len(tokens) > 1
+            try:
+                index, result, error = results.get(timeout=None if hedged else max(0, hedge_at - time.time()))
+            except queue.Empty:
+                index, result, error = None, None, None
+            if index is not None:
+                pending -= 1
+                if error is None and claim(index):
+                    return result
+                errors[index] = error
+                if winner and winner[0] == index:
+                    # Ветка-победитель оборвалась после первого фрагмента
+                    raise error
+            # Резервная ветка - по истечении p95 или сразу после ошибки основной
+            if not hedged and not winner and not cancel.cancelled:
+                if index is None:
+                    logger.info(f"{primary} не ответила за {hedge_delay:.1f} с, запрос продублирован")
+                else:
+                    logger.info(f"Ошибка {primary}, запрос передан резервной модели")
+                metrics.COMPLETIONS.inc(model=primary, status='hedged')
+                start(backup)
+                pending += 1
+        cancel.check()
+        raise errors.get(0) or next(e for e in errors.values() if e)
+    finally:
+        remove()
+
+
+def stream_completion(model, messages, reasoning_max=0, deadline=None, on_delta=None, cancel=None):
+    """Одна попытка запроса: ключ из пула, токены лимитов, потоковый ответ"""
+    deadline = deadline or time.time() + QUEUE_TIMEOUT
+    cancel = cancel or CancelToken()
+    key_pool = get_key_pool()
+    # Ожидание ключа включает и ожидание токенов лимитов
+    with metrics.span('key_acquire', model=model):
+        while True:
+            lease = key_pool.acquire(timeout=max(0, deadline - time.time()), cancel=cancel)
+            delay = LIMITER.try_acquire(lease.parent, model)
+            if not delay:
+                break
+            # Ключ свободен, но лимит модели или аккаунта исчерпан - ждем в очереди
+            key_pool.release(lease)
+            if time.time() + delay > deadline:
+                raise KeyProvisioningError(f"Лимит запросов к {model} исчерпан")
+            logger.info(f"Лимит запросов к {model}, ожидание {delay:.1f} с")
+            cancel.wait(min(delay, 5))
+    cooldown_until = None
+    remove = None
+    status = 'error'
+    first_token = []
+
+    def track(content_part, reasoning_part):
+        if not first_token:
+            first_token.append(time.perf_counter() - sent)
+            metrics.observe('first_token', first_token[0], model=model)
+        if on_delta:
+            on_delta(content_part, reasoning_part)
+    headers = {
+        "Authorization": f"Bearer {lease.key}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "usage": {"include": True}
+    }
+    if reasoning_max>0:
+        data["reasoning"] = {"max_tokens": reasoning_max }
+    else:
+        data["reasoning"] = {"exclude": True}
+    sent = time.perf_counter()
+    try:
+        logger.info(f"Отправка сообщения в API ({model})...")
+        with SESSION.post(API_URL, headers=headers, json=data, timeout=60, stream=True) as response:
+            # Отмена закрывает соединение: чтение потока сразу прерывается
+            remove = cancel.on_cancel(response.close)
+            status = str(response.status_code)
+            metrics.observe('ttfb', time.perf_counter() - sent, model=model, status=status)
+            response.raise_for_status()
+            result = read_stream(response, track)
+            # Соединение, закрытое отменой до начала чтения, дает пустой ответ без ошибки
+            cancel.check()
+        result['model'] = model
+        usage = result.get('usage') or {}
+        for kind in ('prompt', 'completion'):
+            if usage.get(f'{kind}_tokens'):
+                metrics.TOKENS.inc(usage[f'{kind}_tokens'], model=model, kind=kind)
+        content = result['choices'][0]['message']['content']
+        logger.info(f"Ответ от API успешно получен ({model}, {len(content)} символов)", extra={'payload': result})
+        return result
+    except Exception as e:
+        if cancel.cancelled:
+            status = 'cancelled'
+            logger.info(f"Запрос к {model} отменен")
+            raise Cancelled("Запрос отменен") from e
+        if not isinstance(e, requests.exceptions.RequestException):
+            status = 'error'
+            raise
+        logger.error(f"Ошибка сети при запросе: {e}")
+        status = str(error_status(e) or 'error')
+        if error_status(e) == 429:
+            cooldown_until = rate_limited(e, model)
+        raise
+    finally:
+        if remove:
+            remove()
+        metrics.observe('completion', time.perf_counter() - sent, model=model, status=status)
+        metrics.COMPLETIONS.inc(model=model, status=status)
+        # Отмена ничего не говорит о модели и в статистику не идет
+        if status != 'cancelled':
+            HEALTH.record(model, first_token[0] if first_token else None, ok=status == '200')
+        key_pool.release(lease, cooldown_until=cooldown_until)
+
+
+def read_stream(response, on_delta=None):
+    """Собирает потоковый ответ, передавая фрагменты в on_delta(content, reasoning)"""
+    content = []
+    reasoning = []
+    usage = None
+    for chunk in iter_stream_chunks(response):
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        choices = chunk.get('choices') or [{}]
+        delta = choices[0].get('delta') or {}
+        content_part = delta.get('content') or ''
+        reasoning_part = delta.get('reasoning') or ''
+        if not content_part and not reasoning_part:
+            continue
+        content.append(content_part)
+        reasoning.append(reasoning_part)
+        if on_delta:
+            on_delta(content_part, reasoning_part)
+    result = {'choices': [{'message': {'content': ''.join(content), 'reasoning': ''.join(reasoning)}}]}
+    if usage:
+        result['usage'] = usage
+    return result
+
+
+def rate_limited(error, model):
+    """Разбирает 429: ставит на паузу аккаунт ключа или модель.
+
+    Возвращает время окончания паузы аккаунта или None, если лимит
+    упирается в провайдера модели.
+    """
+    response = error.response
+    response_json = None
+    if response is not None:
+        try:
+            response_json = response.json()
+        except ValueError:
+            response_json = None
+        logger.error(f"Ошибка сети при запросе: {response.status_code}", extra={'payload': response_json})
+    reset = parse_reset(response, response_json)
+    if reset:
+        logger.error(f"Сброс лимита произойдет: {datetime.fromtimestamp(reset)}. Ключ заработает через {max(0, reset - time.time()):.0f} с")
+        return reset
+    metadata = ((response_json or {}).get('error') or {}).get('metadata') or {}
+    if metadata.get('provider_name') or metadata.get('raw'):
+        # Лимит у провайдера модели, а не у аккаунта
+        LIMITER.cooldown('model', model, time.time() + MODEL_COOLDOWN)
+        return None
+    return time.time() + KEY_COOLDOWN
+
+
+def describe_error(error):
+    """Текст сообщения об ошибке запроса для пользователя"""
+    status = error_status(error)
+    error_answer = f"Ошибка сети при запросе: {error}\n"
+    if status == 429:
+        error_answer += RATE_LIMIT_TEXT
+    elif status == 502:
+        error_answer += "К сожалению, сервера сейчас перегружены. Попробуйте позже или выберите другую модель."
+    elif status == 404:
+        error_answer += "К сожалению, выбранная вами модель больше не поддерживается. Пожалуйста, выберите другую."
+    return error_answer
+
+
+class ChatRequest:
+    """Один запрос к ИИ для конкретного чата.
+
+    Раньше это состояние хранилось в глобальных переменных api_sender.pyw,
+    который запускался отдельным процессом на каждое сообщение.
+    """
+
+    def __init__(self, chat_filename, cancel=None):
+        self.chat_filename = chat_filename
+        # Отмену выставляет диспетчер: пользователь остановил ответ или пришел новый запрос
+        self.cancel = cancel or CancelToken()
+        self.chat_id = chat_store.chat_id_from_filename(chat_filename)
+        # Один id на весь ответ: индикатор загрузки, поток и итоговое сообщение
+        self.message_id = int(time.time() * 1000)
+        self.history_file = chat_store.load_chat(self.chat_id)
+        if self.history_file is None:
+            logger.error(f"Чат не найден: {self.chat_id}")
+            raise FileNotFoundError(f"Чат не найден: {self.chat_id}")
+        # Незавершенный ответ предыдущего запроса не участвует в истории
+        self.history_file["messages"] = [m for m in self.history_file["messages"] if not chat_store.is_transient(m)]
+        self.user_system_prompt = self.history_file.get("system_prompt", '')
+        self.model = self.history_file.get("model")
+        self.reasoning_max = self.history_file.get("reasoning_len") or 0
+        self.cache = _take_cache(self.chat_id, self.history_file)
+        # Разбор ответа на блоки по мере поступления (см. blocks.py)
+        self.parser = None
+
+    def simulate_progress_real_time(self, stop_event, max_percent=80, total_time=35):
+        """Линейный прогресс от 0 до max_percent с мгновенной остановкой."""
+        start_time = time.time()
+        progress = 0
+        while not stop_event.is_set() and not self.cancel.cancelled:
+            elapsed = time.time() - start_time
+            progress =  (elapsed / (elapsed + total_time/2.5)) * max_percent
+            try:
+                self.save_history({}, 'generating', progress=min(67, progress))
+            except Cancelled:
+                return
+            stop_event.wait(1)
+
+    def load_history(self):
+        """История диалога для запроса в пределах бюджета токенов модели"""
+        system_prompt = f"{BASE_SYSTEM_PROMPT} \n [USERPROMPT] \n{self.user_system_prompt} \n[/USERPROMPT] \n [/INSTRUCTION]"
+        history = get_context_builder().build(self.chat_id, system_prompt, self.history_file["messages"], self.model, self.reasoning_max)
+        logger.info(f"История диалога загружена. Всего сообщений: {len(history)}")
+        return history
+
+    def save_history(self, response, state = None, progress = 0, blocks = None):
+        """Сохраняет ответ в журнал чата, а индикатор загрузки - в файл состояния.
+
+        blocks - уже разобранные блоки ответа; если их нет, ответ разбирается здесь.
+        """
+        # Отмененный запрос ничего не пишет в чат
+        self.cancel.check()
+        answer = response.get('choices',[{}])[0].get('message',{}).get('content','')
+        reasoning = response.get('choices',[{}])[0].get('message',{}).get('reasoning','')
+        if not answer:
+            if state == "start":
+                text = f"[LOADING:10]Создание запроса...[/LOADING]"
+            elif state == 'generating':
+                text = f"[LOADING:{int(20 + progress)}]Генерация ответа...[/LOADING]"
+        elif reasoning:
+            text = f"[THOUGHTS]\n{reasoning}\n[/THOUGHTS]\n{answer}"
+            logger.info("История успешно сохранена.")
+        else:
+            text = answer + " "
+            logger.info("История успешно сохранена.")
+        message = {
+            'id': self.message_id,
+            'sender': 'ai',
+            "reasoning": reasoning,
+            "answer": answer,
+            'text':  text,
+            'timestamp': datetime.now().isoformat()
+        }
+        if answer:
+            message['blocks'] = blocks if blocks is not None else parse_blocks(answer)
+        with metrics.span('history_write', kind='answer' if answer else 'progress'):
+            if answer:
+                chat_store.put_message(self.chat_id, message)
+                chat_store.clear_transient(self.chat_id)
+            else:
+                chat_store.set_transient(self.chat_id, message)
+        bus.publish(self.chat_id, 'message', message)
+        return message
+
+    def save_error(self, text):
+        """Добавляет в чат сообщение об ошибке"""
+        message = {
+            'id': int(time.time() * 1000),
+            'sender': 'error',
+            'text': text,
+            'timestamp': datetime.now().isoformat()
+        }
+        chat_store.put_message(self.chat_id, message)
+        chat_store.clear_transient(self.chat_id)
+        # Сообщение об ошибке заменяет индикатор загрузки с self.message_id
+        bus.publish(self.chat_id, 'removed', {'id': self.message_id})
+        bus.publish(self.chat_id, 'message', message)
+
+    def send_message_api(self, history):
+        """Отправляет запрос и сохраняет ошибку в чат, если ответа не будет"""
+        models = [self.model] + [m for m in self.history_file.get("fallback_models") or [] if m != self.model]
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.simulate_progress_real_time, args=(stop_event, 80, 35), daemon=True)
+
+        self.parser = BlockParser()
+
+        def on_delta(content_part, reasoning_part):
+            # С первым токеном имитация прогресса больше не нужна
+            stop_event.set()
+            bus.publish(self.chat_id, 'delta', {
+                'id': self.message_id,
+                'content': content_part,
+                'reasoning': reasoning_part,
+                'blocks': self.parser.feed(content_part) if content_part else []
+            })
+
+        thread.start()
+        try:
+            return complete(models, history, self.reasoning_max, on_delta=on_delta, cancel=self.cancel)
+        except requests.exceptions.RequestException as e:
+            # Индикатор загрузки не должен появиться поверх сообщения об ошибке
+            stop_event.set()
+            thread.join()
+            self.save_error(describe_error(e))
+            return None
+        except KeyProvisioningError as e:
+            stop_event.set()
+            thread.join()
+            logger.error(f"Нет доступного ключа API: {e}")
+            self.save_error(f"Ошибка сети при запросе: {e}\n" + RATE_LIMIT_TEXT)
+            return None
+        finally:
+            stop_event.set()
+            thread.join()
+
+    def run(self):
+        """Полный цикл обработки: индикатор загрузки, запрос к API, сохранение ответа"""
+        try:
+            self.save_history({}, "start")
+            history = self.load_history()
+            cache_key = make_key(self.model, history, self.reasoning_max) if self.cache else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached:
+                logger.info("Ответ взят из кэша.")
+                answer = {'choices': [{'message': {'content': cached['answer'], 'reasoning': cached['reasoning']}}], 'model': self.model}
+            else:
+                answer = self.send_message_api(history)
+            if answer:
+                blocks = None
+                if answer['choices'][0]['message']['content'] == "" : answer['choices'][0]['message']['content'] += "[RESPONSE]\n*треск сверчков*\n[/RESPONSE]"
+                elif not cached and self.parser:
+                    # Ответ уже разобран по мере поступления
+                    self.parser.finish()
+                    blocks = self.parser.blocks()
+                message = self.save_history(answer, blocks=blocks)
+                logger.info("Ответ сохранён в истории.")
+                # Ответ резервной модели не кэшируется под ключом основной; для "auto" подходит любая
+                if cache_key and not cached and self.model in (answer.get('model'), AUTO_MODEL):
+                    self.cache.put(cache_key, self.model, {k: message[k] for k in ('reasoning', 'answer', 'text')})
+                return True
+            logger.warning("Ответ не был получен.")
+            return False
+        except Cancelled:
+            # Индикатор загрузки и недописанный ответ убираются из чата
+            logger.info(f"Запрос для чата {self.chat_id} отменен")
+            chat_store.clear_transient(self.chat_id)
+            bus.publish(self.chat_id, 'removed', {'id': self.message_id})
+            return False
+        except Exception:
+            logger.exception("Ошибка в коде")
+            self.save_error(ERROR_TEXT)
+            raise
+
+
+def process_request(chat_filename, cancel=None):
+    """Обрабатывает один запрос для файла чата chat_filename.
+
+    cancel - CancelToken, через который диспетчер отменяет запрос.
+    """
+    try:
+        return ChatRequest(chat_filename, cancel).run()
+    finally:
+        logger.info(f"Обработка запроса для {chat_filename} завершена!")
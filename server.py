@@ -0,0 +1,58 @@
+import argparse
+import logging
+
+logger = logging.getLogger("synedrion.server")
+
+HOST = '127.0.0.1'
+PORT = 5001
+# Каждый открытый поток событий (/api/chats/<id>/events) занимает поток
+# сервера, поэтому потоков нужно заметно больше, чем одновременных клиентов
+THREADS = 32
+CONNECTION_LIMIT = 200
+# Сколько секунд держать простаивающее соединение (keep-alive)
+CHANNEL_TIMEOUT = 120
+
+
+def serve(app, host=HOST, port=PORT, threads=THREADS, connection_limit=CONNECTION_LIMIT, channel_timeout=CHANNEL_TIMEOUT):
+    """Запускает Flask-приложение на многопоточном WSGI-сервере (блокирует поток).
+
+    Используется waitress. Несколько процессов не поддерживаются: очередь
+    запросов к ИИ, события чатов и блокировки чатов живут внутри процесса.
+    Без waitress запускается многопоточный сервер Werkzeug без отладки.
+    """
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        logger.warning("waitress не установлен, используется сервер Werkzeug (pip install waitress)")
+        from werkzeug.serving import make_server
+        server = make_server(host, port, app, threaded=True)
+        server.serve_forever()
+        return
+    logger.info(f"Сервер запущен на http://{host}:{port} ({threads} потоков)")
+    waitress_serve(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        connection_limit=connection_limit,
+        channel_timeout=channel_timeout,
+        ident='Synedrion'
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synedrion")
+    parser.add_argument('--headless', action='store_true', help="запустить только сервер, без окна приложения")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--threads', type=int, default=THREADS, help="число потоков обработки запросов")
+    parser.add_argument('--connection-limit', type=int, default=CONNECTION_LIMIT, help="максимум одновременных соединений")
+    parser.add_argument('--channel-timeout', type=int, default=CHANNEL_TIMEOUT, help="таймаут простаивающего соединения, с")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    args = parse_args()
+    from app import app
+    serve(app, args.host, args.port, args.threads, args.connection_limit, args.channel_timeout)
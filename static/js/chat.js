@@ -3,8 +3,26 @@ class SingleChat {
         this.currentChatId = null;
         this.currentChatData = null;
         this.pollingInterval = null;
+        this.eventSource = null;
+        this.streamRenderFrame = null;
+        this.pendingStreamMessage = null;
         this.lastMessageCount = 0;
         this.isWaitingForAI = false;
+        // Список чатов загружается страницами
+        this.chatsPageSize = 50;
+        this.chatsNextCursor = null;
+        this.isLoadingMoreChats = false;
+        // Готовый HTML сообщений ИИ: неизменное сообщение не разбирается заново
+        this.renderCache = new Map();
+        // Сообщения чата загружаются страницами с конца, рассуждения модели - по раскрытию
+        this.messagesPageSize = 50;
+        this.olderMessagesCursor = null;
+        this.isLoadingOlderMessages = false;
+        this.reasoningCache = new Map();
+        // В DOM только видимые сообщения (см. message_list.js)
+        this.messageList = null;
+        // Новые сообщения, которые появляются с анимацией
+        this.animateIds = new Set();
         this.init();
     }
 
@@ -31,6 +49,47 @@ class SingleChat {
 
         // Загружаем список чатов при инициализации
         this.loadChatsList();
+
+        // Подгружаем следующую страницу чатов при прокрутке списка до конца
+        const chatsListElement = document.getElementById('chats-list');
+        if (chatsListElement) {
+            chatsListElement.addEventListener('scroll', () => {
+                if (chatsListElement.scrollTop + chatsListElement.clientHeight >= chatsListElement.scrollHeight - 100) {
+                    this.loadMoreChats();
+                }
+            });
+        }
+        
+        const messagesElement = document.getElementById('chat-messages');
+        if (messagesElement) {
+            this.messageList = new MessageList(messagesElement, {
+                getMessages: () => (this.currentChatData && this.currentChatData.messages) || [],
+                createElement: (message) => this.createMessageElement(message),
+                patchElement: (element, message) => this.updateMessageContent(element, message),
+                onRendered: () => this.initCodeCopyButtons()
+            });
+            // Кнопки перегенерации: один обработчик на весь список
+            messagesElement.addEventListener('click', (e) => {
+                const button = e.target.closest('.regenerate-btn');
+                if (button && messagesElement.contains(button)) {
+                    e.stopPropagation();
+                    this.regenerateMessage(Number(button.dataset.messageId));
+                }
+            });
+            // Более старые сообщения подгружаются при прокрутке к началу чата
+            messagesElement.addEventListener('scroll', () => {
+                if (messagesElement.scrollTop < 200) {
+                    this.loadOlderMessages();
+                }
+            });
+            // Раскрытие блока мыслей (делегирование: сообщения перерисовываются)
+            messagesElement.addEventListener('click', (e) => {
+                const header = e.target.closest('.ai-thoughts-header');
+                if (header && messagesElement.contains(header)) {
+                    this.toggleThoughts(header);
+                }
+            });
+        }
         
         // Назначаем обработчики событий
         document.getElementById('new-chat-btn').addEventListener('click', () => {
@@ -349,6 +408,7 @@ class SingleChat {
                         option.textContent = model.name;
                         modelSelect.appendChild(option);
                     });
+                    modelSelect.appendChild(this.createAutoModelOption(false));
                 } else {
                     modelSelect.innerHTML = '<option value="">Нет доступных моделей</option>';
                 }
@@ -508,6 +568,7 @@ class SingleChat {
                         }
                         modelSelect.appendChild(option);
                     });
+                    modelSelect.appendChild(this.createAutoModelOption(chatData.model === 'auto'));
                 }
                 
                 // Показываем модальное окно с правильным display
@@ -555,29 +616,39 @@ class SingleChat {
         }
         
         try {
-            // Загружаем текущие данные чата
-            const response = await fetch(`/api/chats/${chatId}`);
+            // Только поля чата без сообщений: длинный чат не загружается и не пересылается целиком
+            const response = await fetch(`/api/chats/${chatId}/meta`);
             if (response.ok) {
-                const chatData = await response.json();
-                
-                // Обновляем данные
-                chatData.title = title;
-                chatData.model = modelUrl;
-                chatData.system_prompt = systemPrompt || undefined; // Не добавляем, если пустой
-                
-                // Сохраняем обновленные данные
-                const updateResponse = await fetch(`/api/chats/${chatId}`, {
-                    method: 'PUT',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(chatData)
+                const meta = await response.json();
+                const fields = {
+                    title: title,
+                    model: modelUrl,
+                    system_prompt: systemPrompt || null
+                };
+                const changed = {};
+                Object.keys(fields).forEach(key => {
+                    const current = meta[key] === undefined ? null : meta[key];
+                    if (current !== fields[key]) {
+                        changed[key] = fields[key];
+                    }
                 });
-                
-                if (updateResponse.ok) {
-                    // Обновляем UI
+
+                let updateResponse = null;
+                if (Object.keys(changed).length) {
+                    updateResponse = await fetch(`/api/chats/${chatId}`, {
+                        method: 'PATCH',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify(changed)
+                    });
+                }
+
+                if (!updateResponse || updateResponse.ok) {
+                    // Обновляем UI (сообщения у клиента остаются прежними страницами)
                     if (this.currentChatId === chatId) {
-                        this.currentChatData = chatData;
+                        const updated = updateResponse ? await updateResponse.json() : meta;
+                        this.currentChatData = Object.assign(this.currentChatData, updated);
                         const titleElement = document.getElementById('current-chat-title');
                         if (titleElement) {
                             titleElement.textContent = title;
@@ -612,13 +683,14 @@ class SingleChat {
         }
     }
 
-    // Загрузка списка чатов
+    // Загрузка списка чатов (первая страница)
     async loadChatsList() {
         try {
-            const response = await fetch('/api/chats');
+            const response = await fetch(`/api/chats?limit=${this.chatsPageSize}`);
             if (response.ok) {
-                const chats = await response.json();
-                this.renderChatsList(chats);
+                const page = await response.json();
+                this.chatsNextCursor = page.next_cursor;
+                this.renderChatsList(page.chats);
             } else {
                 console.error('Ошибка загрузки списка чатов');
                 this.renderChatsList([]);
@@ -629,17 +701,39 @@ class SingleChat {
         }
     }
 
-    // Отображение списка чатов
-    renderChatsList(chats) {
+    // Загрузка следующей страницы списка чатов
+    async loadMoreChats() {
+        if (!this.chatsNextCursor || this.isLoadingMoreChats) return;
+
+        this.isLoadingMoreChats = true;
+        try {
+            const cursor = encodeURIComponent(this.chatsNextCursor);
+            const response = await fetch(`/api/chats?limit=${this.chatsPageSize}&cursor=${cursor}`);
+            if (response.ok) {
+                const page = await response.json();
+                this.chatsNextCursor = page.next_cursor;
+                this.renderChatsList(page.chats, true);
+            }
+        } catch (error) {
+            console.error('Ошибка загрузки списка чатов:', error);
+        } finally {
+            this.isLoadingMoreChats = false;
+        }
+    }
+
+    // Отображение списка чатов (append - дописать страницу к уже показанным)
+    renderChatsList(chats, append = false) {
         const chatsListElement = document.getElementById('chats-list');
         if (!chatsListElement) return;
 
-        if (chats.length === 0) {
+        if (append) {
+            if (chats.length === 0) return;
+        } else if (chats.length === 0) {
             chatsListElement.innerHTML = '<div class="loading-placeholder">Нет чатов. Создайте новый!</div>';
             return;
+        } else {
+            chatsListElement.innerHTML = '';
         }
-
-        chatsListElement.innerHTML = '';
         
         chats.forEach(chat => {
             const chatElement = document.createElement('div');
@@ -693,7 +787,7 @@ class SingleChat {
 
     // Остальные методы остаются без изменений...
     // (loadChat, startPolling, stopPolling, checkForUpdates, renderChat, clearChat, 
-    // addMessageToChat, sendToAI, saveChat, autoResizeTextarea, escapeHtml, destroy)
+    // addMessageToChat, sendToAI, saveMessage, autoResizeTextarea, escapeHtml, destroy)
 
     createCodeBlockHTML(language, codeContent) {
         // Разбиваем код на строки
@@ -735,9 +829,19 @@ class SingleChat {
         try {
             this.stopPolling();
             
-            const response = await fetch(`/api/chats/${chatId}`);
-            if (response.ok) {
-                this.currentChatData = await response.json();
+            // Поля чата и последняя страница сообщений без рассуждений модели
+            const [metaResponse, pageResponse] = await Promise.all([
+                fetch(`/api/chats/${chatId}/meta`),
+                fetch(`/api/chats/${chatId}/messages?limit=${this.messagesPageSize}&omit=reasoning`)
+            ]);
+            if (metaResponse.ok && pageResponse.ok) {
+                const page = await pageResponse.json();
+                this.currentChatData = Object.assign(await metaResponse.json(), { messages: page.messages });
+                this.olderMessagesCursor = page.before;
+                if (this.currentChatId !== chatId) {
+                    this.renderCache.clear();
+                    this.reasoningCache.clear();
+                }
                 this.currentChatId = chatId;
                 this.lastMessageCount = this.currentChatData.messages ? this.currentChatData.messages.length : 0;
                 
@@ -745,7 +849,7 @@ class SingleChat {
                 this.renderChat();
                 
                 this.loadChatsList();
-                this.startPolling();
+                this.startEventStream();
             } else {
                 console.error('Чат не найден');
                 this.clearChat();
@@ -767,148 +871,223 @@ class SingleChat {
         }, 1000);
     }
 
-    // Остановка периодической проверки
+    // Остановка периодической проверки и потока событий
     stopPolling() {
         if (this.pollingInterval) {
             clearInterval(this.pollingInterval);
             this.pollingInterval = null;
         }
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+
+    // Подписка на поток событий чата (SSE) вместо периодического опроса
+    startEventStream() {
+        this.stopPolling();
+
+        if (!this.currentChatId || typeof EventSource === 'undefined') {
+            this.startPolling();
+            return;
+        }
+
+        const messages = this.currentChatData && this.currentChatData.messages ? this.currentChatData.messages : [];
+        const lastId = messages.length > 0 ? messages[messages.length - 1].id : '';
+        const source = new EventSource(`/api/chats/${this.currentChatId}/events?last_id=${lastId}`);
+        this.eventSource = source;
+
+        let failures = 0;
+        source.addEventListener('open', () => {
+            failures = 0;
+        });
+        source.addEventListener('sync', (e) => this.applySyncEvent(JSON.parse(e.data)));
+        source.addEventListener('message', (e) => this.applyMessageEvent(JSON.parse(e.data)));
+        source.addEventListener('delta', (e) => this.applyDeltaEvent(JSON.parse(e.data)));
+        source.addEventListener('removed', (e) => this.removeMessageFromChat(JSON.parse(e.data).id));
+        // Сервер потерял часть событий - перечитываем чат целиком
+        source.addEventListener('resync', () => this.checkForUpdates());
+        source.onerror = () => {
+            failures++;
+            // Если поток событий недоступен, возвращаемся к периодическому опросу
+            if (failures >= 3 && this.eventSource === source) {
+                source.close();
+                this.eventSource = null;
+                this.startPolling();
+            }
+        };
+    }
+
+    // DOM-элемент сообщения по его id (null, если сообщение вне видимой области)
+    findMessageElement(messageId) {
+        return this.messageList ? this.messageList.elementFor(messageId) : null;
+    }
+
+    // Сообщения, пропущенные между загрузкой чата и подключением к потоку
+    applySyncEvent(data) {
+        if (!this.currentChatData) return;
+
+        (data.messages || []).forEach(message => this.applyMessageEvent(message));
+
+        // Индикатор загрузки, которого уже нет на сервере, заменён ошибкой - убираем его
+        const serverIds = data.ids || [];
+        (this.currentChatData.messages || [])
+            .filter(msg => msg.sender === 'ai' && (msg.streaming || this.isLoadingMessage(msg.text)) && !serverIds.includes(msg.id))
+            .forEach(msg => this.removeMessageFromChat(msg.id));
     }
 
-    // Проверка на наличие обновлений в чате
+    // Новое или изменённое сообщение
+    applyMessageEvent(message) {
+        if (!this.currentChatData || !message) return;
+        if (!this.currentChatData.messages) {
+            this.currentChatData.messages = [];
+        }
+
+        const messages = this.currentChatData.messages;
+        const index = messages.findIndex(msg => msg.id === message.id);
+
+        if (index !== -1) {
+            // Запоздавший индикатор загрузки не должен затирать уже идущий поток ответа
+            if (messages[index].streaming && this.isLoadingMessage(message.text)) return;
+
+            // Меняется только элемент этого сообщения (например, [LOADING:n] -> ответ)
+            messages[index] = message;
+            this.messageList.update(message.id);
+            this.messageList.scrollToBottom();
+        } else {
+            messages.push(message);
+            if (this.isLoadingMessage(message.text)) {
+                this.messageList.scrollToBottom();
+            } else {
+                this.addMessageToChat(message);
+            }
+        }
+
+        this.lastMessageCount = messages.length;
+        this.updateWaitingState();
+    }
+
+    // Фрагмент ответа модели, пришедший во время генерации
+    applyDeltaEvent(delta) {
+        if (!this.currentChatData || !delta) return;
+        if (!this.currentChatData.messages) {
+            this.currentChatData.messages = [];
+        }
+
+        let message = this.currentChatData.messages.find(msg => msg.id === delta.id);
+        if (!message) {
+            message = { id: delta.id, sender: 'ai', text: '', timestamp: new Date().toISOString() };
+            this.currentChatData.messages.push(message);
+            this.lastMessageCount = this.currentChatData.messages.length;
+            this.messageList.scrollToBottom();
+        }
+
+        // Первый фрагмент заменяет индикатор загрузки
+        if (!message.streaming) {
+            message.streaming = true;
+            message.answer = '';
+            message.reasoning = '';
+            message.blocks = [];
+        }
+
+        message.answer += delta.content || '';
+        message.reasoning += delta.reasoning || '';
+        // Сервер уже разобрал фрагмент на блоки - дописываем их
+        (delta.blocks || []).forEach(change => {
+            const block = message.blocks[change.index] || (message.blocks[change.index] = {
+                type: change.type,
+                language: change.language,
+                content: ''
+            });
+            block.content += change.append;
+            block.closed = change.closed;
+        });
+        message.text = message.reasoning
+            ? `[THOUGHTS]\n${message.reasoning}\n[/THOUGHTS]\n${message.answer}`
+            : message.answer;
+
+        this.scheduleStreamRender(message);
+    }
+
+    // Перерисовка потокового сообщения не чаще одного раза за кадр
+    scheduleStreamRender(message) {
+        this.pendingStreamMessage = message;
+        if (this.streamRenderFrame) return;
+
+        this.streamRenderFrame = requestAnimationFrame(() => {
+            this.streamRenderFrame = null;
+            const pending = this.pendingStreamMessage;
+            this.pendingStreamMessage = null;
+            if (!pending || !pending.streaming) return;
+
+            this.messageList.update(pending.id);
+            this.messageList.scrollToBottom();
+            this.updateWaitingState();
+        });
+    }
+
+    // Удаление сообщения из данных и интерфейса
+    removeMessageFromChat(messageId) {
+        if (this.currentChatData && this.currentChatData.messages) {
+            this.currentChatData.messages = this.currentChatData.messages.filter(msg => msg.id !== messageId);
+            this.lastMessageCount = this.currentChatData.messages.length;
+        }
+        if (this.messageList) {
+            this.messageList.forget(messageId);
+            this.messageList.render();
+        }
+    }
+
+    // Проверка на наличие обновлений в чате (если поток событий недоступен)
     async checkForUpdates() {
         if (!this.currentChatId) return;
 
+        const chatId = this.currentChatId;
         try {
-            const response = await fetch(`/api/chats/${this.currentChatId}`);
-            if (response.ok) {
-                const updatedChatData = await response.json();
-                const newMessageCount = updatedChatData.messages ? updatedChatData.messages.length : 0;
-                
-                // Проверяем, изменились ли данные чата
-                const hasDataChanged = JSON.stringify(updatedChatData) !== JSON.stringify(this.currentChatData);
-                
-                if (hasDataChanged) {
-                    // Если количество сообщений увеличилось, добавляем новые сообщения
-                    if (newMessageCount > this.lastMessageCount) {
-                        // Добавляем новые сообщения в чат
-                        for (let i = this.lastMessageCount; i < newMessageCount; i++) {
-                            const newMessage = updatedChatData.messages[i];
-                            const isMessageAlreadyAdded = this.currentChatData.messages && 
-                                this.currentChatData.messages.some(msg => msg.id === newMessage.id);
-                            
-                            if (!isMessageAlreadyAdded) {
-                                // Проверяем, содержит ли сообщение тег [LOADING]
-                                if (newMessage.text && newMessage.text.includes('[LOADING:')) {
-                                    // Сообщения с тегом [LOADING] всегда обрабатываем без анимации
-                                    this.addMessageToChatWithoutAnimation(newMessage);
-                                } else {
-                                    // Остальные сообщения обрабатываем с анимацией
-                                    this.addMessageToChat(newMessage);
-                                }
-                            }
-                        }
-                        
-                        // Обновляем данные чата и счетчик сообщений
-                        this.currentChatData = updatedChatData;
-                        this.lastMessageCount = newMessageCount;
-                        
-                        // Прокручиваем вниз
-                        const messagesElement = document.getElementById('chat-messages');
-                        if (messagesElement) {
-                            messagesElement.scrollTop = messagesElement.scrollHeight;
-                        }
-                        
-                        // Проверяем состояние ожидания на основе последнего сообщения
-                        if (this.currentChatData.messages.length > 0) {
-                            const lastMessage = this.currentChatData.messages[this.currentChatData.messages.length - 1];
-                            if (lastMessage.sender === 'ai') {
-                                // Проверяем, не содержит ли последнее сообщение тег [LOADING]
-                                if (lastMessage.text && lastMessage.text.includes('[LOADING:')) {
-                                    this.isWaitingForAI = true;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = true;
-                                    }
-                                } else {
-                                    this.isWaitingForAI = false;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = false;
-                                    }
-                                }
-                            }
-                        }
-                    } else if (newMessageCount === this.lastMessageCount) {
-                        // Количество сообщений не изменилось, но содержимое могло измениться
-                        // Это случай, когда [LOADING] заменяется на нормальное сообщение
-                        
-                        // Проверяем, изменились ли сообщения
-                        const hasMessagesChanged = JSON.stringify(updatedChatData.messages) !== 
-                                                JSON.stringify(this.currentChatData.messages);
-                        
-                        if (hasMessagesChanged) {
-                            // Сообщения изменились - перерисовываем чат БЕЗ анимации
-                            this.currentChatData = updatedChatData;
-                            this.renderChatWithoutAnimation();
-                        } else {
-                            // Только метаданные изменились
-                            this.currentChatData = updatedChatData;
-                        }
-                        
-                        // Проверяем состояние ожидания на основе последнего сообщения
-                        if (this.currentChatData.messages.length > 0) {
-                            const lastMessage = this.currentChatData.messages[this.currentChatData.messages.length - 1];
-                            if (lastMessage.sender === 'ai') {
-                                // Проверяем, не содержит ли последнее сообщение тег [LOADING]
-                                if (lastMessage.text && lastMessage.text.includes('[LOADING:')) {
-                                    this.isWaitingForAI = true;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = true;
-                                    }
-                                } else {
-                                    this.isWaitingForAI = false;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = false;
-                                    }
-                                }
-                            }
-                        }
-                    } else {
-                        // Количество сообщений уменьшилось (редкий случай) - перерисовываем полностью БЕЗ анимации
-                        this.currentChatData = updatedChatData;
-                        this.lastMessageCount = newMessageCount;
-                        this.renderChatWithoutAnimation();
-                        
-                        // Проверяем состояние ожидания
-                        if (this.currentChatData.messages.length > 0) {
-                            const lastMessage = this.currentChatData.messages[this.currentChatData.messages.length - 1];
-                            if (lastMessage.sender === 'ai') {
-                                // Проверяем, не содержит ли последнее сообщение тег [LOADING]
-                                if (lastMessage.text && lastMessage.text.includes('[LOADING:')) {
-                                    this.isWaitingForAI = true;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = true;
-                                    }
-                                } else {
-                                    this.isWaitingForAI = false;
-                                    const sendButton = document.getElementById('send-message-btn');
-                                    if (sendButton) {
-                                        sendButton.disabled = false;
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
+            const response = await fetch(`/api/chats/${chatId}/messages?limit=${this.messagesPageSize}&omit=reasoning`);
+            if (!response.ok || chatId !== this.currentChatId || !this.currentChatData) return;
+
+            const page = await response.json();
+            const known = new Map((this.currentChatData.messages || []).map(msg => [msg.id, JSON.stringify(msg)]));
+            // Применяем только новые и изменившиеся сообщения последней страницы
+            this.applySyncEvent({
+                messages: page.messages.filter(msg => known.get(msg.id) !== JSON.stringify(msg)),
+                ids: page.messages.map(msg => msg.id)
+            });
+            this.updateWaitingState();
         } catch (error) {
             console.error('Ошибка проверки обновлений:', error);
         }
     }
+
+    // Подгрузка страницы более старых сообщений при прокрутке к началу чата
+    async loadOlderMessages() {
+        if (!this.currentChatId || !this.olderMessagesCursor || this.isLoadingOlderMessages) return;
+
+        const chatId = this.currentChatId;
+        this.isLoadingOlderMessages = true;
+        try {
+            const response = await fetch(`/api/chats/${chatId}/messages?before=${this.olderMessagesCursor}&limit=${this.messagesPageSize}&omit=reasoning`);
+            if (!response.ok || chatId !== this.currentChatId || !this.currentChatData) return;
+
+            const page = await response.json();
+            const messages = this.currentChatData.messages || [];
+            const known = new Set(messages.map(msg => msg.id));
+            const older = page.messages.filter(msg => !known.has(msg.id));
+            this.currentChatData.messages = older.concat(messages);
+            this.lastMessageCount = this.currentChatData.messages.length;
+            this.olderMessagesCursor = page.before;
+
+            // Список сохраняет положение видимых сообщений, страница добавляется выше
+            if (older.length > 0) {
+                this.messageList.render();
+            }
+        } catch (error) {
+            console.error('Ошибка загрузки сообщений:', error);
+        } finally {
+            this.isLoadingOlderMessages = false;
+        }
+    }
     
     updateWaitingState() {
         if (!this.currentChatData || !this.currentChatData.messages) {
@@ -932,8 +1111,8 @@ class SingleChat {
         // Получаем последнее сообщение
         const lastMessage = this.currentChatData.messages[this.currentChatData.messages.length - 1];
         
-        // Проверяем, является ли последнее сообщение сообщением с тегом [LOADING]
-        if (lastMessage.sender === 'ai' && this.isLoadingMessage(lastMessage.text)) {
+        // Проверяем, является ли последнее сообщение сообщением с тегом [LOADING] или ответом, который еще генерируется
+        if (lastMessage.sender === 'ai' && (lastMessage.streaming || this.isLoadingMessage(lastMessage.text))) {
             this.isWaitingForAI = true; // Продолжаем ждать
             const sendButton = document.getElementById('send-message-btn');
             if (sendButton) {
@@ -1000,51 +1179,12 @@ class SingleChat {
             titleElement.textContent = this.currentChatData.title || 'Без названия';
         }
 
-        const messagesElement = document.getElementById('chat-messages');
-        if (messagesElement) {
-            if (this.currentChatData.messages && this.currentChatData.messages.length > 0) {
-                messagesElement.innerHTML = '';
-                this.currentChatData.messages.forEach(message => {
-                    this.addMessageToChat(message);
-                });
-                
-                // Проверяем состояние ожидания на основе последнего сообщения
-                if (this.currentChatData.messages.length > 0) {
-                    const lastMessage = this.currentChatData.messages[this.currentChatData.messages.length - 1];
-                    if (lastMessage.sender === 'user') {
-                        this.isWaitingForAI = true;
-                        const sendButton = document.getElementById('send-message-btn');
-                        if (sendButton) {
-                            sendButton.disabled = true;
-                        }
-                    } else if (lastMessage.sender === 'ai') {
-                        // Проверяем, является ли последнее сообщение сообщением с тегом [LOADING]
-                        if (this.isLoadingMessage(lastMessage.text)) {
-                            this.isWaitingForAI = true; // Продолжаем ждать
-                            const sendButton = document.getElementById('send-message-btn');
-                            if (sendButton) {
-                                sendButton.disabled = true;
-                            }
-                        } else {
-                            this.isWaitingForAI = false; // Получен обычный ответ
-                            const sendButton = document.getElementById('send-message-btn');
-                            if (sendButton) {
-                                sendButton.disabled = false;
-                            }
-                        }
-                    }
-                }
-            } else {
-                messagesElement.innerHTML = '<div class="welcome-message"><p>Начните диалог! Введите ваше первое сообщение.</p></div>';
-                this.isWaitingForAI = false;
-                const sendButton = document.getElementById('send-message-btn');
-                if (sendButton) {
-                    sendButton.disabled = false;
-                }
-            }
-            
-            messagesElement.scrollTop = messagesElement.scrollHeight;
+        if (this.messageList) {
+            this.messageList.reset('<div class="welcome-message"><p>Начните диалог! Введите ваше первое сообщение.</p></div>');
+            this.messageList.scrollToBottom();
         }
+        // Состояние ожидания - по последнему сообщению
+        this.updateWaitingState();
 
         const inputElement = document.getElementById('message-input');
         const sendButton = document.getElementById('send-message-btn');
@@ -1067,7 +1207,7 @@ class SingleChat {
         
         // Для сообщений ИИ обновляем содержимое с обработкой тегов
         if (messageData.sender === 'ai') {
-            const processedContent = this.processAllAITags(messageData.text);
+            const processedContent = this.renderAIContent(messageData);
             
             // Находим контейнер содержимого сообщения
             const contentContainer = messageElement.querySelector('.message-content');
@@ -1075,26 +1215,17 @@ class SingleChat {
                 contentContainer.innerHTML = processedContent;
             }
             
-            // Обновляем или добавляем кнопку перегенерации
+            // Обновляем или добавляем кнопку перегенерации (клик обрабатывает список сообщений)
             let regenerateBtn = messageElement.querySelector('.regenerate-btn');
-            if (!regenerateBtn) {
+            if (!regenerateBtn && !this.isLoadingMessage(messageData.text)) {
                 regenerateBtn = document.createElement('button');
                 regenerateBtn.className = 'regenerate-btn';
                 regenerateBtn.textContent = '↻ Перегенерировать';
                 messageElement.appendChild(regenerateBtn);
             }
-            regenerateBtn.dataset.messageId = messageData.id;
-            
-            // Назначаем обработчик события (удаляем старый, если есть)
-            const newHandler = (e) => {
-                e.stopPropagation();
-                this.regenerateMessage(messageData.id);
-            };
-            
-            // Удаляем все предыдущие обработчики
-            const clone = regenerateBtn.cloneNode(true);
-            regenerateBtn.parentNode.replaceChild(clone, regenerateBtn);
-            clone.addEventListener('click', newHandler);
+            if (regenerateBtn) {
+                regenerateBtn.dataset.messageId = messageData.id;
+            }
         } else {
             // Для сообщений пользователя просто обновляем текст
             const textElement = messageElement.querySelector('.text');
@@ -1107,120 +1238,6 @@ class SingleChat {
         this.initCodeCopyButtons();
     }
 
-    // Добавление сообщения в чат БЕЗ анимации
-    addMessageToChatWithoutAnimation(message) {
-        const messagesElement = document.getElementById('chat-messages');
-        if (!messagesElement) return;
-
-        const messageElement = document.createElement('div');
-        messageElement.className = `message ${message.sender === 'user' ? 'user' : 'ai'}`;
-        
-        if (message.id !== undefined) {
-            messageElement.dataset.messageId = message.id;
-        }
-        
-        const senderName = message.sender === 'user' ? 'Вы' : 'ИИ';
-        
-        // Для сообщений ИИ добавляем кнопку перегенерации и обрабатываем теги
-        if (message.sender === 'ai') {
-            // Сначала обрабатываем теги
-            const processedContent = this.processAllAITags(message.text);
-            
-            messageElement.innerHTML = `
-                <div class="sender">${senderName}</div>
-                <div class="message-content">
-                    ${processedContent}
-                </div>
-                <button class="regenerate-btn" data-message-id="${message.id}">↻ Перегенерировать</button>
-            `;
-            
-            // Добавляем обработчик для кнопки перегенерации
-            const regenerateBtn = messageElement.querySelector('.regenerate-btn');
-            if (regenerateBtn) {
-                regenerateBtn.addEventListener('click', (e) => {
-                    e.stopPropagation();
-                    this.regenerateMessage(message.id); 
-                });
-            }
-        } else {
-            messageElement.innerHTML = `
-                <div class="sender">${senderName}</div>
-                <div class="message-content">
-                    <div class="text">${this.escapeHtml(message.text)}</div>
-                </div>
-            `;
-        }
-        
-        messagesElement.appendChild(messageElement);
-        // НЕ прокручиваем здесь, это делается в renderChatWithoutAnimation
-        
-        // Инициализируем обработчики для кнопок копирования кода
-        this.initCodeCopyButtons();
-    }
-
-    renderChatWithoutAnimation() {
-        if (!this.currentChatData) return;
-        
-        const titleElement = document.getElementById('current-chat-title');
-        if (titleElement) {
-            titleElement.textContent = this.currentChatData.title || 'Без названия';
-        }
-        
-        const messagesElement = document.getElementById('chat-messages');
-        if (messagesElement) {
-            // Проверяем, есть ли уже сообщения в UI
-            const existingMessageElements = messagesElement.querySelectorAll('.message');
-            const existingMessageIds = Array.from(existingMessageElements).map(el => parseInt(el.dataset.messageId));
-            
-            // Проверяем сообщения в данных чата
-            if (this.currentChatData.messages && this.currentChatData.messages.length > 0) {
-                this.currentChatData.messages.forEach((message, index) => {
-                    // Проверяем, есть ли уже такое сообщение в UI
-                    const existingElementIndex = existingMessageIds.indexOf(message.id);
-                    
-                    if (existingElementIndex !== -1) {
-                        // Сообщение уже существует - ОБНОВЛЯЕМ его содержимое
-                        const existingElement = existingMessageElements[existingElementIndex];
-                        this.updateMessageContent(existingElement, message);
-                    } else {
-                        // Новое сообщение - ДОБАВЛЯЕМ его
-                        this.addMessageToChatWithoutAnimation(message);
-                    }
-                });
-                
-                // Удаляем сообщения, которые есть в UI, но отсутствуют в новых данных
-                // (на случай, если логика чата предусматривает удаление сообщений)
-                const currentMessageIds = this.currentChatData.messages.map(msg => msg.id);
-                existingMessageElements.forEach(element => {
-                    const elementId = parseInt(element.dataset.messageId);
-                    if (elementId && !currentMessageIds.includes(elementId)) {
-                        element.remove();
-                    }
-                });
-            } else {
-                // Если нет сообщений, показываем приветствие
-                if (existingMessageElements.length === 0) {
-                    messagesElement.innerHTML = '<div class="welcome-message"><p>Начните диалог! Введите ваше первое сообщение.</p></div>';
-                }
-            }
-            
-            // Прокручиваем вниз без анимации
-            messagesElement.scrollTop = messagesElement.scrollHeight;
-        }
-        
-        // Обновляем состояние кнопки отправки
-        const inputElement = document.getElementById('message-input');
-        const sendButton = document.getElementById('send-message-btn');
-        
-        if (inputElement) {
-            inputElement.disabled = false;
-        }
-        
-        if (sendButton) {
-            sendButton.disabled = this.isWaitingForAI;
-        }
-    }
-
     // Очистка чата
     clearChat() {
         this.currentChatId = null;
@@ -1234,9 +1251,8 @@ class SingleChat {
             titleElement.textContent = 'Выберите или создайте чат';
         }
 
-        const messagesElement = document.getElementById('chat-messages');
-        if (messagesElement) {
-            messagesElement.innerHTML = '<div class="welcome-message"><p>Добро пожаловать в чат с ИИ!</p><p>Выберите существующий чат или создайте новый.</p></div>';
+        if (this.messageList) {
+            this.messageList.clear('<div class="welcome-message"><p>Добро пожаловать в чат с ИИ!</p><p>Выберите существующий чат или создайте новый.</p></div>');
         }
 
         const inputElement = document.getElementById('message-input');
@@ -1255,13 +1271,21 @@ class SingleChat {
         this.loadChatsList();
     }
 
-    // Добавление сообщения в чат
+    // Добавление нового сообщения (уже записанного в currentChatData) с анимацией
     addMessageToChat(message) {
-        const messagesElement = document.getElementById('chat-messages');
-        if (!messagesElement) return;
+        if (!this.messageList) return;
+        this.animateIds.add(message.id);
+        this.messageList.scrollToBottom();
+    }
 
+    // Элемент сообщения для списка сообщений
+    createMessageElement(message) {
         const messageElement = document.createElement('div');
         messageElement.className = `message ${message.sender === 'user' ? 'user' : 'ai'}`;
+        // Анимация появления - только у новых сообщений, а не при прокрутке
+        if (!this.animateIds.delete(message.id)) {
+            messageElement.classList.add('no-animation');
+        }
         
         // Убедитесь, что у сообщения есть ID
         if (message.id !== undefined) {
@@ -1272,37 +1296,18 @@ class SingleChat {
         
         // Для сообщений ИИ добавляем кнопку перегенерации и обрабатываем теги
         if (message.sender === 'ai') {
-            // Сначала обрабатываем теги кода
-            const processedContent = this.processAllAITags(message.text);
-            
-            // Проверяем, является ли сообщение сообщением с тегом [LOADING]
-            if (this.isLoadingMessage(message.text)) {
-                // Для сообщений с тегом [LOADING] используем специальную обработку
-                messageElement.innerHTML = `
-                    <div class="sender">${senderName}</div>
-                    <div class="message-content">
-                        ${processedContent}
-                    </div>
-                `;
-            } else {
-                // Для обычных сообщений ИИ добавляем кнопку перегенерации
-                messageElement.innerHTML = `
-                    <div class="sender">${senderName}</div>
-                    <div class="message-content">
-                        ${processedContent}
-                    </div>
-                    <button class="regenerate-btn" data-message-id="${message.id}">↻ Перегенерировать</button>
-                `;
-                
-                // Добавляем обработчик для кнопки перегенерации
-                const regenerateBtn = messageElement.querySelector('.regenerate-btn');
-                if (regenerateBtn) {
-                    regenerateBtn.addEventListener('click', (e) => {
-                        e.stopPropagation();
-                        this.regenerateMessage(message.id); 
-                    });
-                }
-            }
+            const processedContent = this.renderAIContent(message);
+            // У индикатора загрузки [LOADING] кнопки перегенерации нет
+            const regenerateButton = this.isLoadingMessage(message.text)
+                ? ''
+                : `<button class="regenerate-btn" data-message-id="${message.id}">↻ Перегенерировать</button>`;
+            messageElement.innerHTML = `
+                <div class="sender">${senderName}</div>
+                <div class="message-content">
+                    ${processedContent}
+                </div>
+                ${regenerateButton}
+            `;
         } else {
             messageElement.innerHTML = `
                 <div class="sender">${senderName}</div>
@@ -1312,14 +1317,22 @@ class SingleChat {
             `;
         }
         
-        messagesElement.appendChild(messageElement);
-        messagesElement.scrollTop = messagesElement.scrollHeight;
-        
-        // Инициализируем обработчики для кнопок копирования кода
-        this.initCodeCopyButtons();
+        return messageElement;
+    }
+
+    // Режим "auto": сервер выбирает самую быструю из доступных моделей
+    createAutoModelOption(selected) {
+        const option = document.createElement('option');
+        option.value = 'auto';
+        option.textContent = 'Авто (самая быстрая модель)';
+        option.selected = selected;
+        return option;
     }
 
     getModelDisplayName(modelUrl) {
+        if (modelUrl === 'auto') {
+            return 'Авто';
+        }
         // Попытка извлечь название из URL
         try {
             // Если это наш внутренний формат (как в примере: qwen/qwen3-coder:free)
@@ -1347,6 +1360,121 @@ class SingleChat {
         return 'ИИ';
     }
 
+    // HTML сообщения ИИ: по блокам, разобранным сервером, или по тексту для старых сообщений
+    renderAIContent(message) {
+        const text = message.text || '';
+        if (this.isLoadingMessage(text)) {
+            return this.processAllAITags(text);
+        }
+        const cached = this.renderCache.get(message.id);
+        if (!message.streaming && cached && cached.text === text) {
+            return cached.html;
+        }
+        let html;
+        if (Array.isArray(message.blocks)) {
+            html = this.renderBlocks(message);
+        } else if (this.isReasoningOmitted(message)) {
+            // Рассуждения не пришли со страницей - загрузятся при раскрытии
+            html = this.createThoughtsHTML('', message.id) + this.processAllAITags(text);
+        } else {
+            html = this.processAllAITags(text);
+        }
+        if (!message.streaming) {
+            this.renderCache.set(message.id, { text, html });
+        }
+        return html;
+    }
+
+    renderBlocks(message) {
+        let result = '';
+        const thoughts = [];
+        if (message.reasoning) {
+            thoughts.push(message.reasoning);
+        }
+        message.blocks.filter(block => block.type === 'thoughts').forEach(block => thoughts.push(block.content));
+        const omitted = this.isReasoningOmitted(message);
+        if (thoughts.length || omitted) {
+            result += this.createThoughtsHTML(thoughts.join('\n').trim(), omitted ? message.id : null);
+        }
+
+        message.blocks.forEach(block => {
+            if (block.type === 'code') {
+                const code = block.content.replace(/^\s*\n/, '').replace(/\n\s*$/, '\n');
+                result += this.createCodeBlockHTML(block.language || 'text', code);
+            } else if (block.type !== 'thoughts') {
+                const content = block.content.trim();
+                if (content) {
+                    result += `<div class="ai-response">${this.escapeHtml(this.processBoldText(content))}</div>`;
+                }
+            }
+        });
+
+        if (!result.trim()) {
+            result = `<div class="text">${this.escapeHtml(message.answer || message.text || '')}</div>`;
+        }
+        return result;
+    }
+
+    createThoughtsHTML(thoughtsContent, lazyMessageId = null) {
+        // Блок мыслей СВЕРНУТ по умолчанию; рассуждения сообщения lazyMessageId загружаются при раскрытии
+        const lazy = lazyMessageId !== null ? ` data-reasoning-id="${lazyMessageId}"` : '';
+        return `
+                <div class="ai-thoughts-container">
+                    <div class="ai-thoughts-header">
+                        <span class="ai-thoughts-label-main">Мысли ИИ</span>
+                        <button class="ai-thoughts-toggle" aria-label="Развернуть мысли">+</button>
+                    </div>
+                    <div class="ai-thoughts-content collapsed"${lazy}>${this.escapeHtml(thoughtsContent)}
+                    </div>
+                </div>
+            `;
+    }
+
+    isReasoningOmitted(message) {
+        return Array.isArray(message.omitted) && message.omitted.includes('reasoning');
+    }
+
+    // Сворачивание и раскрытие блока мыслей
+    toggleThoughts(header) {
+        const toggleBtn = header.querySelector('.ai-thoughts-toggle');
+        const content = header.nextElementSibling; // .ai-thoughts-content
+        if (!toggleBtn || !content) return;
+
+        content.classList.toggle('collapsed');
+        if (content.classList.contains('collapsed')) {
+            toggleBtn.textContent = '+';
+            toggleBtn.setAttribute('aria-label', 'Развернуть мысли');
+        } else {
+            toggleBtn.textContent = '−';
+            toggleBtn.setAttribute('aria-label', 'Свернуть мысли');
+            if (content.dataset.reasoningId) {
+                this.loadReasoning(content);
+            }
+        }
+    }
+
+    // Рассуждения модели, опущенные при загрузке страницы сообщений
+    async loadReasoning(content) {
+        const messageId = Number(content.dataset.reasoningId);
+        delete content.dataset.reasoningId;
+        const inline = content.textContent.trim();
+        try {
+            let reasoning = this.reasoningCache.get(messageId);
+            if (reasoning === undefined) {
+                content.textContent = 'Загрузка...';
+                const response = await fetch(`/api/chats/${this.currentChatId}/messages/${messageId}`);
+                if (!response.ok) throw new Error('Сообщение не найдено');
+                reasoning = (await response.json()).reasoning || '';
+                this.reasoningCache.set(messageId, reasoning);
+            }
+            content.textContent = [reasoning, inline].filter(Boolean).join('\n').trim();
+        } catch (error) {
+            console.error('Ошибка загрузки рассуждений:', error);
+            content.textContent = inline;
+            content.dataset.reasoningId = messageId;
+        }
+    }
+
     processAllAITags(text) {
         let result = '';
         
@@ -1381,17 +1509,7 @@ class SingleChat {
         const thoughtsMatch = thoughtsRegex.exec(text);
         if (thoughtsMatch) {
             const thoughtsContent = thoughtsMatch[1].trim();
-            // Создаем СВЕРНУТЫЙ блок мыслей
-            thoughtsHtml = `
-                <div class="ai-thoughts-container">
-                    <div class="ai-thoughts-header">
-                        <span class="ai-thoughts-label-main">Мысли ИИ</span>
-                        <button class="ai-thoughts-toggle" aria-label="Развернуть мысли">+</button>
-                    </div>
-                    <div class="ai-thoughts-content collapsed">${this.escapeHtml(thoughtsContent)}
-                    </div>
-                </div>
-            `;
+            thoughtsHtml = this.createThoughtsHTML(thoughtsContent);
             // Удаляем обработанный тег из текста
             text = text.replace(thoughtsMatch[0], '');
         }
@@ -1616,9 +1734,6 @@ class SingleChat {
             timestamp: new Date().toISOString()
         };
 
-        // Добавляем сообщение в UI
-        this.addMessageToChat(userMessage);
-        
         // Очищаем поле ввода и сбрасываем размер
         inputElement.value = '';
         this.autoResizeTextarea.call(inputElement);
@@ -1630,12 +1745,13 @@ class SingleChat {
             sendButton.disabled = true;
         }
 
-        // Добавляем сообщение в данные чата И СРАЗУ СОХРАНЯЕМ
+        // Добавляем сообщение в данные чата и UI И СРАЗУ СОХРАНЯЕМ
         if (!this.currentChatData.messages) {
             this.currentChatData.messages = [];
         }
         this.currentChatData.messages.push(userMessage);
-        await this.saveChat();
+        this.addMessageToChat(userMessage);
+        await this.saveMessage(userMessage);
 
         try {
             // Отправляем сообщение ИИ через API
@@ -1658,14 +1774,17 @@ class SingleChat {
                 timestamp: new Date().toISOString()
             };
             
-            this.addMessageToChat(errorMessage);
             this.currentChatData.messages.push(errorMessage);
-            await this.saveChat();
+            this.addMessageToChat(errorMessage);
+            await this.saveMessage(errorMessage);
         }
     }
 
     // Интенсивная проверка обновлений (для быстрого получения ответа от ИИ)
     startIntensivePolling() {
+        // При активном потоке событий ответ придет сам, опрос не нужен
+        if (this.eventSource) return;
+
         // Останавливаем обычный polling
         this.stopPolling();
         
@@ -1712,20 +1831,22 @@ class SingleChat {
     }
 
     // Отправка сообщения ИИ через API
-    async sendToAI(userMessage) {
+    async sendToAI(userMessage, options = {}) {
         if (!this.currentChatId) {
             throw new Error('Нет активного чата');
         }
 
         try {
-            // 1. Создаем файл request.json
+            // 1. Ставим запрос в очередь обработки
             const response = await fetch('/api/create_request', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    chat: `${this.currentChatId}.json`
+                    chat: `${this.currentChatId}.json`,
+                    // При перегенерации ответ не берется из кэша сервера
+                    no_cache: Boolean(options.noCache)
                 })
             });
 
@@ -1734,10 +1855,7 @@ class SingleChat {
                 throw new Error(errorData.error || 'Ошибка создания запроса');
             }
 
-            // 2. Ждем завершения обработки (опрашиваем чат на наличие нового сообщения от ИИ)
-            // Пока просто ждем несколько секунд, в реальной реализации можно сделать более умную проверку
-            await new Promise(resolve => setTimeout(resolve, 3000));
-            
+            // 2. Ответ придет через поток событий чата (или обычный опрос, если поток недоступен)
             console.log('Запрос отправлен ИИ через локальный API');
             
         } catch (error) {
@@ -1746,27 +1864,44 @@ class SingleChat {
         }
     }
 
-    // Сохранение чата
-    async saveChat() {
-        if (!this.currentChatId || !this.currentChatData) return;
+    // Сохранение одного сообщения: клиент держит только последние страницы чата,
+    // поэтому чат целиком не пересылается
+    async saveMessage(message) {
+        if (!this.currentChatId) return;
 
         try {
-            const response = await fetch(`/api/chats/${this.currentChatId}`, {
-                method: 'PUT',
+            const response = await fetch(`/api/chats/${this.currentChatId}/messages`, {
+                method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify(this.currentChatData)
+                body: JSON.stringify(message)
             });
             
             if (!response.ok) {
-                console.error('Ошибка сохранения чата');
+                console.error('Ошибка сохранения сообщения');
             }
         } catch (error) {
             console.error('Ошибка подключения при сохранении:', error);
         }
     }
 
+    async deleteMessage(messageId) {
+        if (!this.currentChatId) return;
+
+        try {
+            const response = await fetch(`/api/chats/${this.currentChatId}/messages/${messageId}`, {
+                method: 'DELETE'
+            });
+            
+            if (!response.ok) {
+                console.error('Ошибка удаления сообщения');
+            }
+        } catch (error) {
+            console.error('Ошибка подключения при удалении:', error);
+        }
+    }
+
     // Автоматическое изменение размера textarea
     autoResizeTextarea() {
         this.style.height = 'auto';
@@ -1887,19 +2022,11 @@ class SingleChat {
             this.currentChatData.messages.splice(messageIndex, 1);
             
             // Обновляем UI - удаляем элемент сообщения
-            const messagesContainer = document.getElementById('chat-messages');
-            if (messagesContainer) {
-                const messageElements = messagesContainer.querySelectorAll('.message');
-                messageElements.forEach(element => {
-                    const elementMessageId = parseInt(element.dataset.messageId);
-                    if (elementMessageId === messageToRemove.id) {
-                        element.remove();
-                    }
-                });
-            }
+            this.messageList.forget(messageToRemove.id);
+            this.messageList.render();
             
-            // Сохраняем обновленный чат
-            await this.saveChat();
+            // Удаляем сообщение на сервере
+            await this.deleteMessage(messageToRemove.id);
             
             // Блокируем интерфейс
             this.isWaitingForAI = true;
@@ -1921,7 +2048,7 @@ class SingleChat {
                 
                 if (lastUserMessage) {
                     // Отправляем сообщение ИИ
-                    await this.sendToAI(lastUserMessage.text);
+                    await this.sendToAI(lastUserMessage.text, { noCache: true });
                     
                     // Запускаем интенсивную проверку обновлений
                     this.startIntensivePolling();
@@ -1961,8 +2088,16 @@ class SingleChat {
                 throw new Error('Неверный индекс сообщения для создания нового чата');
             }
             
-            // Получаем историю до указанного сообщения
-            const history = this.currentChatData.messages.slice(0, messageIndex);
+            // Получаем историю до указанного сообщения: у клиента только последние
+            // страницы и без рассуждений, поэтому берем чат с сервера целиком
+            const messageId = this.currentChatData.messages[messageIndex].id;
+            const chatResponse = await fetch(`/api/chats/${this.currentChatId}`);
+            if (!chatResponse.ok) {
+                throw new Error('Не удалось загрузить историю чата');
+            }
+            const fullMessages = (await chatResponse.json()).messages || [];
+            const fullIndex = fullMessages.findIndex(msg => msg.id === messageId);
+            const history = fullMessages.slice(0, fullIndex === -1 ? fullMessages.length : fullIndex);
             
             // Генерируем название для нового чата
             let chatTitle = 'Перегенерация: ';
@@ -2017,7 +2152,7 @@ class SingleChat {
                     
                     if (lastUserMessage) {
                         // Отправляем сообщение ИИ
-                        await this.sendToAI(lastUserMessage.text);
+                        await this.sendToAI(lastUserMessage.text, { noCache: true });
                         
                         // Запускаем интенсивную проверку обновлений
                         this.startIntensivePolling();
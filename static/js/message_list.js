@@ -0,0 +1,297 @@
+// Виртуальный список сообщений чата.
+//
+// В DOM находятся только сообщения в видимой области и overscan пикселей
+// над и под ней; место остальных занимают два распорки (spacer) с их
+// суммарной высотой. Высоты сообщений измеряются после отрисовки и
+// запоминаются по id, для еще не показанных берется средняя.
+//
+// Источник данных - функция getMessages(): список перерисовывается через
+// render() после изменения массива сообщений, а одно изменившееся
+// сообщение обновляется через update(id) без пересоздания остальных.
+class MessageList {
+    constructor(container, options) {
+        this.container = container;
+        this.getMessages = options.getMessages;
+        // createElement(message) -> новый элемент сообщения
+        this.createElement = options.createElement;
+        // patchElement(element, message) - обновление содержимого элемента
+        this.patchElement = options.patchElement;
+        this.onRendered = options.onRendered || (() => {});
+        this.overscan = options.overscan || 800;
+        this.emptyHTML = '';
+
+        this.heights = new Map();
+        this.elements = new Map();
+        this.measuredTotal = 0;
+        this.measuredCount = 0;
+        this.topSpacer = null;
+        this.bottomSpacer = null;
+        this.frame = null;
+        this.ignoreScroll = false;
+
+        this.container.addEventListener('scroll', () => {
+            if (!this.ignoreScroll) {
+                this.scheduleRender();
+            }
+        });
+        window.addEventListener('resize', () => {
+            // Ширина изменилась - сохраненные высоты больше не верны
+            this.heights.clear();
+            this.measuredTotal = 0;
+            this.measuredCount = 0;
+            this.scheduleRender();
+        });
+    }
+
+    // Новый чат: сброс элементов и высот
+    reset(emptyHTML = '') {
+        this.emptyHTML = emptyHTML;
+        this.heights.clear();
+        this.elements.clear();
+        this.measuredTotal = 0;
+        this.measuredCount = 0;
+        this.topSpacer = null;
+        this.bottomSpacer = null;
+        this.container.innerHTML = '';
+    }
+
+    // Пустой список с сообщением-заглушкой (например, когда чат не выбран)
+    clear(emptyHTML) {
+        this.reset(emptyHTML);
+        this.container.innerHTML = emptyHTML;
+    }
+
+    scheduleRender() {
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    isAtBottom() {
+        const c = this.container;
+        return c.scrollHeight - c.scrollTop - c.clientHeight < 50;
+    }
+
+    estimate() {
+        return this.measuredCount ? this.measuredTotal / this.measuredCount : 120;
+    }
+
+    heightOf(id) {
+        const height = this.heights.get(id);
+        return height === undefined ? this.estimate() : height;
+    }
+
+    measure(id, element) {
+        const style = getComputedStyle(element);
+        const height = element.offsetHeight + (parseFloat(style.marginTop) || 0) + (parseFloat(style.marginBottom) || 0);
+        const previous = this.heights.get(id);
+        if (previous !== undefined) {
+            this.measuredTotal -= previous;
+            this.measuredCount--;
+        }
+        this.heights.set(id, height);
+        this.measuredTotal += height;
+        this.measuredCount++;
+        return previous !== height;
+    }
+
+    forget(id) {
+        const height = this.heights.get(id);
+        if (height !== undefined) {
+            this.heights.delete(id);
+            this.measuredTotal -= height;
+            this.measuredCount--;
+        }
+    }
+
+    elementFor(id) {
+        return this.elements.get(id) || null;
+    }
+
+    // Перерисовка одного сообщения, если оно сейчас в DOM
+    update(id) {
+        const element = this.elements.get(id);
+        if (!element) {
+            // Сообщение вне видимой области: высоту измерим, когда оно появится
+            this.forget(id);
+            return;
+        }
+        const message = this.getMessages().find(msg => msg.id === id);
+        if (!message) return;
+        const atBottom = this.isAtBottom();
+        // Положение видимых сообщений запоминается до изменения высоты
+        const anchor = atBottom ? null : this.findAnchor();
+        this.patchElement(element, message);
+        if (this.measure(id, element)) {
+            this.render({ stickToBottom: atBottom, anchor });
+        }
+    }
+
+    scrollToBottom() {
+        this.render({ stickToBottom: true });
+    }
+
+    // Сдвиг элемента от верха видимой области
+    offsetInView(element) {
+        return element.getBoundingClientRect().top - this.container.getBoundingClientRect().top;
+    }
+
+    // Первое сообщение, видимое хотя бы частично, и его сдвиг от верха области
+    findAnchor() {
+        for (const element of this.container.children) {
+            if (!element.dataset.messageId) continue;
+            const delta = this.offsetInView(element);
+            if (delta + element.offsetHeight > 0) {
+                return { element, delta };
+            }
+        }
+        return null;
+    }
+
+    render(options = {}) {
+        const messages = this.getMessages();
+        const c = this.container;
+
+        if (!messages.length) {
+            this.elements.clear();
+            this.topSpacer = null;
+            this.bottomSpacer = null;
+            c.innerHTML = this.emptyHTML;
+            return;
+        }
+
+        if (!this.topSpacer || this.topSpacer.parentNode !== c) {
+            c.innerHTML = '';
+            this.elements.clear();
+            this.topSpacer = this.createSpacer();
+            this.bottomSpacer = this.createSpacer();
+            c.appendChild(this.topSpacer);
+            c.appendChild(this.bottomSpacer);
+        }
+
+        const stickToBottom = options.stickToBottom || false;
+        const anchor = stickToBottom ? null : (options.anchor || this.findAnchor());
+        const anchorMessage = anchor
+            ? messages.find(msg => String(msg.id) === anchor.element.dataset.messageId)
+            : null;
+
+        // Несколько проходов: после измерения новых сообщений диапазон может сдвинуться
+        let first = 0;
+        let last = 0;
+        for (let pass = 0; pass < 3; pass++) {
+            const tops = new Array(messages.length + 1);
+            tops[0] = 0;
+            let anchorTop = null;
+            for (let i = 0; i < messages.length; i++) {
+                if (messages[i] === anchorMessage) {
+                    anchorTop = tops[i];
+                }
+                tops[i + 1] = tops[i] + this.heightOf(messages[i].id);
+            }
+            const total = tops[messages.length];
+
+            let viewTop;
+            if (stickToBottom) {
+                viewTop = Math.max(0, total - c.clientHeight);
+            } else if (anchorTop !== null) {
+                viewTop = anchorTop - anchor.delta;
+            } else {
+                viewTop = c.scrollTop - this.padding();
+            }
+            first = Math.max(0, this.upperBound(tops, viewTop - this.overscan) - 1);
+            last = Math.min(messages.length - 1, this.upperBound(tops, viewTop + c.clientHeight + this.overscan));
+            if (!this.syncRange(messages, first, last)) break;
+        }
+        this.updateSpacers(messages, first, last);
+
+        this.ignoreScroll = true;
+        if (stickToBottom) {
+            c.scrollTop = c.scrollHeight;
+        } else if (anchorMessage && this.elements.has(anchorMessage.id)) {
+            // Сообщение, бывшее вверху области, остается на том же месте
+            c.scrollTop += this.offsetInView(this.elements.get(anchorMessage.id)) - anchor.delta;
+        }
+        requestAnimationFrame(() => {
+            this.ignoreScroll = false;
+        });
+        this.onRendered();
+    }
+
+    padding() {
+        return parseFloat(getComputedStyle(this.container).paddingTop) || 0;
+    }
+
+    // Индекс сообщения, на которое приходится offset
+    upperBound(tops, offset) {
+        let lo = 0;
+        let hi = tops.length - 1;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (tops[mid + 1] <= offset) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo;
+    }
+
+    updateSpacers(messages, first, last) {
+        let above = 0;
+        for (let i = 0; i < first; i++) {
+            above += this.heightOf(messages[i].id);
+        }
+        let below = 0;
+        for (let i = last + 1; i < messages.length; i++) {
+            below += this.heightOf(messages[i].id);
+        }
+        this.topSpacer.style.height = `${above}px`;
+        this.bottomSpacer.style.height = `${below}px`;
+    }
+
+    // Оставляет в DOM сообщения first..last; true, если измерены новые высоты
+    syncRange(messages, first, last) {
+        const visible = new Set();
+        for (let i = first; i <= last; i++) {
+            visible.add(messages[i].id);
+        }
+        for (const [id, element] of this.elements) {
+            if (!visible.has(id)) {
+                element.remove();
+                this.elements.delete(id);
+            }
+        }
+
+        const created = [];
+        let cursor = this.topSpacer;
+        for (let i = first; i <= last; i++) {
+            const message = messages[i];
+            let element = this.elements.get(message.id);
+            if (!element) {
+                element = this.createElement(message);
+                this.elements.set(message.id, element);
+                created.push(message.id);
+            }
+            if (cursor.nextSibling !== element) {
+                this.container.insertBefore(element, cursor.nextSibling);
+            }
+            cursor = element;
+        }
+        // Измеряем после вставки всех элементов - одна перекладка страницы, а не по одной на сообщение
+        let changed = false;
+        created.forEach(id => {
+            if (this.measure(id, this.elements.get(id))) {
+                changed = true;
+            }
+        });
+        return changed;
+    }
+
+    createSpacer() {
+        const spacer = document.createElement('div');
+        spacer.className = 'messages-spacer';
+        return spacer;
+    }
+}